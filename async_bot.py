@@ -0,0 +1,466 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Asyncio-режим бота: все обработчики — корутины, запросы к OpenAI идут через
+# AsyncOpenAI, поэтому один процесс обслуживает сотни разговоров одновременно
+# вместо пяти рабочих потоков TeleBot. Включается через BOT_MODE=async.
+
+import os
+import asyncio
+import logging
+import time
+import threading
+from functools import wraps
+from telebot.async_telebot import AsyncTeleBot
+from openai_helper import (
+    generate_ai_response_async,
+    generate_ai_response_stream_async,
+    analyze_image_async,
+    analyze_video_async,
+    analyze_video_detailed_async,
+    transcribe_audio_async,
+)
+from conversation_handler import get_conversation_history, add_to_conversation, clear_conversation
+from user_preferences import update_user_preferences
+import response_cache
+import media_cache
+import media_worker
+import media_download
+from image_preprocessing import choose_photo_size, record_download_savings
+from bot_messages import (
+    WELCOME_TEMPLATE,
+    HELP_TEXT,
+    CLEAR_TEXT,
+    PHOTO_ERROR_TEXT,
+    VIDEO_ERROR_TEXT,
+    VOICE_ERROR_TEXT,
+    VIDEO_NOTE_ERROR_TEXT,
+    VOICE_NOT_RECOGNIZED_TEXT,
+    TEXT_ERROR_TEXT,
+    MEDIA_TOO_LARGE_TEXT,
+    VIDEO_NOTE_PROMPT,
+    build_start_markup,
+    build_help_markup,
+    build_video_prompt,
+)
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+
+# Максимальное число одновременно обрабатываемых тяжелых обновлений (запросы к OpenAI)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "200"))
+
+# Потоковая отправка ответов (те же настройки, что и в bot.py)
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "1") != "0"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+TEMP_DIR = "temp_media"
+os.makedirs(TEMP_DIR, exist_ok=True)
+
+bot = AsyncTeleBot(TELEGRAM_TOKEN)
+
+# Created lazily inside the running loop
+_update_semaphore = None
+
+# Функция, возвращающая текст для /status (передается из bot.py)
+_status_provider = None
+
+# Simple counters for monitoring the async pipeline
+stats = {
+    "in_flight": 0,
+    "peak_in_flight": 0,
+    "completed": 0,
+}
+
+def _get_semaphore():
+    global _update_semaphore
+    if _update_semaphore is None:
+        _update_semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPDATES)
+    return _update_semaphore
+
+def limited(handler):
+    """
+    Run a handler coroutine under the global concurrency cap.
+
+    Updates above MAX_CONCURRENT_UPDATES wait on the semaphore instead of
+    opening more OpenAI connections.
+    """
+    @wraps(handler)
+    async def wrapper(message):
+        async with _get_semaphore():
+            stats["in_flight"] += 1
+            stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+            try:
+                return await handler(message)
+            finally:
+                stats["in_flight"] -= 1
+                stats["completed"] += 1
+    return wrapper
+
+async def download_to_temp(file_id, filename):
+    """
+    Stream a Telegram file into TEMP_DIR.
+
+    Args:
+        file_id (str): Telegram file id
+        filename (str): Name of the file inside TEMP_DIR
+
+    Returns:
+        str: Path of the downloaded file
+    """
+    file_info = await bot.get_file(file_id)
+    return await _download(file_info, os.path.join(TEMP_DIR, filename))
+
+async def download_bytes(file_id):
+    """
+    Download a Telegram file into memory.
+
+    Args:
+        file_id (str): Telegram file id
+
+    Returns:
+        bytes: File contents
+    """
+    file_info = await bot.get_file(file_id)
+    return await _download(file_info)
+
+async def _download(file_info, destination=None):
+    # Скачивание идет в отдельном потоке; если задачу отменили, поток тоже останавливается
+    cancel_event = threading.Event()
+    try:
+        return await asyncio.to_thread(
+            media_download.download, TELEGRAM_TOKEN, file_info, destination, cancel_event=cancel_event
+        )
+    except asyncio.CancelledError:
+        cancel_event.set()
+        raise
+
+def _remove_files(*paths):
+    for path in paths:
+        try:
+            if path and os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            logger.error(f"Error cleaning up file {path}: {str(e)}")
+
+async def send_streaming_response(chat_id, fragments, prefix=""):
+    """
+    Deliver a streamed response by sending a message and progressively editing it.
+
+    Args:
+        chat_id: Telegram chat to answer in
+        fragments: Async iterator of text fragments
+        prefix (str): Text shown before the response (e.g. the voice transcription)
+
+    Returns:
+        str: The full response without the prefix
+    """
+    parts = []
+    sent_message = None
+    shown_text = ""
+    last_edit = 0.0
+
+    async for fragment in fragments:
+        parts.append(fragment)
+        now = time.monotonic()
+        if sent_message is not None and now - last_edit < STREAM_EDIT_INTERVAL:
+            continue
+
+        text = (prefix + "".join(parts))[:TELEGRAM_MESSAGE_LIMIT]
+        if sent_message is None:
+            sent_message = await bot.send_message(chat_id, text)
+        elif text != shown_text:
+            await _edit_streamed_message(chat_id, sent_message.message_id, text)
+        shown_text = text
+        last_edit = now
+
+    response = "".join(parts)
+    full_text = prefix + response
+    if sent_message is None:
+        if full_text:
+            await bot.send_message(chat_id, full_text)
+        return response
+
+    final_text = full_text[:TELEGRAM_MESSAGE_LIMIT]
+    if final_text != shown_text:
+        await _edit_streamed_message(chat_id, sent_message.message_id, final_text)
+    for i in range(TELEGRAM_MESSAGE_LIMIT, len(full_text), TELEGRAM_MESSAGE_LIMIT):
+        await bot.send_message(chat_id, full_text[i:i + TELEGRAM_MESSAGE_LIMIT])
+
+    return response
+
+async def _edit_streamed_message(chat_id, message_id, text):
+    try:
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+    except Exception as e:
+        logger.warning(f"Error editing streamed message: {str(e)}")
+
+@bot.message_handler(commands=["start"])
+async def start_command(message):
+    """Send a message when the command /start is issued."""
+    await bot.send_message(
+        message.chat.id,
+        WELCOME_TEMPLATE.format(first_name=message.from_user.first_name),
+        reply_markup=build_start_markup(),
+        parse_mode="HTML"
+    )
+
+@bot.message_handler(commands=["help"])
+async def help_command(message):
+    """Send a message when the command /help is issued."""
+    await bot.send_message(message.chat.id, HELP_TEXT, reply_markup=build_help_markup())
+
+@bot.message_handler(commands=["clear"])
+async def clear_command(message):
+    """Clear conversation history when the command /clear is issued."""
+    clear_conversation(message.from_user.id)
+    await bot.send_message(message.chat.id, CLEAR_TEXT)
+
+@bot.message_handler(commands=["status"])
+async def status_command(message):
+    """Send status information to the administrator."""
+    if _status_provider is None:
+        return
+    status_msg = await asyncio.to_thread(_status_provider)
+    status_msg += (
+        f"🔀 *Async-запросов в обработке*: {stats['in_flight']} "
+        f"(пик {stats['peak_in_flight']}, лимит {MAX_CONCURRENT_UPDATES})\n"
+    )
+    await bot.send_message(message.chat.id, status_msg, parse_mode="Markdown")
+
+@bot.message_handler(content_types=['photo'])
+@limited
+async def handle_photo(message):
+    """Process and respond to photos sent by users."""
+    user_id = message.from_user.id
+
+    try:
+        await bot.send_chat_action(message.chat.id, "typing")
+
+        caption = message.caption or ""
+        if caption:
+            await asyncio.to_thread(update_user_preferences, user_id, caption)
+
+        photo = choose_photo_size(message.photo)
+        custom_prompt = f"Опиши, что ты видишь на этом изображении. {caption}" if caption else None
+        cache_key = media_cache.make_key("photo", photo.file_unique_id, custom_prompt)
+        analysis = await asyncio.to_thread(media_cache.get, cache_key)
+        if analysis is None:
+            photo_bytes = await download_bytes(photo.file_id)
+            record_download_savings(message.photo[-1].file_size, len(photo_bytes))
+            analysis = await analyze_image_async(photo_bytes, custom_prompt)
+            await asyncio.to_thread(media_cache.put, cache_key, analysis)
+
+        image_desc = f"[Пользователь отправил фотографию{': ' + caption if caption else ''}]"
+        await asyncio.to_thread(add_to_conversation, user_id, "user", image_desc)
+        await asyncio.to_thread(add_to_conversation, user_id, "assistant", analysis)
+
+        await bot.send_message(message.chat.id, analysis)
+
+    except Exception as e:
+        logger.error(f"Error processing photo: {str(e)}")
+        await bot.send_message(message.chat.id, PHOTO_ERROR_TEXT)
+
+@bot.message_handler(content_types=['video'])
+@limited
+async def handle_video(message):
+    """Process and respond to videos sent by users."""
+    user_id = message.from_user.id
+    video_path = None
+    thumbnail = None
+
+    try:
+        await bot.send_chat_action(message.chat.id, "typing")
+
+        caption = message.caption or ""
+        if caption:
+            await asyncio.to_thread(update_user_preferences, user_id, caption)
+
+        custom_prompt = build_video_prompt(caption)
+        cache_key = media_cache.make_key("video", message.video.file_unique_id, custom_prompt)
+        analysis = await asyncio.to_thread(media_cache.get, cache_key)
+
+        if analysis is None:
+            try:
+                media_worker.check_limits(message.video.file_size, message.video.duration)
+                video_path = await download_to_temp(message.video.file_id, f"video_{user_id}_{int(time.time())}.mp4")
+            except Exception as e:
+                logger.error(f"Error downloading video: {str(e)}")
+
+            try:
+                if message.video.thumbnail:
+                    thumbnail = await download_bytes(message.video.thumbnail.file_id)
+            except Exception as e:
+                logger.error(f"Error downloading thumbnail: {str(e)}")
+
+            await bot.send_chat_action(message.chat.id, "typing")
+
+            if video_path:
+                result = await analyze_video_detailed_async(video_path, thumbnail, custom_prompt, True, 5, message.video.duration)
+                analysis = result["analysis"]
+                # Ответ по одному превью (ffmpeg не извлек кадры) или сообщение об ошибке не кэшируется
+                if result["from_frames"]:
+                    await asyncio.to_thread(media_cache.put, cache_key, analysis)
+            elif thumbnail:
+                logger.warning("Using thumbnail-only analysis due to video download failure")
+                if not custom_prompt:
+                    custom_prompt = "Это кадр из видео. Опиши, что ты видишь, и предположи, о чем может быть это видео."
+                analysis = await analyze_video_async(None, thumbnail, custom_prompt, False, 1)
+            else:
+                raise Exception("Failed to download both video and thumbnail")
+
+        video_desc = f"[Пользователь отправил видео{': ' + caption if caption else ''}]"
+        await asyncio.to_thread(add_to_conversation, user_id, "user", video_desc)
+        await asyncio.to_thread(add_to_conversation, user_id, "assistant", analysis)
+
+        await bot.send_message(message.chat.id, analysis)
+
+    except Exception as e:
+        logger.error(f"Error processing video: {str(e)}")
+        await bot.send_message(message.chat.id, VIDEO_ERROR_TEXT)
+    finally:
+        _remove_files(video_path)
+
+@bot.message_handler(content_types=['voice'])
+@limited
+async def handle_voice(message):
+    """Process and respond to voice messages sent by users."""
+    user_id = message.from_user.id
+
+    try:
+        await bot.send_chat_action(message.chat.id, "typing")
+
+        caption = message.caption or ""
+        if caption:
+            await asyncio.to_thread(update_user_preferences, user_id, caption)
+
+        media_worker.check_limits(message.voice.file_size, message.voice.duration)
+        voice_bytes = await download_bytes(message.voice.file_id)
+        custom_prompt = f"Контекст от пользователя: {caption}" if caption else None
+
+        await bot.send_chat_action(message.chat.id, "typing")
+        result = await transcribe_audio_async(voice_bytes, custom_prompt, "voice.ogg")
+        transcription = result["transcription"]
+        response_prefix = result["response"]
+
+        if transcription:
+            voice_desc = f"[Голосовое сообщение: \"{transcription}\"{' | ' + caption if caption else ''}]"
+            await asyncio.to_thread(add_to_conversation, user_id, "user", voice_desc)
+            conversation = get_conversation_history(user_id)
+
+            await bot.send_chat_action(message.chat.id, "typing")
+            if STREAM_RESPONSES:
+                ai_response = await send_streaming_response(
+                    message.chat.id, generate_ai_response_stream_async(conversation, user_id), response_prefix
+                )
+            else:
+                ai_response = await generate_ai_response_async(conversation, user_id)
+                full_response = f"{response_prefix}{ai_response}" if response_prefix else ai_response
+                await bot.send_message(message.chat.id, full_response)
+            await asyncio.to_thread(add_to_conversation, user_id, "assistant", ai_response)
+        else:
+            await bot.send_message(message.chat.id, VOICE_NOT_RECOGNIZED_TEXT)
+
+    except media_worker.MediaTooLargeError as e:
+        logger.warning(f"Rejected voice message: {str(e)}")
+        await bot.send_message(message.chat.id, MEDIA_TOO_LARGE_TEXT)
+    except Exception as e:
+        logger.error(f"Error processing voice message: {str(e)}")
+        await bot.send_message(message.chat.id, VOICE_ERROR_TEXT)
+
+@bot.message_handler(content_types=['video_note'])
+@limited
+async def handle_video_note(message):
+    """Process and respond to video notes (circular videos) sent by users."""
+    user_id = message.from_user.id
+    video_path = None
+
+    try:
+        await bot.send_chat_action(message.chat.id, "typing")
+
+        cache_key = media_cache.make_key("video_note", message.video_note.file_unique_id, VIDEO_NOTE_PROMPT)
+        analysis = await asyncio.to_thread(media_cache.get, cache_key)
+        if analysis is None:
+            media_worker.check_limits(message.video_note.file_size, message.video_note.duration)
+            video_path = await download_to_temp(message.video_note.file_id, f"video_note_{user_id}_{int(time.time())}.mp4")
+            result = await analyze_video_detailed_async(video_path, None, VIDEO_NOTE_PROMPT, True, 5, message.video_note.duration)
+            analysis = result["analysis"]
+            # Ответ по одному превью (ffmpeg не извлек кадры) или сообщение об ошибке не кэшируется
+            if result["from_frames"]:
+                await asyncio.to_thread(media_cache.put, cache_key, analysis)
+
+        await asyncio.to_thread(add_to_conversation, user_id, "user", "[Пользователь отправил круговое видео]")
+        await asyncio.to_thread(add_to_conversation, user_id, "assistant", analysis)
+
+        await bot.send_message(message.chat.id, analysis)
+
+    except media_worker.MediaTooLargeError as e:
+        logger.warning(f"Rejected video note: {str(e)}")
+        await bot.send_message(message.chat.id, MEDIA_TOO_LARGE_TEXT)
+    except Exception as e:
+        logger.error(f"Error processing video note: {str(e)}")
+        await bot.send_message(message.chat.id, VIDEO_NOTE_ERROR_TEXT)
+    finally:
+        _remove_files(video_path)
+
+@bot.message_handler(content_types=['text'])
+@limited
+async def handle_message(message):
+    """Handle user text messages and generate AI responses."""
+    user_id = message.from_user.id
+    message_text = message.text
+
+    await asyncio.to_thread(add_to_conversation, user_id, "user", message_text)
+    await asyncio.to_thread(update_user_preferences, user_id, message_text)
+    conversation = get_conversation_history(user_id)
+
+    try:
+        cached_response = await asyncio.to_thread(response_cache.lookup, conversation, user_id)
+        if cached_response is not None:
+            await bot.send_message(message.chat.id, cached_response)
+            await asyncio.to_thread(add_to_conversation, user_id, "assistant", cached_response)
+            return
+
+        await bot.send_chat_action(message.chat.id, "typing")
+        if STREAM_RESPONSES:
+            ai_response = await send_streaming_response(message.chat.id, generate_ai_response_stream_async(conversation, user_id))
+        else:
+            ai_response = await generate_ai_response_async(conversation, user_id)
+            await bot.send_message(message.chat.id, ai_response)
+        await asyncio.to_thread(add_to_conversation, user_id, "assistant", ai_response)
+
+    except Exception as e:
+        logger.error(f"Error generating response: {str(e)}")
+        await bot.send_message(message.chat.id, TEXT_ERROR_TEXT)
+
+@bot.callback_query_handler(func=lambda call: True)
+async def handle_callback(call):
+    """Handle inline keyboard button callbacks."""
+    await bot.answer_callback_query(call.id)
+
+    if call.data == "help":
+        await bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=HELP_TEXT,
+            reply_markup=build_help_markup()
+        )
+
+    elif call.data == "clear_chat":
+        clear_conversation(call.from_user.id)
+        await bot.send_message(call.message.chat.id, CLEAR_TEXT)
+
+def run(status_provider=None):
+    """
+    Start the asyncio bot. Blocks until polling stops.
+
+    Args:
+        status_provider (callable, optional): Returns the /status text shared with the threaded bot
+    """
+    global _status_provider
+    _status_provider = status_provider
+
+    logger.info(f"Starting asyncio bot (max {MAX_CONCURRENT_UPDATES} concurrent updates)...")
+    asyncio.run(bot.infinity_polling(timeout=60, request_timeout=90))
@@ -1,38 +1,64 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import time
+
+# Момент начала импорта, чтобы измерить время холодного старта
+_IMPORT_STARTED = time.perf_counter()
+
 import os
+import sys
+import shutil  # Для получения информации о диске
 import logging
-import telebot
-from telebot import types
-from dotenv import load_dotenv
 import threading
 import tempfile
-import time
-import requests
-import sys
 import traceback
+import functools
 from datetime import datetime
-import telebot
-from googlesearch import search
-from bs4 import BeautifulSoup
 import requests
-from openai_helper import generate_ai_response, analyze_image, analyze_video
+import telebot
+from dotenv import load_dotenv
+
+# Load environment variables before the modules that read them at import time
+load_dotenv()
+
+from openai_helper import generate_ai_response, generate_ai_response_stream, analyze_image, analyze_video, analyze_video_detailed, get_streaming_stats
 from conversation_handler import get_conversation_history, add_to_conversation, clear_conversation
 from user_preferences import update_user_preferences
+from prompt_builder import get_prompt_cache_stats
+from knowledge_base import get_retrieval_stats
+from llm_providers import get_provider_stats
+from resilience import get_resilience_stats
+from rate_limiter import get_rate_limiter_stats
 from keep_alive import keep_alive
-from g4f.client import Client
-
-client = Client()
-response = client.chat.completions.create(
-    model="gpt-4o-mini",
-    messages=[{"role": "user", "content": "Hello"}],
-    web_search=False
+import update_queue
+import scheduler
+import response_cache
+import media_cache
+import media_worker
+import media_download
+from video_frames import get_frame_stats
+from image_preprocessing import choose_photo_size, record_download_savings, get_image_stats
+from bot_messages import (
+    WELCOME_TEMPLATE,
+    HELP_TEXT,
+    CLEAR_TEXT,
+    PHOTO_ERROR_TEXT,
+    VIDEO_ERROR_TEXT,
+    VOICE_ERROR_TEXT,
+    VIDEO_NOTE_ERROR_TEXT,
+    VOICE_NOT_RECOGNIZED_TEXT,
+    TEXT_ERROR_TEXT,
+    BUSY_TEXT,
+    MEDIA_TOO_LARGE_TEXT,
+    VIDEO_NOTE_PROMPT,
+    build_start_markup,
+    build_help_markup,
+    build_video_prompt,
 )
-print(response.choices[0].message.content)
 
-# Load environment variables
-load_dotenv()
+# Время импорта модулей (без сетевых запросов: клиенты создаются при первом обращении)
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
 
 # Configure detailed logging
 log_dir = "logs"
@@ -72,27 +98,111 @@ def handle_exception(exc_type, exc_value, exc_traceback):
 # Set the exception hook
 sys.excepthook = handle_exception
 
+# Допустимое время импорта при холодном старте (секунды); превышение пишется в лог
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "2"))
+
+# Режим работы: "threaded" (TeleBot с пулом потоков) или "async" (см. async_bot.py)
+BOT_MODE = os.getenv("BOT_MODE", "threaded").lower()
+
+# Webhook-режим: если задан WEBHOOK_URL, Telegram присылает обновления на /webhook keep-alive сервера
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
 # Initialize the bot with appropriate configuration
 bot = telebot.TeleBot(TELEGRAM_TOKEN, threaded=True, num_threads=5)
 
+# В webhook-режиме переполненный планировщик задерживает рабочие потоки очереди
+# обновлений, а не отклоняет задачи (см. run_webhook)
+_block_when_scheduler_full = False
+
+def scheduled(kind):
+    """
+    Run a handler on the per-user fair scheduler instead of the Telegram worker thread.
+    
+    Args:
+        kind (str): Job kind for the scheduler ("text", "photo", "voice", "video", "video_note")
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(message):
+            if not scheduler.submit(message.from_user.id, kind, handler, message, block=_block_when_scheduler_full):
+                try:
+                    bot.reply_to(message, BUSY_TEXT)
+                except Exception as e:
+                    logger.error(f"Error sending busy notice: {e}")
+        return wrapper
+    return decorator
+
+# Потоковая отправка ответов: сообщение появляется после первых токенов и
+# дополняется через edit_message_text не чаще, чем раз в STREAM_EDIT_INTERVAL секунд
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "1") != "0"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+def send_streaming_response(chat_id, fragments, prefix=""):
+    """
+    Deliver a streamed response by sending a message and progressively editing it.
+    
+    Args:
+        chat_id: Telegram chat to answer in
+        fragments (iterable): Text fragments as produced by generate_ai_response_stream
+        prefix (str): Text shown before the response (e.g. the voice transcription)
+        
+    Returns:
+        str: The full response without the prefix
+    """
+    parts = []
+    sent_message = None
+    shown_text = ""
+    last_edit = 0.0
+    
+    for fragment in fragments:
+        parts.append(fragment)
+        now = time.monotonic()
+        if sent_message is not None and now - last_edit < STREAM_EDIT_INTERVAL:
+            continue
+        
+        text = (prefix + "".join(parts))[:TELEGRAM_MESSAGE_LIMIT]
+        if sent_message is None:
+            sent_message = bot.send_message(chat_id, text)
+        elif text != shown_text:
+            _edit_streamed_message(chat_id, sent_message.message_id, text)
+        shown_text = text
+        last_edit = now
+    
+    response = "".join(parts)
+    full_text = prefix + response
+    if sent_message is None:
+        if full_text:
+            bot.send_message(chat_id, full_text)
+        return response
+    
+    # Final edit with the complete text; anything beyond Telegram's limit goes into extra messages
+    final_text = full_text[:TELEGRAM_MESSAGE_LIMIT]
+    if final_text != shown_text:
+        _edit_streamed_message(chat_id, sent_message.message_id, final_text)
+    for i in range(TELEGRAM_MESSAGE_LIMIT, len(full_text), TELEGRAM_MESSAGE_LIMIT):
+        bot.send_message(chat_id, full_text[i:i + TELEGRAM_MESSAGE_LIMIT])
+    
+    return response
+
+def _edit_streamed_message(chat_id, message_id, text):
+    try:
+        bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+    except Exception as e:
+        # Telegram rejects edits that do not change the text; a missed update is not fatal
+        logger.warning(f"Error editing streamed message: {str(e)}")
+
 # Handle /start command
 @bot.message_handler(commands=["start"])
 def start_command(message):
     """Send a message when the command /start is issued."""
     user_first_name = message.from_user.first_name
     
-    # Create inline keyboard
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    help_button = types.InlineKeyboardButton("Помощь", callback_data="help")
-    clear_button = types.InlineKeyboardButton("Очистить чат", callback_data="clear_chat")
-    markup.add(help_button, clear_button)
-    
     bot.send_message(
         message.chat.id,
-        f"Привет, {user_first_name}! 👋 Я Cookie AI, твой дружелюбный помощник, созданный Вадимом Прохоренко! ✨\n\n"
-        f"Я очень рад общаться с тобой! 🎉 Просто отправь мне сообщение, и я дам осмысленным ответ. Я здесь, чтобы помогать, развлекать или просто обсуждать твой день! 💬\n\n"
-        f"🍪 Интересный факт: я являюсь частью растущей экосистемы, которая скоро будет включать мобильные приложения в Google Play Store и App Store, а также мем-коин под названием Cookie AI! 🚀",
-        reply_markup=markup,
+        WELCOME_TEMPLATE.format(first_name=user_first_name),
+        reply_markup=build_start_markup(),
         parse_mode="HTML"
     )
 
@@ -100,25 +210,10 @@ def start_command(message):
 @bot.message_handler(commands=["help"])
 def help_command(message):
     """Send a message when the command /help is issued."""
-    # Create inline keyboard
-    markup = types.InlineKeyboardMarkup(row_width=1)
-    clear_button = types.InlineKeyboardButton("Очистить чат", callback_data="clear_chat")
-    markup.add(clear_button)
-    
     bot.send_message(
         message.chat.id,
-        "📚 Как использовать Cookie AI:\n\n"
-        "- 💬 Просто отправь любое сообщение, и я отвечу с помощью своего ИИ-мозга 🧠\n"
-        "- 📸 Отправь мне фотографию, и я расскажу, что на ней вижу\n"
-        "- 🎥 Отправь мне видео, и я проанализирую всё его содержание (а не только первый кадр)\n"
-        "- 🎤 Отправь мне голосовое сообщение, и я распознаю речь и отвечу на твой вопрос\n"
-        "- 🔘 Запиши круговое видео (видеосообщение), и я проанализирую что на нем\n"
-        "- 🗑️ Используй /clear, чтобы очистить историю нашего разговора\n"
-        "- 🔄 Используй /start, чтобы начать наш дружеский чат заново\n"
-        "- ❓ Используй /help, чтобы увидеть эту справку снова\n\n"
-        "🍪 Обо мне: я Cookie AI, созданный 15-летним разработчиком Вадимом Прохоренко. Скоро я буду доступен как приложение в Google Play и App Store, а также готовится выпуск мем-коина Cookie AI! 🚀\n\n"
-        "О чём ты хочешь поговорить сегодня? 😊",
-        reply_markup=markup
+        HELP_TEXT,
+        reply_markup=build_help_markup()
     )
 
 # Handle /clear command
@@ -127,7 +222,7 @@ def clear_command(message):
     """Clear conversation history when the command /clear is issued."""
     user_id = message.from_user.id
     clear_conversation(user_id)
-    bot.send_message(message.chat.id, "🧹 Готово! История нашего разговора очищена! ✨ Теперь мы начинаем с чистого листа. О чём ты хочешь поговорить? 😊")
+    bot.send_message(message.chat.id, CLEAR_TEXT)
 
 # Создадим временную директорию для хранения файлов
 TEMP_DIR = "temp_media"
@@ -135,6 +230,7 @@ os.makedirs(TEMP_DIR, exist_ok=True)
 
 # Handle photo messages
 @bot.message_handler(content_types=['photo'])
+@scheduled("photo")
 def handle_photo(message):
     """Process and respond to photos sent by users."""
     user_id = message.from_user.id
@@ -150,20 +246,23 @@ def handle_photo(message):
             # Update preferences based on caption
             update_user_preferences(user_id, caption)
         
-        # Get the highest quality photo
-        file_info = bot.get_file(message.photo[-1].file_id)
-        
-        # Generate a unique filename
-        photo_path = os.path.join(TEMP_DIR, f"photo_{user_id}_{int(time.time())}.jpg")
-        
-        # Download the photo
-        downloaded_file = bot.download_file(file_info.file_path)
-        with open(photo_path, 'wb') as new_file:
-            new_file.write(downloaded_file)
-        
-        # Analyze the image
+        # Get the smallest photo size that still has all the detail the model uses
+        photo = choose_photo_size(message.photo)
         custom_prompt = f"Опиши, что ты видишь на этом изображении. {caption}" if caption else None
-        analysis = analyze_image(photo_path, custom_prompt)
+        
+        # The same photo (e.g. a forwarded meme) is analyzed only once
+        cache_key = media_cache.make_key("photo", photo.file_unique_id, custom_prompt)
+        analysis = media_cache.get(cache_key)
+        if analysis is None:
+            file_info = bot.get_file(photo.file_id)
+            
+            # Download the photo (kept in memory, no temp file)
+            downloaded_file = media_download.download(bot.token, file_info)
+            record_download_savings(message.photo[-1].file_size, len(downloaded_file))
+            
+            # Analyze the image
+            analysis = analyze_image(downloaded_file, custom_prompt)
+            media_cache.put(cache_key, analysis)
         
         # Add user and bot messages to conversation history
         image_desc = f"[Пользователь отправил фотографию{': ' + caption if caption else ''}]"
@@ -172,25 +271,30 @@ def handle_photo(message):
         
         # Send the response
         bot.send_message(message.chat.id, analysis)
-        
-        # Clean up
-        try:
-            os.remove(photo_path)
-        except:
-            pass
             
     except Exception as e:
         logger.error(f"Error processing photo: {str(e)}")
         bot.send_message(
             message.chat.id,
-            "😓 Ой! У меня возникла проблема при обработке фотографии. Пожалуйста, попробуйте отправить её еще раз или в другом формате."
+            PHOTO_ERROR_TEXT
         )
 
+def _remove_files(*paths):
+    for path in paths:
+        try:
+            if path and os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            logger.error(f"Error cleaning up file {path}: {str(e)}")
+
 # Handle video messages
 @bot.message_handler(content_types=['video'])
+@scheduled("video")
 def handle_video(message):
     """Process and respond to videos sent by users."""
     user_id = message.from_user.id
+    # Временный файл удаляется в finally, даже если анализ или отправка упали
+    video_path = None
     
     try:
         # Show the bot is processing
@@ -203,53 +307,56 @@ def handle_video(message):
             # Update preferences based on caption
             update_user_preferences(user_id, caption)
         
-        # Download both the video and its thumbnail
-        video_path = None
-        thumbnail_path = None
-        
-        # Get the video file itself
-        try:
-            video_file_info = bot.get_file(message.video.file_id)
-            video_path = os.path.join(TEMP_DIR, f"video_{user_id}_{int(time.time())}.mp4")
-            video_downloaded_file = bot.download_file(video_file_info.file_path)
-            with open(video_path, 'wb') as new_file:
-                new_file.write(video_downloaded_file)
-        except Exception as e:
-            logger.error(f"Error downloading video: {str(e)}")
-        
-        # Get video thumbnail as fallback
-        try:
-            if message.video.thumbnail:
-                thumbnail_file_info = bot.get_file(message.video.thumbnail.file_id)
-                thumbnail_path = os.path.join(TEMP_DIR, f"video_thumb_{user_id}_{int(time.time())}.jpg")
-                thumbnail_downloaded_file = bot.download_file(thumbnail_file_info.file_path)
-                with open(thumbnail_path, 'wb') as new_file:
-                    new_file.write(thumbnail_downloaded_file)
-        except Exception as e:
-            logger.error(f"Error downloading thumbnail: {str(e)}")
-        
-        # Show the bot is still processing 
-        bot.send_chat_action(message.chat.id, "typing")
+        # Download both the video and its thumbnail (the thumbnail stays in memory)
+        thumbnail = None
         
         # Create custom prompt based on caption
-        custom_prompt = None
-        if caption:
-            if "исправить" in caption.lower() or "улучшить" in caption.lower() or "проблема" in caption.lower():
-                custom_prompt = f"Это видео, которое пользователь хочет исправить или улучшить. Проанализируй его содержание, выяви возможные проблемы и предложи конкретные решения. Контекст от пользователя: {caption}"
+        custom_prompt = build_video_prompt(caption)
+        
+        # A forwarded video that was already analyzed is answered without downloading it
+        cache_key = media_cache.make_key("video", message.video.file_unique_id, custom_prompt)
+        analysis = media_cache.get(cache_key)
+        
+        if analysis is None:
+            # Get the video file itself
+            try:
+                # Слишком большое или длинное видео не скачиваем: хватит превью
+                media_worker.check_limits(message.video.file_size, message.video.duration)
+                video_file_info = bot.get_file(message.video.file_id)
+                # Видео пишется на диск кусками, целиком в памяти оно не держится
+                video_path = media_download.download(
+                    bot.token, video_file_info, os.path.join(TEMP_DIR, f"video_{user_id}_{int(time.time())}.mp4")
+                )
+            except Exception as e:
+                logger.error(f"Error downloading video: {str(e)}")
+            
+            # Get video thumbnail as fallback
+            try:
+                if message.video.thumbnail:
+                    thumbnail_file_info = bot.get_file(message.video.thumbnail.file_id)
+                    thumbnail = media_download.download(bot.token, thumbnail_file_info)
+            except Exception as e:
+                logger.error(f"Error downloading thumbnail: {str(e)}")
+            
+            # Show the bot is still processing 
+            bot.send_chat_action(message.chat.id, "typing")
+            
+            # Analyze the video using the enhanced multi-frame approach
+            if video_path:
+                # Full video analysis with multiple frames
+                result = analyze_video_detailed(video_path, thumbnail, custom_prompt, True, 5, message.video.duration)
+                analysis = result["analysis"]
+                # Ответ по одному превью (ffmpeg не извлек кадры) или сообщение об ошибке не кэшируется
+                if result["from_frames"]:
+                    media_cache.put(cache_key, analysis)
+            elif thumbnail:
+                # Fallback to thumbnail-only analysis
+                logger.warning("Using thumbnail-only analysis due to video download failure")
+                if not custom_prompt:
+                    custom_prompt = "Это кадр из видео. Опиши, что ты видишь, и предположи, о чем может быть это видео."
+                analysis = analyze_video(None, thumbnail, custom_prompt, False, 1)
             else:
-                custom_prompt = f"Это видео от пользователя. Проанализируй его и дай подробный ответ, учитывая контекст: {caption}"
-        # Analyze the video using the enhanced multi-frame approach
-        if video_path:
-            # Full video analysis with multiple frames
-            analysis = analyze_video(video_path, thumbnail_path, custom_prompt, True, 5)
-        elif thumbnail_path:
-            # Fallback to thumbnail-only analysis
-            logger.warning("Using thumbnail-only analysis due to video download failure")
-            if not custom_prompt:
-                custom_prompt = "Это кадр из видео. Опиши, что ты видишь, и предположи, о чем может быть это видео."
-            analysis = analyze_video(None, thumbnail_path, custom_prompt, False, 1)
-        else:
-            raise Exception("Failed to download both video and thumbnail")
+                raise Exception("Failed to download both video and thumbnail")
         
         # Add user and bot messages to conversation history
         video_desc = f"[Пользователь отправил видео{': ' + caption if caption else ''}]"
@@ -258,25 +365,19 @@ def handle_video(message):
         
         # Send the response
         bot.send_message(message.chat.id, analysis)
-        
-        # Clean up
-        try:
-            if video_path and os.path.exists(video_path):
-                os.remove(video_path)
-            if thumbnail_path and os.path.exists(thumbnail_path):
-                os.remove(thumbnail_path)
-        except Exception as e:
-            logger.error(f"Error cleaning up files: {str(e)}")
             
     except Exception as e:
         logger.error(f"Error processing video: {str(e)}")
         bot.send_message(
             message.chat.id,
-            "😓 Ой! У меня возникла проблема при обработке видео. Пожалуйста, попробуйте отправить его еще раз или в другом формате."
+            VIDEO_ERROR_TEXT
         )
+    finally:
+        _remove_files(video_path)
 
 # Handle voice messages
 @bot.message_handler(content_types=['voice'])
+@scheduled("voice")
 def handle_voice(message):
     """Process and respond to voice messages sent by users."""
     user_id = message.from_user.id
@@ -293,15 +394,11 @@ def handle_voice(message):
             update_user_preferences(user_id, caption)
         
         # Get the voice file
+        media_worker.check_limits(message.voice.file_size, message.voice.duration)
         file_info = bot.get_file(message.voice.file_id)
         
-        # Generate a unique filename
-        voice_path = os.path.join(TEMP_DIR, f"voice_{user_id}_{int(time.time())}.ogg")
-        
-        # Download the voice file
-        downloaded_file = bot.download_file(file_info.file_path)
-        with open(voice_path, 'wb') as new_file:
-            new_file.write(downloaded_file)
+        # Download the voice file (Whisper gets the bytes directly, no temp file)
+        downloaded_file = media_download.download(bot.token, file_info)
         
         # Transcribe the audio
         from openai_helper import transcribe_audio
@@ -311,7 +408,7 @@ def handle_voice(message):
         bot.send_chat_action(message.chat.id, "typing")
         
         # Get transcription result
-        result = transcribe_audio(voice_path, custom_prompt)
+        result = transcribe_audio(downloaded_file, custom_prompt, "voice.ogg")
         transcription = result["transcription"]
         response_prefix = result["response"]
         
@@ -325,60 +422,70 @@ def handle_voice(message):
             
             # Generate AI response with user preferences
             bot.send_chat_action(message.chat.id, "typing")
-            ai_response = generate_ai_response(conversation, user_id)
+            if STREAM_RESPONSES:
+                # Stream the response with transcription prefix if applicable
+                ai_response = send_streaming_response(
+                    message.chat.id, generate_ai_response_stream(conversation, user_id), response_prefix
+                )
+            else:
+                ai_response = generate_ai_response(conversation, user_id)
+                
+                # Send the response with transcription prefix if applicable
+                full_response = f"{response_prefix}{ai_response}" if response_prefix else ai_response
+                bot.send_message(message.chat.id, full_response)
             
             # Add AI response to conversation history
             add_to_conversation(user_id, "assistant", ai_response)
-            
-            # Send the response with transcription prefix if applicable
-            full_response = f"{response_prefix}{ai_response}" if response_prefix else ai_response
-            bot.send_message(message.chat.id, full_response)
         else:
             # If transcription failed, send error message
             bot.send_message(
                 message.chat.id,
-                "😕 Извините, я не смог разобрать, что было сказано в голосовом сообщении. Возможно, качество звука не очень хорошее или есть фоновый шум. Не могли бы вы повторить голосовое сообщение или написать текстом?"
+                VOICE_NOT_RECOGNIZED_TEXT
             )
-        
-        # Clean up
-        try:
-            os.remove(voice_path)
-        except:
-            pass
             
+    except media_worker.MediaTooLargeError as e:
+        logger.warning(f"Rejected voice message: {str(e)}")
+        bot.send_message(message.chat.id, MEDIA_TOO_LARGE_TEXT)
     except Exception as e:
         logger.error(f"Error processing voice message: {str(e)}")
         bot.send_message(
             message.chat.id,
-            "😓 Ой! У меня возникла проблема при обработке голосового сообщения. Пожалуйста, попробуйте отправить его еще раз или напишите текстом."
+            VOICE_ERROR_TEXT
         )
 
 # Handle video notes (круговые видео)
 @bot.message_handler(content_types=['video_note'])
+@scheduled("video_note")
 def handle_video_note(message):
     """Process and respond to video notes (circular videos) sent by users."""
     user_id = message.from_user.id
+    video_path = None
     
     try:
         # Show the bot is processing
         bot.send_chat_action(message.chat.id, "typing")
         
-        # Get the video note file
-        file_info = bot.get_file(message.video_note.file_id)
-        
-        # Generate unique filenames
-        video_path = os.path.join(TEMP_DIR, f"video_note_{user_id}_{int(time.time())}.mp4")
-        
-        # Download the video note
-        downloaded_file = bot.download_file(file_info.file_path)
-        with open(video_path, 'wb') as new_file:
-            new_file.write(downloaded_file)
-        
         # Custom prompt for video notes
-        custom_prompt = "Это круговое видео из Telegram (video note). Проанализируй, что на нем происходит и дай подробный ответ. Если человек просит о помощи или задает вопрос, попробуй ответить по сути."
-        
-        # Analyze the video with multiple frames
-        analysis = analyze_video(video_path, None, custom_prompt, True, 5)
+        custom_prompt = VIDEO_NOTE_PROMPT
+        
+        cache_key = media_cache.make_key("video_note", message.video_note.file_unique_id, custom_prompt)
+        analysis = media_cache.get(cache_key)
+        if analysis is None:
+            # Get the video note file
+            media_worker.check_limits(message.video_note.file_size, message.video_note.duration)
+            file_info = bot.get_file(message.video_note.file_id)
+            
+            # Stream the video note to a uniquely named temp file
+            video_path = media_download.download(
+                bot.token, file_info, os.path.join(TEMP_DIR, f"video_note_{user_id}_{int(time.time())}.mp4")
+            )
+            
+            # Analyze the video with multiple frames
+            result = analyze_video_detailed(video_path, None, custom_prompt, True, 5, message.video_note.duration)
+            analysis = result["analysis"]
+            # Ответ по одному превью (ffmpeg не извлек кадры) или сообщение об ошибке не кэшируется
+            if result["from_frames"]:
+                media_cache.put(cache_key, analysis)
         
         # Add to conversation history
         video_desc = "[Пользователь отправил круговое видео]"
@@ -387,22 +494,22 @@ def handle_video_note(message):
         
         # Send the response
         bot.send_message(message.chat.id, analysis)
-        
-        # Clean up
-        try:
-            os.remove(video_path)
-        except:
-            pass
             
+    except media_worker.MediaTooLargeError as e:
+        logger.warning(f"Rejected video note: {str(e)}")
+        bot.send_message(message.chat.id, MEDIA_TOO_LARGE_TEXT)
     except Exception as e:
         logger.error(f"Error processing video note: {str(e)}")
         bot.send_message(
             message.chat.id,
-            "😓 Ой! У меня возникла проблема при обработке видеосообщения. Пожалуйста, попробуйте отправить его еще раз или опишите ситуацию текстом."
+            VIDEO_NOTE_ERROR_TEXT
         )
+    finally:
+        _remove_files(video_path)
 
 # Handle text messages
 @bot.message_handler(content_types=['text'])
+@scheduled("text")
 def handle_message(message):
     """Handle user text messages and generate AI responses."""
     user_id = message.from_user.id
@@ -418,23 +525,34 @@ def handle_message(message):
     conversation = get_conversation_history(user_id)
     
     try:
+        # Repeated questions (FAQ, first messages after /start) are answered from the cache
+        cached_response = response_cache.lookup(conversation, user_id)
+        if cached_response is not None:
+            bot.send_message(message.chat.id, cached_response)
+            add_to_conversation(user_id, "assistant", cached_response)
+            return
+        
         # Send "typing" action to show the bot is processing
         bot.send_chat_action(message.chat.id, "typing")
         
         # Generate AI response with user preferences
-        ai_response = generate_ai_response(conversation, user_id)
+        if STREAM_RESPONSES:
+            # Show the answer as it is generated
+            ai_response = send_streaming_response(message.chat.id, generate_ai_response_stream(conversation, user_id))
+        else:
+            ai_response = generate_ai_response(conversation, user_id)
+            
+            # Send the response
+            bot.send_message(message.chat.id, ai_response)
         
         # Add AI response to conversation history
         add_to_conversation(user_id, "assistant", ai_response)
-        
-        # Send the response
-        bot.send_message(message.chat.id, ai_response)
     
     except Exception as e:
         logger.error(f"Error generating response: {str(e)}")
         bot.send_message(
             message.chat.id,
-            "😓 Ой! У меня возникла небольшая проблема в процессе обработки. 🤖 Мои схемы немного перегрузились. Не мог бы ты попробовать сформулировать вопрос по-другому? Или, возможно, попробуй повторить запрос через минуту. Приношу извинения за неудобства! 🙏"
+            TEXT_ERROR_TEXT
         )
 
 # Handle callback queries from inline keyboards
@@ -445,33 +563,18 @@ def handle_callback(call):
     bot.answer_callback_query(call.id)
     
     if call.data == "help":
-        # Create inline keyboard
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        clear_button = types.InlineKeyboardButton("Очистить чат", callback_data="clear_chat")
-        markup.add(clear_button)
-        
         # Edit the message with help information
         bot.edit_message_text(
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            text="📚 Как использовать Cookie AI:\n\n"
-                "- 💬 Просто отправь любое сообщение, и я отвечу с помощью своего ИИ-мозга 🧠\n"
-                "- 📸 Отправь мне фотографию, и я расскажу, что на ней вижу\n"
-                "- 🎥 Отправь мне видео, и я проанализирую всё его содержание (а не только первый кадр)\n"
-                "- 🎤 Отправь мне голосовое сообщение, и я распознаю речь и отвечу на твой вопрос\n"
-                "- 🔘 Запиши круговое видео (видеосообщение), и я проанализирую что на нем\n"
-                "- 🗑️ Используй /clear, чтобы очистить историю нашего разговора\n"
-                "- 🔄 Используй /start, чтобы начать наш дружеский чат заново\n"
-                "- ❓ Используй /help, чтобы увидеть эту справку снова\n\n"
-                "🍪 Обо мне: я Cookie AI, созданный 15-летним разработчиком Вадимом Прохоренко. Скоро я буду доступен как приложение в Google Play и App Store, а также готовится выпуск мем-коина Cookie AI! 🚀\n\n"
-                "О чём ты хочешь поговорить сегодня? 😊",
-            reply_markup=markup
+            text=HELP_TEXT,
+            reply_markup=build_help_markup()
         )
     
     elif call.data == "clear_chat":
         user_id = call.from_user.id
         clear_conversation(user_id)
-        bot.send_message(call.message.chat.id, "🧹 Готово! История нашего разговора очищена! ✨ Теперь мы начинаем с чистого листа. О чём ты хочешь поговорить? 😊")
+        bot.send_message(call.message.chat.id, CLEAR_TEXT)
 
 # Создаем системную команду для мониторинга состояния
 @bot.message_handler(commands=["status"])
@@ -479,6 +582,10 @@ def status_command(message):
     """Send status information to the administrator."""
     # Проверяем, является ли отправитель администратором (можно настроить список администраторов)
     # В данном примере доступ к команде имеют все, но в продакшен варианте стоит ограничить
+    bot.send_message(message.chat.id, build_status_message(), parse_mode="Markdown")
+
+def build_status_message():
+    """Build the /status text (shared by the threaded and asyncio modes)."""
     uptime = time.time() - BOT_START_TIME
     days, remainder = divmod(uptime, 86400)
     hours, remainder = divmod(remainder, 3600)
@@ -491,10 +598,125 @@ def status_command(message):
         f"🧠 *Память*: {get_memory_usage()} МБ\n"
         f"💾 *Диск*: {get_disk_usage()} ГБ свободно\n"
         f"🔄 *Перезапусков*: {RESTART_COUNT}\n"
+        f"🚀 *Холодный старт*: {IMPORT_SECONDS:.2f} с\n"
         f"⚡ *Последняя проверка соединения*: {last_connection_check.strftime('%Y-%m-%d %H:%M:%S')}\n"
     )
     
-    bot.send_message(message.chat.id, status_msg, parse_mode="Markdown")
+    prompt_stats = get_prompt_cache_stats()
+    status_msg += (
+        f"📝 *Кэш промпта*: {prompt_stats['hits']} попаданий / {prompt_stats['misses']} промахов, "
+        f"переиспользовано {prompt_stats['bytes_reused_per_request'] / 1024:.1f} КБ на запрос\n"
+    )
+    
+    kb_stats = get_retrieval_stats()
+    if kb_stats["queries"]:
+        status_msg += (
+            f"📚 *База знаний*: ~{kb_stats['avg_tokens']:.0f} из {kb_stats['full_tokens']} токенов на запрос, "
+            f"поиск {kb_stats['avg_seconds'] * 1000:.2f} мс\n"
+        )
+    
+    streaming_stats = get_streaming_stats()
+    if streaming_stats["requests"]:
+        status_msg += (
+            f"⚡ *Стриминг*: первый токен через {streaming_stats['avg_ttft']:.2f} с, "
+            f"полный ответ за {streaming_stats['avg_generation']:.2f} с\n"
+        )
+    
+    for name, provider_stats in get_provider_stats().items():
+        if provider_stats["requests"]:
+            status_msg += (
+                f"🔌 *{name}* ({provider_stats['model']}): "
+                f"{'✅' if provider_stats['healthy'] else '⛔'} "
+                f"{provider_stats['requests']} запросов, {provider_stats['failures']} ошибок, "
+                f"~{provider_stats['avg_latency']:.1f} с\n"
+            )
+    
+    resilience_stats = get_resilience_stats()
+    if resilience_stats["calls"]:
+        open_breakers = [
+            name for name, breaker in resilience_stats["breakers"].items() if breaker["state"] != "closed"
+        ]
+        status_msg += (
+            f"🔁 *Повторы*: {resilience_stats['retries']} на {resilience_stats['calls']} вызовов, "
+            f"исчерпано {resilience_stats['exhausted']}, "
+            f"разомкнуты: {', '.join(open_breakers) if open_breakers else 'нет'}\n"
+        )
+    
+    for model, limiter_stats in get_rate_limiter_stats().items():
+        if limiter_stats["granted"] or limiter_stats["waiting"]:
+            status_msg += (
+                f"⏳ *Лимит {model}*: ожидание ~{limiter_stats['avg_wait']:.2f} с "
+                f"(макс {limiter_stats['max_wait']:.1f} с), в очереди {limiter_stats['waiting']}, "
+                f"отказов {limiter_stats['timeouts']}\n"
+            )
+    
+    scheduler_stats = scheduler.get_scheduler_stats()
+    if scheduler_stats["completed"] or scheduler_stats["running"]:
+        status_msg += (
+            f"🗂 *Планировщик*: в очереди {scheduler_stats['queued_text']} текст / {scheduler_stats['queued_media']} медиа "
+            f"(лимит {scheduler_stats['capacity']}), "
+            f"ожидание текста p99 {scheduler_stats['text_p99']:.2f} с, медиа p99 {scheduler_stats['media_p99']:.2f} с, "
+            f"отклонено {scheduler_stats['rejected']}\n"
+        )
+    
+    cache_stats = response_cache.get_response_cache_stats()
+    if cache_stats["hits"] or cache_stats["misses"]:
+        status_msg += (
+            f"🗃 *Кэш ответов*: {cache_stats['hit_rate']:.0%} попаданий "
+            f"({cache_stats['hits']}, из них похожих {cache_stats['near_hits']}), "
+            f"{cache_stats['entries']} записей, ответ за {cache_stats['avg_hit_seconds'] * 1000:.1f} мс\n"
+        )
+    
+    media_stats = media_cache.get_media_cache_stats()
+    if media_stats["hits"] or media_stats["misses"]:
+        status_msg += (
+            f"🖼 *Кэш медиа*: {media_stats['hit_rate']:.0%} попаданий ({media_stats['hits']}), "
+            f"{media_stats['entries']} записей\n"
+        )
+    
+    image_stats = get_image_stats()
+    if image_stats["images"]:
+        status_msg += (
+            f"🔍 *Изображения*: {image_stats['bytes_out'] / 1024:.0f} из {image_stats['bytes_in'] / 1024:.0f} КБ отправлено, "
+            f"уменьшено {image_stats['resized']} из {image_stats['images']}, {image_stats['avg_ms']:.0f} мс, "
+            f"detail low/high {image_stats['low_detail']}/{image_stats['high_detail']}\n"
+        )
+    
+    worker_stats = media_worker.get_media_worker_stats()
+    if worker_stats["completed"] or worker_stats["failed"] or worker_stats["rejected"] or worker_stats["too_large"]:
+        status_msg += (
+            f"🎬 *Медиа-пул*: {worker_stats['running']}/{worker_stats['workers']} занято, "
+            f"в очереди {worker_stats['queued']}, ожидание {worker_stats['avg_wait']:.2f} с, "
+            f"обработка {worker_stats['avg_run']:.2f} с, таймаутов {worker_stats['timeouts']}, "
+            f"отклонено {worker_stats['rejected'] + worker_stats['too_large']}\n"
+        )
+    
+    frame_stats = get_frame_stats()
+    if frame_stats["videos"]:
+        status_msg += (
+            f"🎞 *Кадры видео*: отправлено {frame_stats['selected']} из {frame_stats['candidates']} "
+            f"({frame_stats['selected'] / frame_stats['videos']:.1f} на видео), "
+            f"не получено от ffmpeg {frame_stats['missing']}\n"
+        )
+    
+    download_stats = media_download.get_download_stats()
+    if download_stats["downloads"] or download_stats["too_large"] or download_stats["failed"]:
+        status_msg += (
+            f"📥 *Скачивание медиа*: {download_stats['downloads']} файлов, "
+            f"{download_stats['bytes'] / 1024 / 1024:.1f} МБ, {download_stats['mb_per_second']:.1f} МБ/с, "
+            f"отклонено {download_stats['too_large']}, отменено {download_stats['cancelled']}, "
+            f"ошибок {download_stats['failed']}\n"
+        )
+    
+    if WEBHOOK_URL:
+        queue_stats = update_queue.get_queue_stats()
+        status_msg += (
+            f"📥 *Очередь обновлений*: {queue_stats['depth']}/{queue_stats['capacity']}, "
+            f"отброшено {queue_stats['shed']}, отклонено {queue_stats['rejected']}, "
+            f"среднее ожидание {queue_stats['avg_wait']:.2f} с\n"
+        )
+    
+    return status_msg
 
 def get_memory_usage():
     """Get memory usage of the current process in MB."""
@@ -566,6 +788,36 @@ def cleanup_temp_files():
         except Exception as e:
             logger.error(f"Error in temp file cleanup: {str(e)}")
 
+def process_webhook_update(update_json):
+    """Run the handlers for a single raw update taken from the webhook queue."""
+    update = telebot.types.Update.de_json(update_json)
+    bot.process_new_updates([update])
+
+def run_webhook():
+    """Register the webhook with Telegram and process updates from the bounded queue."""
+    global _block_when_scheduler_full
+    # Queue workers dispatch updates inline (not on TeleBot's own unbounded pool)
+    # and hand the handlers to the scheduler. When the scheduler's global queue is
+    # full they block, so the bounded update queue fills up and the webhook sheds
+    # media and answers 503 to make Telegram retry later
+    bot.threaded = False
+    _block_when_scheduler_full = True
+    update_queue.start_workers(process_webhook_update)
+    
+    logger.info(f"Setting webhook to {WEBHOOK_URL}...")
+    bot.remove_webhook()
+    bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+    
+    # Flask-сервер работает в отдельном потоке, основной поток просто ждет
+    while True:
+        time.sleep(CONNECTION_CHECK_INTERVAL)
+        queue_stats = update_queue.get_queue_stats()
+        logger.info(
+            f"Update queue: depth {queue_stats['depth']}/{queue_stats['capacity']}, "
+            f"processed {queue_stats['processed']}, shed {queue_stats['shed']}, "
+            f"rejected {queue_stats['rejected']}, avg wait {queue_stats['avg_wait']:.2f}s"
+        )
+
 def main():
     """Start the bot and background services."""
     global BOT_START_TIME, last_connection_check, RESTART_COUNT
@@ -575,6 +827,20 @@ def main():
     last_connection_check = datetime.now()
     RESTART_COUNT = 0
     
+    logger.info(f"Modules imported in {IMPORT_SECONDS:.2f}s")
+    if IMPORT_SECONDS > STARTUP_BUDGET_SECONDS:
+        logger.warning(f"Cold start exceeded the budget of {STARTUP_BUDGET_SECONDS:.1f}s")
+    
+    # async_bot получает обновления только поллингом — молча игнорировать webhook нельзя
+    if BOT_MODE == "async" and WEBHOOK_URL:
+        logger.error("WEBHOOK_URL is not supported with BOT_MODE=async: unset WEBHOOK_URL or use BOT_MODE=threaded")
+        sys.exit(1)
+    
+    # Без секрета кто угодно, узнавший URL, может присылать боту поддельные обновления
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        logger.error("WEBHOOK_SECRET is required when WEBHOOK_URL is set: refusing to start in webhook mode")
+        sys.exit(1)
+    
     # Запускаем веб-сервер для keep-alive
     logger.info("Starting keep-alive server...")
     keep_alive()  # Start the Flask server in a separate thread
@@ -587,6 +853,20 @@ def main():
     logger.info("Starting temp file cleanup service...")
     threading.Thread(target=cleanup_temp_files, daemon=True).start()
     
+    # В asyncio-режиме обработчики работают как корутины в async_bot.py
+    if BOT_MODE == "async":
+        import async_bot
+        async_bot.run(status_provider=build_status_message)
+        return
+    
+    # Обработчики сообщений выполняются планировщиком с очередями по пользователям
+    scheduler.start_workers()
+    
+    # Webhook-режим: обновления приходят через Flask и обрабатываются из ограниченной очереди
+    if WEBHOOK_URL:
+        run_webhook()
+        return
+    
     # Запускаем бота с обработкой ошибок и автоматическим перезапуском
     logger.info("Starting bot...")
     while True:
@@ -615,8 +895,5 @@ CONNECTION_CHECK_INTERVAL = 300  # 5 минут
 TEMP_CLEANUP_INTERVAL = 3600  # 1 час
 last_connection_check = datetime.now()
 
-# Импортируем дополнительные модули
-import shutil  # Для получения информации о диске
-
 if __name__ == "__main__":
     main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Общие тексты и клавиатуры для обоих режимов бота (threaded и asyncio)
+
+from telebot import types
+
+WELCOME_TEMPLATE = (
+    "Привет, {first_name}! 👋 Я Cookie AI, твой дружелюбный помощник, созданный Вадимом Прохоренко! ✨\n\n"
+    "Я очень рад общаться с тобой! 🎉 Просто отправь мне сообщение, и я дам осмысленным ответ. Я здесь, чтобы помогать, развлекать или просто обсуждать твой день! 💬\n\n"
+    "🍪 Интересный факт: я являюсь частью растущей экосистемы, которая скоро будет включать мобильные приложения в Google Play Store и App Store, а также мем-коин под названием Cookie AI! 🚀"
+)
+
+HELP_TEXT = (
+    "📚 Как использовать Cookie AI:\n\n"
+    "- 💬 Просто отправь любое сообщение, и я отвечу с помощью своего ИИ-мозга 🧠\n"
+    "- 📸 Отправь мне фотографию, и я расскажу, что на ней вижу\n"
+    "- 🎥 Отправь мне видео, и я проанализирую всё его содержание (а не только первый кадр)\n"
+    "- 🎤 Отправь мне голосовое сообщение, и я распознаю речь и отвечу на твой вопрос\n"
+    "- 🔘 Запиши круговое видео (видеосообщение), и я проанализирую что на нем\n"
+    "- 🗑️ Используй /clear, чтобы очистить историю нашего разговора\n"
+    "- 🔄 Используй /start, чтобы начать наш дружеский чат заново\n"
+    "- ❓ Используй /help, чтобы увидеть эту справку снова\n\n"
+    "🍪 Обо мне: я Cookie AI, созданный 15-летним разработчиком Вадимом Прохоренко. Скоро я буду доступен как приложение в Google Play и App Store, а также готовится выпуск мем-коина Cookie AI! 🚀\n\n"
+    "О чём ты хочешь поговорить сегодня? 😊"
+)
+
+CLEAR_TEXT = "🧹 Готово! История нашего разговора очищена! ✨ Теперь мы начинаем с чистого листа. О чём ты хочешь поговорить? 😊"
+
+PHOTO_ERROR_TEXT = "😓 Ой! У меня возникла проблема при обработке фотографии. Пожалуйста, попробуйте отправить её еще раз или в другом формате."
+VIDEO_ERROR_TEXT = "😓 Ой! У меня возникла проблема при обработке видео. Пожалуйста, попробуйте отправить его еще раз или в другом формате."
+VOICE_ERROR_TEXT = "😓 Ой! У меня возникла проблема при обработке голосового сообщения. Пожалуйста, попробуйте отправить его еще раз или напишите текстом."
+VIDEO_NOTE_ERROR_TEXT = "😓 Ой! У меня возникла проблема при обработке видеосообщения. Пожалуйста, попробуйте отправить его еще раз или опишите ситуацию текстом."
+VOICE_NOT_RECOGNIZED_TEXT = "😕 Извините, я не смог разобрать, что было сказано в голосовом сообщении. Возможно, качество звука не очень хорошее или есть фоновый шум. Не могли бы вы повторить голосовое сообщение или написать текстом?"
+MEDIA_TOO_LARGE_TEXT = "📦 Этот файл слишком большой или длинный для меня. Попробуй отправить покороче или опиши, что там, текстом! 🙏"
+BUSY_TEXT = "⏳ Я еще обрабатываю твои предыдущие сообщения. Подожди немного, пока я с ними разберусь, и отправь это снова! 🙏"
+TEXT_ERROR_TEXT = "😓 Ой! У меня возникла небольшая проблема в процессе обработки. 🤖 Мои схемы немного перегрузились. Не мог бы ты попробовать сформулировать вопрос по-другому? Или, возможно, попробуй повторить запрос через минуту. Приношу извинения за неудобства! 🙏"
+
+# Промпт для круговых видео (video note)
+VIDEO_NOTE_PROMPT = "Это круговое видео из Telegram (video note). Проанализируй, что на нем происходит и дай подробный ответ. Если человек просит о помощи или задает вопрос, попробуй ответить по сути."
+
+def build_start_markup():
+    """Build the inline keyboard shown with the /start greeting."""
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    help_button = types.InlineKeyboardButton("Помощь", callback_data="help")
+    clear_button = types.InlineKeyboardButton("Очистить чат", callback_data="clear_chat")
+    markup.add(help_button, clear_button)
+    return markup
+
+def build_help_markup():
+    """Build the inline keyboard shown with the help text."""
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    clear_button = types.InlineKeyboardButton("Очистить чат", callback_data="clear_chat")
+    markup.add(clear_button)
+    return markup
+
+def build_video_prompt(caption):
+    """
+    Build the analysis prompt for a video based on the user's caption.
+
+    Args:
+        caption (str): Caption sent with the video (may be empty)
+
+    Returns:
+        str: Custom prompt or None if there is no caption
+    """
+    if not caption:
+        return None
+    if "исправить" in caption.lower() or "улучшить" in caption.lower() or "проблема" in caption.lower():
+        return f"Это видео, которое пользователь хочет исправить или улучшить. Проанализируй его содержание, выяви возможные проблемы и предложи конкретные решения. Контекст от пользователя: {caption}"
+    return f"Это видео от пользователя. Проанализируй его и дай подробный ответ, учитывая контекст: {caption}"
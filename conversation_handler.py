@@ -1,4 +1,10 @@
+import os
+import time
+import queue
 import logging
+import threading
+from token_counter import count_message_tokens
+from sharded_state import ShardedDict
 
 # Set up logging
 logging.basicConfig(
@@ -6,9 +12,32 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# In-memory storage for conversations
-# Structure: {user_id: [{"role": "user/assistant", "content": "message"}, ...]}
-conversation_store = {}
+# In-memory storage for conversations, sharded with a lock per shard
+# Structure: {user_id: [{"role": "user/assistant", "content": "message", "tokens": int}, ...]}
+conversation_store = ShardedDict()
+
+# Бюджет токенов на весь запрос (системный промпт + история + ответ)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "8000"))
+
+# Краткое содержание старой части разговора
+# Structure: {user_id: {"role": "system", "content": "...", "tokens": int}}
+summary_store = ShardedDict()
+
+# Когда история длиннее SUMMARY_THRESHOLD сообщений, все, кроме последних
+# SUMMARY_KEEP_RECENT, сжимается в фоне в одно краткое содержание
+SUMMARY_THRESHOLD = int(os.getenv("SUMMARY_THRESHOLD", "30"))
+SUMMARY_KEEP_RECENT = int(os.getenv("SUMMARY_KEEP_RECENT", "10"))
+
+# Сколько секунд не повторять суммаризацию для пользователя после неудачной попытки
+SUMMARY_RETRY_COOLDOWN = float(os.getenv("SUMMARY_RETRY_COOLDOWN", "300"))
+
+# Очередь пользователей, которым нужна суммаризация, и те, кто уже в ней
+_summary_queue = queue.Queue()
+_summary_pending = set()
+# Structure: {user_id: time.monotonic() of the last failed summary}
+_summary_failed_at = {}
+_summary_lock = threading.Lock()
+_summary_worker_started = False
 
 def get_conversation_history(user_id):
     """
@@ -18,12 +47,10 @@ def get_conversation_history(user_id):
         user_id: The user's unique identifier
         
     Returns:
-        list: List of conversation messages
+        list: Snapshot of the conversation messages (safe to iterate while others append)
     """
-    if user_id not in conversation_store:
-        conversation_store[user_id] = []
-    
-    return conversation_store[user_id]
+    with conversation_store.lock(user_id):
+        return list(conversation_store.setdefault(user_id, []))
 
 def add_to_conversation(user_id, role, content):
     """
@@ -37,23 +64,29 @@ def add_to_conversation(user_id, role, content):
     Returns:
         None
     """
-    if user_id not in conversation_store:
-        conversation_store[user_id] = []
-    
     # Ensure the role is valid
     if role not in ["user", "assistant", "system"]:
         logger.warning(f"Invalid role '{role}' provided. Must be 'user', 'assistant', or 'system'.")
         return
     
-    # Add the message to the conversation history
-    conversation_store[user_id].append({
-        "role": role,
-        "content": content
-    })
+    # Add the message to the conversation history (token count is computed once here)
+    message = {"role": role, "content": content}
+    message["tokens"] = count_message_tokens(message)
+    
+    with conversation_store.lock(user_id):
+        history = conversation_store.setdefault(user_id, [])
+        history.append(message)
+        
+        # Limit conversation history to last 50 messages to prevent memory issues
+        if len(history) > 50:
+            history = history[-50:]
+            conversation_store[user_id] = history
+        
+        needs_summary = len(history) > SUMMARY_THRESHOLD
     
-    # Limit conversation history to last 50 messages to prevent memory issues
-    if len(conversation_store[user_id]) > 50:
-        conversation_store[user_id] = conversation_store[user_id][-50:]
+    # Compress older turns in the background once the history grows long
+    if needs_summary:
+        _schedule_summary(user_id)
 
 def clear_conversation(user_id):
     """
@@ -65,4 +98,141 @@ def clear_conversation(user_id):
     Returns:
         None
     """
-    conversation_store[user_id] = []
+    with conversation_store.lock(user_id):
+        conversation_store[user_id] = []
+        summary_store.pop(user_id, None)
+    # Новый разговор не должен ждать окончания паузы после неудачного сжатия старого
+    with _summary_lock:
+        _summary_failed_at.pop(user_id, None)
+
+
+def get_message_tokens(message):
+    """
+    Get the cached token count of a stored message, computing it on first use.
+    
+    Args:
+        message (dict): A conversation message
+        
+    Returns:
+        int: Number of tokens including per-message overhead
+    """
+    if "tokens" not in message:
+        message["tokens"] = count_message_tokens(message)
+    return message["tokens"]
+
+def get_context_window(conversation_history, reserved_tokens=0, token_budget=None):
+    """
+    Select the newest messages that fit into the token budget.
+    
+    Messages are taken from newest to oldest until the budget (minus the
+    reserved tokens for the system prompt and the response) is used up. The
+    latest message is always included.
+    
+    Args:
+        conversation_history (list): List of conversation messages
+        reserved_tokens (int): Tokens reserved for the system prompt and max_tokens of the response
+        token_budget (int, optional): Total budget, defaults to CONTEXT_TOKEN_BUDGET
+        
+    Returns:
+        list: Messages in chronological order
+    """
+    if token_budget is None:
+        token_budget = CONTEXT_TOKEN_BUDGET
+    available = token_budget - reserved_tokens
+    
+    window = []
+    used = 0
+    for message in reversed(conversation_history):
+        tokens = get_message_tokens(message)
+        if window and used + tokens > available:
+            break
+        window.append(message)
+        used += tokens
+    
+    window.reverse()
+    return window
+
+def get_conversation_summary(user_id):
+    """
+    Get the summary message that stands in for the user's older turns.
+    
+    Args:
+        user_id: The user's unique identifier
+        
+    Returns:
+        dict: A system message with the summary, or None if there is none yet
+    """
+    return summary_store.get(user_id)
+
+def _schedule_summary(user_id):
+    """Queue a user for background summarisation (at most once at a time)."""
+    global _summary_worker_started
+    
+    with _summary_lock:
+        if user_id in _summary_pending:
+            return
+        # После неудачи каждое новое сообщение иначе снова запускало бы платный запрос
+        failed_at = _summary_failed_at.get(user_id)
+        if failed_at is not None and time.monotonic() - failed_at < SUMMARY_RETRY_COOLDOWN:
+            return
+        _summary_pending.add(user_id)
+        if not _summary_worker_started:
+            threading.Thread(target=_summary_worker, name="summary-worker", daemon=True).start()
+            _summary_worker_started = True
+    
+    _summary_queue.put(user_id)
+
+def _summary_worker():
+    """Background thread that compresses old turns off the request path."""
+    while True:
+        user_id = _summary_queue.get()
+        try:
+            _summarize_old_turns(user_id)
+        except Exception as e:
+            logger.error(f"Error summarizing conversation for user {user_id}: {str(e)}")
+            _record_summary_failure(user_id)
+        finally:
+            with _summary_lock:
+                _summary_pending.discard(user_id)
+
+def _record_summary_failure(user_id):
+    """Start the retry cooldown for a user whose summary could not be generated."""
+    with _summary_lock:
+        _summary_failed_at[user_id] = time.monotonic()
+    logger.warning(f"Summary for user {user_id} failed, next attempt in {SUMMARY_RETRY_COOLDOWN:.0f}s at the earliest")
+
+def _summarize_old_turns(user_id):
+    """Replace everything except the most recent turns with a single summary message."""
+    # Imported here to avoid loading the OpenAI client for modules that only need the store
+    from openai_helper import summarize_conversation
+    
+    with conversation_store.lock(user_id):
+        history = conversation_store.get(user_id, [])
+        if len(history) <= SUMMARY_THRESHOLD:
+            return
+        old_turns = history[:-SUMMARY_KEEP_RECENT]
+        previous = summary_store.get(user_id)
+    
+    # The slow API call runs without holding the lock
+    summary_text = summarize_conversation(old_turns, previous["content"] if previous else None)
+    if not summary_text:
+        _record_summary_failure(user_id)
+        return
+    
+    with _summary_lock:
+        _summary_failed_at.pop(user_id, None)
+    
+    summary = {"role": "system", "content": summary_text}
+    summary["tokens"] = count_message_tokens(summary)
+    
+    with conversation_store.lock(user_id):
+        # The history may have been cleared or trimmed while the summary was generated;
+        # only replace the turns if they are still at the start of the list
+        current = conversation_store.get(user_id, [])
+        if len(current) < len(old_turns) or any(a is not b for a, b in zip(current, old_turns)):
+            logger.info(f"Conversation for user {user_id} changed during summarisation, discarding summary")
+            return
+        
+        summary_store[user_id] = summary
+        conversation_store[user_id] = current[len(old_turns):]
+    logger.info(f"Summarized {len(old_turns)} old messages for user {user_id}")
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Подготовка изображений перед отправкой в GPT-4o vision.
+# Модель все равно уменьшает картинку: в режиме detail=high — до 2048 по длинной
+# стороне и 768 по короткой, в режиме low — до 512. Все, что больше, только
+# увеличивает размер запроса и время загрузки. Поэтому из размеров фото, которые
+# присылает Telegram, выбирается самый маленький, который еще не теряет деталей,
+# а если он все равно больше нужного, ffmpeg уменьшает и пережимает его в памяти.
+
+import os
+import sys
+import time
+import logging
+import threading
+import subprocess
+import media_worker
+
+logger = logging.getLogger(__name__)
+
+# Режим detail для фото и для кадров из видео ("low", "high" или "auto")
+VISION_DETAIL_PHOTO = os.getenv("VISION_DETAIL_PHOTO", "high")
+VISION_DETAIL_VIDEO = os.getenv("VISION_DETAIL_VIDEO", "low")
+
+# Предельные размеры для detail=high: длинная и короткая сторона
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "2048"))
+IMAGE_MAX_SHORT_SIDE = int(os.getenv("IMAGE_MAX_SHORT_SIDE", "768"))
+
+# Для detail=low модель смотрит на картинку 512x512
+LOW_DETAIL_SIDE = 512
+
+# Качество JPEG при пережатии (2 — лучшее, 31 — худшее)
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "4"))
+
+# Сколько секунд может занимать пережатие одного изображения
+IMAGE_RESIZE_TIMEOUT = float(os.getenv("IMAGE_RESIZE_TIMEOUT", "10"))
+
+# Маркеры JPEG SOF*, в которых записаны размеры изображения
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+_stats_lock = threading.Lock()
+stats = {
+    "images": 0,
+    "resized": 0,
+    "bytes_in": 0,
+    "bytes_out": 0,
+    "seconds": 0.0,
+    "low_detail": 0,
+    "high_detail": 0,
+}
+
+def jpeg_size(data):
+    """
+    Read the dimensions from a JPEG header without decoding the image.
+
+    Args:
+        data (bytes): JPEG contents (any bytes-like object)
+
+    Returns:
+        tuple: (width, height), or None if the data is not a readable JPEG
+    """
+    if bytes(data[:2]) != b"\xff\xd8":
+        return None
+    position = 2
+    while position + 9 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # Заполняющий байт перед маркером
+            position += 1
+            continue
+        if 0xD0 <= marker <= 0xD9 or marker == 0x01:
+            # Маркеры без длины
+            position += 2
+            continue
+        if marker in _SOF_MARKERS:
+            # Сегмент SOF должен уместиться целиком, иначе заголовок обрезан
+            length = int.from_bytes(data[position + 2:position + 4], "big")
+            if length < 8 or position + 2 + length > len(data):
+                return None
+            height = int.from_bytes(data[position + 5:position + 7], "big")
+            width = int.from_bytes(data[position + 7:position + 9], "big")
+            return width, height
+        position += 2 + int.from_bytes(data[position + 2:position + 4], "big")
+    return None
+
+def target_size(width, height, detail):
+    """
+    Size the vision model will actually look at.
+
+    Args:
+        width (int): Image width
+        height (int): Image height
+        detail (str): "low", "high" or "auto"
+
+    Returns:
+        tuple: (width, height), never larger than the original
+    """
+    if detail == "low":
+        scale = LOW_DETAIL_SIDE / max(width, height)
+    else:
+        scale = min(IMAGE_MAX_SIDE / max(width, height), IMAGE_MAX_SHORT_SIDE / min(width, height))
+    scale = min(1.0, scale)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def max_side_for(detail, default):
+    """Longest side worth producing for a detail level (used for video frames)."""
+    return min(default, LOW_DETAIL_SIDE) if detail == "low" else default
+
+def choose_photo_size(photo_sizes, detail=VISION_DETAIL_PHOTO):
+    """
+    Pick the smallest Telegram photo size that still has every pixel the model will use.
+
+    Args:
+        photo_sizes (list): message.photo (PhotoSize objects from smallest to largest)
+        detail (str): Vision detail level the photo will be sent with
+
+    Returns:
+        PhotoSize: The size to download
+    """
+    largest = photo_sizes[-1]
+    needed = target_size(largest.width, largest.height, detail)
+    for size in photo_sizes:
+        if size.width >= needed[0] and size.height >= needed[1]:
+            return size
+    return largest
+
+def _resize(data, width, height):
+    cmd = [
+        "ffmpeg", "-v", "error", "-nostdin", "-f", "image2pipe", "-i", "pipe:0",
+        "-vf", f"scale={width}:{height}:flags=area", "-q:v", str(IMAGE_JPEG_QUALITY),
+        "-f", "image2pipe", "-vcodec", "mjpeg", "pipe:1",
+    ]
+    result = media_worker.run(cmd, input=bytes(data), timeout=IMAGE_RESIZE_TIMEOUT, check=True)
+    return result.stdout
+
+def prepare_image(data, detail):
+    """
+    Downscale and re-encode an image to the size the model will look at.
+
+    The original is returned unchanged if it is already small enough, is not
+    a JPEG, or re-encoding fails or does not make it smaller.
+
+    Args:
+        data (bytes): Image contents (any bytes-like object)
+        detail (str): "low", "high" or "auto"
+
+    Returns:
+        bytes: Image to upload
+    """
+    start = time.perf_counter()
+    result = data
+    size = jpeg_size(data)
+    if size is not None:
+        width, height = target_size(size[0], size[1], detail)
+        # mjpeg требует четные размеры у изображений с цветовой субдискретизацией
+        width, height = max(2, width - width % 2), max(2, height - height % 2)
+        if width < size[0] or height < size[1]:
+            try:
+                resized = _resize(data, width, height)
+                if resized and len(resized) < len(data):
+                    result = resized
+            except (OSError, subprocess.SubprocessError) as e:
+                logger.warning(f"Error resizing image: {e}")
+
+    with _stats_lock:
+        stats["images"] += 1
+        stats["resized"] += result is not data
+        stats["bytes_in"] += len(data)
+        stats["bytes_out"] += len(result)
+        stats["seconds"] += time.perf_counter() - start
+        stats["low_detail" if detail == "low" else "high_detail"] += 1
+    return result
+
+def record_download_savings(full_size, downloaded_size):
+    """Count bytes not downloaded because a smaller Telegram photo size was chosen."""
+    if not full_size or not downloaded_size:
+        return
+    with _stats_lock:
+        stats["bytes_in"] += full_size - downloaded_size
+
+def get_image_stats():
+    """
+    Get image preprocessing metrics.
+
+    Returns:
+        dict: images, resized, bytes_in (original sizes), bytes_out (uploaded),
+              bytes_saved, avg_ms per image and low/high detail counts
+    """
+    with _stats_lock:
+        snapshot = dict(stats)
+    snapshot["bytes_saved"] = snapshot["bytes_in"] - snapshot["bytes_out"]
+    snapshot["avg_ms"] = snapshot["seconds"] / snapshot["images"] * 1000 if snapshot["images"] else 0.0
+    return snapshot
+
+if __name__ == "__main__":
+    # python image_preprocessing.py photo1.jpg photo2.jpg ...
+    for path in sys.argv[1:]:
+        with open(path, "rb") as f:
+            original = f.read()
+        for detail in ("high", "low"):
+            started = time.perf_counter()
+            prepared = prepare_image(original, detail)
+            elapsed = time.perf_counter() - started
+            print(
+                f"{os.path.basename(path)} {jpeg_size(original)} detail={detail}: "
+                f"{len(original) // 1024} KB -> {len(prepared) // 1024} KB {jpeg_size(prepared)}, "
+                f"{elapsed * 1000:.0f} ms"
+            )
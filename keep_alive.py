@@ -1,12 +1,21 @@
-from flask import Flask
+import os
+import hmac
+from flask import Flask, request
 from threading import Thread
 import logging
+import update_queue
 
 # Disable Flask's default logging to avoid cluttering the console
 logging.getLogger('werkzeug').setLevel(logging.ERROR)
 
 app = Flask('')
 
+# Маршрут /webhook есть только в webhook-режиме (задан WEBHOOK_URL)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+
+# Секрет, который Telegram присылает в заголовке X-Telegram-Bot-Api-Secret-Token (обязателен в webhook-режиме)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
 @app.route('/')
 def home():
     """
@@ -22,6 +31,29 @@ def health():
     """
     return "OK", 200
 
+def webhook():
+    """
+    Receive a Telegram update in webhook mode.
+    The update is queued and acknowledged immediately; processing happens in update_queue workers.
+    Requests without the secret token are rejected, so nobody else can inject updates.
+    """
+    token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not WEBHOOK_SECRET or not hmac.compare_digest(token, WEBHOOK_SECRET):
+        return "Forbidden", 403
+    
+    update = request.get_json(silent=True)
+    if not update:
+        return "Bad Request", 400
+    
+    # 503 makes Telegram redeliver the update later (backpressure)
+    if not update_queue.submit(update):
+        return "Busy", 503
+    return "OK", 200
+
+# В режиме поллинга принимать обновления извне незачем
+if WEBHOOK_URL:
+    app.add_url_rule('/webhook', view_func=webhook, methods=['POST'])
+
 def run():
     """
     Run the Flask server on port 8080 with host 0.0.0.0 
@@ -4,6 +4,14 @@
 # База знаний для бота Cookie AI
 # Содержит основную информацию, которую бот должен знать
 
+import os
+import re
+import math
+import time
+import threading
+from collections import Counter, defaultdict
+from token_counter import count_tokens
+
 COOKIE_AI_KNOWLEDGE = """
 # Основная информация о Cookie AI
 
@@ -168,4 +176,204 @@ def get_knowledge_base():
     Returns:
         str: Строка с базой знаний
     """
-    return COOKIE_AI_KNOWLEDGE
\ No newline at end of file
+    return COOKIE_AI_KNOWLEDGE
+
+
+# ---------------------------------------------------------------------------
+# Поиск по базе знаний (BM25)
+# Вместо того чтобы вставлять всю базу знаний в каждый промпт, разбиваем ее на
+# записи (пункты разделов и пары вопрос-ответ) и подставляем только top-k
+# записей, релевантных последним сообщениям пользователя.
+# ---------------------------------------------------------------------------
+
+# Сколько записей подставлять в промпт
+KB_TOP_K = int(os.getenv("KB_TOP_K", "6"))
+
+# Разделы, которые всегда попадают в промпт (базовые факты о боте)
+PINNED_SECTIONS = ["О проекте и создателе"]
+
+# Параметры BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_STOP_WORDS = {
+    "и", "в", "во", "на", "с", "со", "по", "к", "ко", "о", "об", "от", "до", "из", "за", "для",
+    "не", "ни", "а", "но", "или", "что", "как", "это", "то", "же", "ли", "бы", "у", "я", "ты",
+    "он", "она", "оно", "мы", "вы", "они", "мне", "тебя", "тебе", "его", "ее", "её", "их",
+    "так", "там", "тут", "вот", "все", "всё", "уже", "еще", "ещё", "есть", "был", "была",
+    "году", "года", "год", "the", "a", "an", "is", "are", "of", "to", "in", "and",
+}
+
+# Простейший стемминг для русского: обрезаем длинные слова до общей основы,
+# чтобы "создал", "создателе" и "создан" совпадали
+STEM_LENGTH = 5
+
+def tokenize(text):
+    """
+    Split text into normalized search terms.
+
+    Args:
+        text (str): Text to tokenize
+
+    Returns:
+        list: Lowercased, stemmed terms without stop words
+    """
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower().replace("ё", "е")):
+        if token in _STOP_WORDS or len(token) < 2:
+            continue
+        terms.append(token[:STEM_LENGTH])
+    return terms
+
+def parse_knowledge_base(text=COOKIE_AI_KNOWLEDGE):
+    """
+    Split the knowledge base into sections and entries.
+
+    Every bullet of a section becomes one entry; a question with its answer
+    in the FAQ section is kept together as a single entry.
+
+    Args:
+        text (str): Knowledge base in the markdown-like format of COOKIE_AI_KNOWLEDGE
+
+    Returns:
+        list: Dicts with 'section' and 'text' keys, in document order
+    """
+    entries = []
+    section = ""
+    current = None
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("## "):
+            section = stripped[3:].strip()
+            current = None
+        elif stripped.startswith("- "):
+            current = {"section": section, "text": stripped}
+            entries.append(current)
+        elif stripped and current is not None:
+            # Продолжение пункта (например, строка "**Ответ**: ...")
+            current["text"] += "\n  " + stripped
+        elif not stripped:
+            current = None
+
+    return entries
+
+class KnowledgeIndex:
+    """In-memory inverted index with BM25 ranking over knowledge base entries."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.postings = defaultdict(list)  # term -> [(entry_idx, term_freq), ...]
+        self.doc_lengths = []
+
+        for idx, entry in enumerate(entries):
+            # Название раздела тоже участвует в поиске
+            terms = tokenize(entry["section"] + " " + entry["text"])
+            self.doc_lengths.append(len(terms))
+            for term, freq in Counter(terms).items():
+                self.postings[term].append((idx, freq))
+
+        self.avg_doc_length = sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0.0
+        num_docs = len(entries)
+        self.idf = {
+            term: math.log(1 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query, top_k=KB_TOP_K):
+        """
+        Rank entries against a query.
+
+        Args:
+            query (str): Free-text query
+            top_k (int): Maximum number of entries to return
+
+        Returns:
+            list: (entry_idx, score) tuples, best first
+        """
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for idx, freq in self.postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[idx] / self.avg_doc_length)
+                scores[idx] += idf * freq * (BM25_K1 + 1) / (freq + norm)
+
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
+
+_entries = parse_knowledge_base()
+_index = KnowledgeIndex(_entries)
+_pinned_text = "\n".join(
+    entry["text"] for entry in _entries if entry["section"] in PINNED_SECTIONS
+)
+
+_stats_lock = threading.Lock()
+retrieval_stats = {
+    "queries": 0,
+    "total_seconds": 0.0,
+    "total_chars": 0,
+    "total_tokens": 0,
+}
+
+def search_knowledge_base(query, top_k=KB_TOP_K):
+    """
+    Build the knowledge base fragment relevant to a query.
+
+    The pinned sections are always included; the top-k entries found by
+    BM25 are appended, grouped under their section headings.
+
+    Args:
+        query (str): Recent user messages
+        top_k (int): Maximum number of retrieved entries
+
+    Returns:
+        str: Knowledge base fragment to put into the system prompt
+    """
+    start = time.perf_counter()
+
+    hits = [idx for idx, _ in _index.search(query, top_k)] if query else []
+    # Keep document order so related facts stay together
+    by_section = {}
+    for idx in sorted(hits):
+        entry = _entries[idx]
+        if entry["section"] in PINNED_SECTIONS:
+            continue
+        by_section.setdefault(entry["section"], []).append(entry["text"])
+
+    parts = ["## " + PINNED_SECTIONS[0], _pinned_text] if _pinned_text else []
+    for section, texts in by_section.items():
+        parts.append("## " + section)
+        parts.extend(texts)
+    result = "\n".join(parts)
+
+    elapsed = time.perf_counter() - start
+    tokens = count_tokens(result)
+    with _stats_lock:
+        retrieval_stats["queries"] += 1
+        retrieval_stats["total_seconds"] += elapsed
+        retrieval_stats["total_chars"] += len(result)
+        retrieval_stats["total_tokens"] += tokens
+
+    return result
+
+def get_retrieval_stats():
+    """
+    Get retrieval metrics.
+
+    Returns:
+        dict: Number of queries, average retrieval latency and the average size
+              (chars and tokens) of the injected fragment compared to the full knowledge base
+    """
+    with _stats_lock:
+        snapshot = dict(retrieval_stats)
+    queries = snapshot["queries"]
+    snapshot["avg_seconds"] = snapshot["total_seconds"] / queries if queries else 0.0
+    snapshot["avg_chars"] = snapshot["total_chars"] / queries if queries else 0
+    snapshot["avg_tokens"] = snapshot["total_tokens"] / queries if queries else 0
+    snapshot["full_chars"] = len(COOKIE_AI_KNOWLEDGE)
+    snapshot["full_tokens"] = count_tokens(COOKIE_AI_KNOWLEDGE)
+    snapshot["entries"] = len(_entries)
+    return snapshot
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Слой провайдеров LLM: все обращения к OpenAI-совместимым API идут через него.
+# Один клиент (с пулом keep-alive соединений) на каждую пару адрес + ключ,
+# таймауты на каждый вызов и автоматическое переключение на запасной провайдер
+# или более дешевую модель, если основной отвечает с ошибками или слишком медленно.
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+import resilience
+import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Основной провайдер
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+TRANSCRIPTION_MODEL = os.getenv("TRANSCRIPTION_MODEL", "whisper-1")
+
+# Запасной провайдер: другой OpenAI-совместимый API (FALLBACK_BASE_URL / FALLBACK_API_KEY)
+# или, если они не заданы, более дешевая модель у основного. Пустой FALLBACK_MODEL отключает переключение.
+FALLBACK_BASE_URL = os.getenv("FALLBACK_BASE_URL") or None
+FALLBACK_API_KEY = os.getenv("FALLBACK_API_KEY") or None
+FALLBACK_MODEL = os.getenv("FALLBACK_MODEL", "gpt-4o-mini")
+
+# Таймаут одного запроса (секунды)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+TRANSCRIPTION_TIMEOUT = float(os.getenv("TRANSCRIPTION_TIMEOUT", "120"))
+
+# Когда провайдер считается нездоровым: по последним PROVIDER_HEALTH_WINDOW запросам
+# доля ошибок выше PROVIDER_MAX_ERROR_RATE или средняя задержка выше PROVIDER_MAX_LATENCY.
+# Нездоровый провайдер пропускается PROVIDER_COOLDOWN секунд, потом снова пробуется.
+PROVIDER_HEALTH_WINDOW = int(os.getenv("PROVIDER_HEALTH_WINDOW", "20"))
+PROVIDER_MIN_SAMPLES = 5
+PROVIDER_MAX_ERROR_RATE = float(os.getenv("PROVIDER_MAX_ERROR_RATE", "0.5"))
+PROVIDER_MAX_LATENCY = float(os.getenv("PROVIDER_MAX_LATENCY", "20"))
+PROVIDER_COOLDOWN = float(os.getenv("PROVIDER_COOLDOWN", "30"))
+
+# Клиенты SDK, общие для провайдеров с одинаковым адресом и ключом.
+# Structure: {(base_url, api_key, is_async): client}
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _get_sdk_client(base_url, api_key, is_async=False):
+    """Get a shared (pooled, keep-alive) OpenAI SDK client, creating it on first use."""
+    key = (base_url, api_key, is_async)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                from openai import OpenAI, AsyncOpenAI
+                client_class = AsyncOpenAI if is_async else OpenAI
+                # Повторы выполняет слой выше, SDK не должен повторять сам
+                client = client_class(api_key=api_key, base_url=base_url, timeout=LLM_TIMEOUT, max_retries=0)
+                _clients[key] = client
+    return client
+
+class Provider:
+    """One OpenAI-compatible endpoint + model, with a sliding window of recent outcomes."""
+
+    def __init__(self, name, model, api_key, base_url=None, transcription_model=TRANSCRIPTION_MODEL):
+        self.name = name
+        self.model = model
+        self.api_key = api_key
+        self.base_url = base_url
+        self.transcription_model = transcription_model
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=PROVIDER_HEALTH_WINDOW)  # (ok, latency)
+        self._unhealthy_until = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def client(self):
+        return _get_sdk_client(self.base_url, self.api_key)
+
+    @property
+    def async_client(self):
+        return _get_sdk_client(self.base_url, self.api_key, is_async=True)
+
+    def record(self, ok, latency):
+        """
+        Record the outcome of a call and re-evaluate the provider's health.
+
+        Args:
+            ok (bool): Whether the call succeeded
+            latency (float): Call duration in seconds
+        """
+        with self._lock:
+            self.requests += 1
+            if not ok:
+                self.failures += 1
+            self._outcomes.append((ok, latency))
+            if len(self._outcomes) < PROVIDER_MIN_SAMPLES:
+                return
+            error_rate, avg_latency = self._health_locked()
+            if error_rate > PROVIDER_MAX_ERROR_RATE or avg_latency > PROVIDER_MAX_LATENCY:
+                if time.time() >= self._unhealthy_until:
+                    logger.warning(
+                        f"Provider {self.name} is unhealthy (errors {error_rate:.0%}, "
+                        f"latency {avg_latency:.1f}s), failing over for {PROVIDER_COOLDOWN:.0f}s"
+                    )
+                self._unhealthy_until = time.time() + PROVIDER_COOLDOWN
+                # После паузы провайдер оценивается заново
+                self._outcomes.clear()
+
+    def _health_locked(self):
+        if not self._outcomes:
+            return 0.0, 0.0
+        errors = sum(1 for ok, _ in self._outcomes if not ok)
+        latency = sum(latency for _, latency in self._outcomes) / len(self._outcomes)
+        return errors / len(self._outcomes), latency
+
+    def is_healthy(self):
+        return time.time() >= self._unhealthy_until
+
+    def stats(self):
+        with self._lock:
+            error_rate, avg_latency = self._health_locked()
+            return {
+                "model": self.model,
+                "healthy": self.is_healthy(),
+                "requests": self.requests,
+                "failures": self.failures,
+                "error_rate": error_rate,
+                "avg_latency": avg_latency,
+            }
+
+def _build_providers():
+    providers = [Provider("openai", LLM_MODEL, OPENAI_API_KEY, OPENAI_BASE_URL)]
+    if FALLBACK_BASE_URL or FALLBACK_API_KEY:
+        providers.append(Provider(
+            "fallback",
+            FALLBACK_MODEL or LLM_MODEL,
+            FALLBACK_API_KEY or OPENAI_API_KEY,
+            FALLBACK_BASE_URL or OPENAI_BASE_URL,
+        ))
+    elif FALLBACK_MODEL and FALLBACK_MODEL != LLM_MODEL:
+        providers.append(Provider("openai-fallback", FALLBACK_MODEL, OPENAI_API_KEY, OPENAI_BASE_URL))
+    return providers
+
+# Провайдеры в порядке приоритета
+providers = _build_providers()
+
+def _ordered_providers():
+    """Healthy providers first (in priority order), then the ones cooling down as a last resort."""
+    healthy = [provider for provider in providers if provider.is_healthy()]
+    return healthy + [provider for provider in providers if provider not in healthy]
+
+def _model_for(provider, model):
+    # Явно заданная модель (например, для суммаризации) относится к основному провайдеру,
+    # запасные всегда используют свою
+    return model if model and provider is providers[0] else provider.model
+
+def _limited_call(call, provider, model_name, tokens, user_id):
+    """
+    Wait for rate limiter capacity, make the call and refund over-estimated tokens.
+
+    Returns:
+        tuple: (result, call duration excluding the time spent in the limiter queue)
+    """
+    limiter = rate_limiter.get_limiter(model_name)
+    if limiter is not None:
+        limiter.acquire(tokens, user_id)
+    started = time.perf_counter()
+    result = call(provider, model_name)
+    _refund_unused(limiter, tokens, result)
+    return result, time.perf_counter() - started
+
+async def _limited_call_async(call, provider, model_name, tokens, user_id):
+    limiter = rate_limiter.get_limiter(model_name)
+    if limiter is not None:
+        await limiter.acquire_async(tokens, user_id)
+    started = time.perf_counter()
+    result = await call(provider, model_name)
+    _refund_unused(limiter, tokens, result)
+    return result, time.perf_counter() - started
+
+def _refund_unused(limiter, tokens, result):
+    usage = getattr(result, "usage", None)
+    if limiter is not None and usage is not None and getattr(usage, "total_tokens", None):
+        limiter.refund(tokens - usage.total_tokens)
+
+def _is_request_error(error):
+    """API error with a non-retryable status code: the request itself is at fault, not the provider."""
+    return getattr(error, "status_code", None) is not None and not resilience.is_retryable(error)
+
+def _call_with_failover(action, call, model=None, transcription=False, tokens=0, user_id=None):
+    """
+    Try providers in order. Each attempt goes through retries and the model's
+    circuit breaker; an open breaker moves on to the next provider immediately.
+    Non-retryable API errors (e.g. 400) are raised at once without failover.
+    """
+    last_error = None
+    for provider in _ordered_providers():
+        model_name = provider.transcription_model if transcription else _model_for(provider, model)
+        breaker = resilience.get_breaker(f"{provider.name}/{model_name}")
+        started = time.perf_counter()
+        try:
+            result, latency = resilience.call_with_retry(
+                lambda: _limited_call(call, provider, model_name, tokens, user_id), breaker
+            )
+        except resilience.CircuitOpenError as e:
+            last_error = e
+            continue
+        except rate_limiter.RateLimitTimeout as e:
+            # Запрос ждал в нашей собственной очереди и до провайдера не дошел —
+            # на здоровье провайдера это не влияет, пробуем следующую модель
+            logger.warning(f"{action} via {provider.name} not sent: {e}")
+            last_error = e
+            continue
+        except Exception as e:
+            if _is_request_error(e):
+                # 400/401/404/422 вызваны самим запросом (слишком длинный промпт, плохое
+                # изображение): другой провайдер ответит так же, а здоровье этого не страдает
+                logger.warning(f"{action} via {provider.name} rejected: {e}")
+                raise
+            provider.record(False, time.perf_counter() - started)
+            logger.warning(f"{action} via {provider.name} failed: {e}")
+            last_error = e
+            continue
+        provider.record(True, latency)
+        return result
+    raise last_error
+
+async def _call_with_failover_async(action, call, model=None, transcription=False, tokens=0, user_id=None):
+    last_error = None
+    for provider in _ordered_providers():
+        model_name = provider.transcription_model if transcription else _model_for(provider, model)
+        breaker = resilience.get_breaker(f"{provider.name}/{model_name}")
+        started = time.perf_counter()
+        try:
+            result, latency = await resilience.call_with_retry_async(
+                lambda: _limited_call_async(call, provider, model_name, tokens, user_id), breaker
+            )
+        except resilience.CircuitOpenError as e:
+            last_error = e
+            continue
+        except rate_limiter.RateLimitTimeout as e:
+            # Запрос ждал в нашей собственной очереди и до провайдера не дошел —
+            # на здоровье провайдера это не влияет, пробуем следующую модель
+            logger.warning(f"{action} via {provider.name} not sent: {e}")
+            last_error = e
+            continue
+        except Exception as e:
+            if _is_request_error(e):
+                # 400/401/404/422 вызваны самим запросом (слишком длинный промпт, плохое
+                # изображение): другой провайдер ответит так же, а здоровье этого не страдает
+                logger.warning(f"{action} via {provider.name} rejected: {e}")
+                raise
+            provider.record(False, time.perf_counter() - started)
+            logger.warning(f"{action} via {provider.name} failed: {e}")
+            last_error = e
+            continue
+        provider.record(True, latency)
+        return result
+    raise last_error
+
+def chat_completion(messages, max_tokens, temperature=0.7, model=None, stream=False, timeout=None, user_id=None):
+    """
+    Create a chat completion, failing over to the next provider on errors.
+
+    For streaming calls only opening the stream is covered by failover; the
+    latency recorded is the time until the stream is open.
+
+    Args:
+        messages (list): Chat messages
+        max_tokens (int): Maximum tokens in the response
+        temperature (float): Sampling temperature
+        model (str, optional): Model for the primary provider (default: LLM_MODEL)
+        stream (bool): Return a stream of chunks instead of a full response
+        timeout (float, optional): Per-call timeout in seconds (default: LLM_TIMEOUT)
+        user_id (optional): Requesting user, for fair queueing in the rate limiter
+
+    Returns:
+        The SDK response object (or stream)
+    """
+    return _call_with_failover("Chat completion", lambda provider, model_name: provider.client.chat.completions.create(
+        model=model_name,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stream=stream,
+        timeout=timeout or LLM_TIMEOUT,
+    ), model, tokens=rate_limiter.estimate_tokens(messages, max_tokens), user_id=user_id)
+
+async def chat_completion_async(messages, max_tokens, temperature=0.7, model=None, stream=False, timeout=None, user_id=None):
+    """Async version of chat_completion."""
+    return await _call_with_failover_async("Chat completion", lambda provider, model_name: provider.async_client.chat.completions.create(
+        model=model_name,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stream=stream,
+        timeout=timeout or LLM_TIMEOUT,
+    ), model, tokens=rate_limiter.estimate_tokens(messages, max_tokens), user_id=user_id)
+
+def transcribe(file, language="ru", timeout=None):
+    """
+    Transcribe audio, failing over to the next provider on errors.
+
+    Args:
+        file (tuple): (filename, bytes) so the upload can be repeated on failover
+        language (str): Audio language
+        timeout (float, optional): Per-call timeout in seconds (default: TRANSCRIPTION_TIMEOUT)
+
+    Returns:
+        str: Transcribed text
+    """
+    return _call_with_failover("Transcription", lambda provider, model_name: provider.client.audio.transcriptions.create(
+        model=model_name,
+        file=file,
+        language=language,
+        timeout=timeout or TRANSCRIPTION_TIMEOUT,
+    ), transcription=True).text
+
+async def transcribe_async(file, language="ru", timeout=None):
+    """Async version of transcribe."""
+    transcript = await _call_with_failover_async("Transcription", lambda provider, model_name: provider.async_client.audio.transcriptions.create(
+        model=model_name,
+        file=file,
+        language=language,
+        timeout=timeout or TRANSCRIPTION_TIMEOUT,
+    ), transcription=True)
+    return transcript.text
+
+def get_provider_stats():
+    """
+    Get per-provider request counters and health.
+
+    Returns:
+        dict: {provider name: stats dict}
+    """
+    return {provider.name: provider.stats() for provider in providers}
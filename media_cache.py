@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Кэш результатов анализа фото и видео.
+# Telegram присваивает каждому файлу постоянный file_unique_id, одинаковый у всех
+# пользователей, поэтому пересланный мем или вирусное видео анализируется один раз:
+# при попадании в кэш не нужно ни скачивать файл, ни вызывать GPT-4o vision.
+
+import os
+import json
+import time
+import atexit
+import hashlib
+import logging
+import threading
+from response_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Сколько результатов анализа хранить
+MEDIA_CACHE_SIZE = int(os.getenv("MEDIA_CACHE_SIZE", "5000"))
+
+# Файл для сохранения кэша между перезапусками (пусто — только в памяти)
+MEDIA_CACHE_FILE = os.getenv("MEDIA_CACHE_FILE", "")
+
+# Как часто (в секундах) изменившийся кэш записывается на диск
+MEDIA_CACHE_SAVE_INTERVAL = float(os.getenv("MEDIA_CACHE_SAVE_INTERVAL", "300"))
+
+_cache = LRUCache(MEDIA_CACHE_SIZE)
+_dirty = False
+_save_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+stats = {
+    "hits": 0,
+    "misses": 0,
+    "stored": 0,
+}
+
+def make_key(kind, file_unique_id, prompt=None):
+    """
+    Build the cache key for a media analysis.
+
+    Args:
+        kind (str): "photo", "video" or "video_note"
+        file_unique_id (str): Telegram's stable file identifier (or a content hash)
+        prompt (str, optional): The analysis prompt; different captions give different answers
+
+    Returns:
+        str: Cache key
+    """
+    prompt_hash = hashlib.sha1((prompt or "").encode("utf-8")).hexdigest()[:16]
+    return f"{kind}:{file_unique_id}:{prompt_hash}"
+
+def get(key):
+    """
+    Get a cached analysis.
+
+    Returns:
+        str: The analysis, or None on a miss
+    """
+    analysis = _cache.get(key)
+    with _stats_lock:
+        stats["hits" if analysis is not None else "misses"] += 1
+    return analysis
+
+def put(key, analysis):
+    """
+    Cache an analysis result. Apologies (errors and refusals) are not cached.
+
+    Args:
+        key (str): Key from make_key
+        analysis (str): The model's answer
+    """
+    global _dirty
+    if not analysis or analysis.startswith("Извините"):
+        return
+    _cache.put(key, analysis)
+    _dirty = True
+    with _stats_lock:
+        stats["stored"] += 1
+
+def load():
+    """Load the persisted cache (if MEDIA_CACHE_FILE is set) and start the periodic saver."""
+    if not MEDIA_CACHE_FILE:
+        return
+    if os.path.exists(MEDIA_CACHE_FILE):
+        try:
+            with open(MEDIA_CACHE_FILE, 'r', encoding='utf-8') as f:
+                for key, analysis in json.load(f):
+                    _cache.put(key, analysis)
+            logger.info(f"Loaded {len(_cache)} media analyses from {MEDIA_CACHE_FILE}")
+        except Exception as e:
+            logger.error(f"Error loading media cache: {e}")
+
+    threading.Thread(target=_save_loop, name="media-cache-save", daemon=True).start()
+    atexit.register(save)
+
+def save():
+    """Write the cache to MEDIA_CACHE_FILE if it changed since the last save."""
+    global _dirty
+    if not MEDIA_CACHE_FILE or not _dirty:
+        return
+    with _save_lock:
+        _dirty = False
+        tmp_path = MEDIA_CACHE_FILE + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(_cache.items(), f, ensure_ascii=False)
+            os.replace(tmp_path, MEDIA_CACHE_FILE)
+        except Exception as e:
+            logger.error(f"Error saving media cache: {e}")
+            _dirty = True
+
+def _save_loop():
+    while True:
+        time.sleep(MEDIA_CACHE_SAVE_INTERVAL)
+        save()
+
+def get_media_cache_stats():
+    """
+    Get media cache metrics.
+
+    Returns:
+        dict: hits, misses, stored, entries and hit_rate
+    """
+    with _stats_lock:
+        snapshot = dict(stats)
+    snapshot["entries"] = len(_cache)
+    lookups = snapshot["hits"] + snapshot["misses"]
+    snapshot["hit_rate"] = snapshot["hits"] / lookups if lookups else 0.0
+    return snapshot
+
+load()
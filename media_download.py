@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Потоковое скачивание файлов из Telegram.
+# bot.download_file возвращает весь файл одним объектом bytes, поэтому 20 МБ
+# видео занимали 20+ МБ памяти на каждый одновременный запрос. Здесь файл читается
+# кусками через общий пул соединений и пишется сразу в файл назначения (видео для
+# ffmpeg) или в буфер (небольшие фото и голосовые). Размер проверяется заранее по
+# file_info.file_size и еще раз по ходу скачивания, скачивание можно отменить.
+
+import os
+import time
+import atexit
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+from media_worker import MediaTooLargeError, MEDIA_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Размер куска при скачивании (байты)
+MEDIA_DOWNLOAD_CHUNK = int(os.getenv("MEDIA_DOWNLOAD_CHUNK", str(256 * 1024)))
+
+# Сколько соединений с серверами Telegram держать открытыми
+MEDIA_DOWNLOAD_POOL = int(os.getenv("MEDIA_DOWNLOAD_POOL", "10"))
+
+# Таймауты подключения и чтения (секунды)
+MEDIA_DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv("MEDIA_DOWNLOAD_CONNECT_TIMEOUT", "10"))
+MEDIA_DOWNLOAD_READ_TIMEOUT = float(os.getenv("MEDIA_DOWNLOAD_READ_TIMEOUT", "30"))
+
+class DownloadCancelled(Exception):
+    """Raised when a download is cancelled (per request or on shutdown)."""
+
+_session = None
+_session_lock = threading.Lock()
+_shutdown = threading.Event()
+
+_stats_lock = threading.Lock()
+stats = {
+    "downloads": 0,
+    "bytes": 0,
+    "seconds": 0.0,
+    "too_large": 0,
+    "cancelled": 0,
+    "failed": 0,
+}
+
+def _get_session():
+    """Create the pooled HTTP session on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=MEDIA_DOWNLOAD_POOL, pool_maxsize=MEDIA_DOWNLOAD_POOL)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def file_url(token, file_path):
+    """Download URL for a Telegram file (honours a custom Bot API server set in apihelper.FILE_URL)."""
+    if apihelper.FILE_URL is None:
+        return f"https://api.telegram.org/file/bot{token}/{file_path}"
+    return apihelper.FILE_URL.format(token, file_path)
+
+def _count(key):
+    with _stats_lock:
+        stats[key] += 1
+
+def _too_large(size, max_bytes):
+    _count("too_large")
+    raise MediaTooLargeError(f"Media file is too large: {size} bytes > {max_bytes}")
+
+def download(token, file_info, destination=None, max_bytes=MEDIA_MAX_BYTES, cancel_event=None):
+    """
+    Stream a Telegram file to disk or into memory in chunks.
+
+    Args:
+        token (str): Bot token
+        file_info (File): Result of bot.get_file (file_path and, usually, file_size)
+        destination (str, optional): Path to write to; the contents are returned as bytes if omitted
+        max_bytes (int): Largest accepted file (0 for no limit)
+        cancel_event (threading.Event, optional): Set it to abort the download
+
+    Returns:
+        str or bytes: The destination path, or the file contents
+
+    Raises:
+        MediaTooLargeError: If the file is larger than max_bytes (checked before and during the download)
+        DownloadCancelled: If cancel_event was set or the bot is shutting down
+        requests.RequestException: On network errors and non-200 responses
+    """
+    if max_bytes and file_info.file_size and file_info.file_size > max_bytes:
+        _too_large(file_info.file_size, max_bytes)
+
+    start = time.perf_counter()
+    received = 0
+    buffer = bytearray() if destination is None else None
+    output = None
+    try:
+        with _get_session().get(
+            file_url(token, file_info.file_path),
+            stream=True,
+            timeout=(MEDIA_DOWNLOAD_CONNECT_TIMEOUT, MEDIA_DOWNLOAD_READ_TIMEOUT),
+            proxies=apihelper.proxy,
+        ) as response:
+            response.raise_for_status()
+            length = int(response.headers.get("Content-Length") or 0)
+            if max_bytes and length > max_bytes:
+                _too_large(length, max_bytes)
+
+            if destination is not None:
+                output = open(destination, "wb")
+            for chunk in response.iter_content(MEDIA_DOWNLOAD_CHUNK):
+                if _shutdown.is_set() or (cancel_event is not None and cancel_event.is_set()):
+                    _count("cancelled")
+                    raise DownloadCancelled(f"Download of {file_info.file_path} cancelled")
+                received += len(chunk)
+                if max_bytes and received > max_bytes:
+                    _too_large(received, max_bytes)
+                if output is not None:
+                    output.write(chunk)
+                else:
+                    buffer += chunk
+    except (MediaTooLargeError, DownloadCancelled):
+        _remove_partial(output, destination)
+        raise
+    except Exception:
+        _count("failed")
+        _remove_partial(output, destination)
+        raise
+
+    if output is not None:
+        output.close()
+    with _stats_lock:
+        stats["downloads"] += 1
+        stats["bytes"] += received
+        stats["seconds"] += time.perf_counter() - start
+    return destination if destination is not None else bytes(buffer)
+
+def _remove_partial(output, destination):
+    if output is None:
+        return
+    output.close()
+    try:
+        os.remove(destination)
+    except OSError:
+        pass
+
+def cancel_all():
+    """Abort every running download and refuse new chunks (used on shutdown)."""
+    _shutdown.set()
+
+atexit.register(cancel_all)
+
+def get_download_stats():
+    """
+    Get download metrics.
+
+    Returns:
+        dict: downloads, bytes, average speed (MB/s) and too_large/cancelled/failed counters
+    """
+    with _stats_lock:
+        snapshot = dict(stats)
+    snapshot["mb_per_second"] = snapshot["bytes"] / snapshot["seconds"] / 1024 / 1024 if snapshot["seconds"] else 0.0
+    return snapshot
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Отдельный пул для тяжелой обработки медиа (ffmpeg, ffprobe).
+# Все внешние процессы запускаются через run(): одновременно работает не больше
+# MEDIA_WORKERS процессов, остальные ждут в своей очереди (по порядку поступления),
+# процессы получают пониженный приоритет, а зависшие убиваются по таймауту. Так
+# пара больших видео не отнимает процессор и потоки у текстовых ответов, а размер
+# медиа-уровня настраивается отдельно от обработчиков чата.
+
+import os
+import time
+import atexit
+import logging
+import asyncio
+import threading
+import subprocess
+import contextvars
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Сколько процессов ffmpeg может работать одновременно
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+# Сколько задач может ждать в очереди и как долго (в секундах)
+MEDIA_QUEUE_SIZE = int(os.getenv("MEDIA_QUEUE_SIZE", "20"))
+MEDIA_QUEUE_TIMEOUT = float(os.getenv("MEDIA_QUEUE_TIMEOUT", "30"))
+
+# Таймаут одной задачи по умолчанию (секунды)
+MEDIA_JOB_TIMEOUT = float(os.getenv("MEDIA_JOB_TIMEOUT", "60"))
+
+# Приоритет (nice) процессов ffmpeg: чем больше, тем меньше они мешают остальному боту
+MEDIA_NICE = int(os.getenv("MEDIA_NICE", "10"))
+
+# Ограничения на входящие файлы: размер (байты) и длительность (секунды)
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(20 * 1024 * 1024)))
+MEDIA_MAX_DURATION = int(os.getenv("MEDIA_MAX_DURATION", "600"))
+
+# Как часто (в секундах) задача проверяет, не отменил ли ее обработчик
+MEDIA_CANCEL_POLL = float(os.getenv("MEDIA_CANCEL_POLL", "0.2"))
+
+class MediaWorkerError(subprocess.SubprocessError):
+    """Base class for media pool errors."""
+
+class MediaBusyError(MediaWorkerError):
+    """Raised when the media queue is full, the wait timed out or the pool was cancelled."""
+
+class MediaTooLargeError(MediaWorkerError):
+    """Raised when a file exceeds MEDIA_MAX_BYTES or MEDIA_MAX_DURATION."""
+
+class MediaCancelledError(MediaWorkerError):
+    """Raised when the caller cancelled the job; a running process is killed."""
+
+_cond = threading.Condition()
+_waiting = deque()  # билеты задач в порядке поступления
+_running = set()  # запущенные процессы (для отмены)
+_slots_used = 0
+_cancelled = False
+
+# Событие отмены для задач, запущенных из to_thread(): asyncio.to_thread копирует
+# контекст в поток, поэтому run() находит его без передачи через все вызовы
+_cancel_scope = contextvars.ContextVar("media_cancel_event", default=None)
+
+_stats = {
+    "completed": 0,
+    "failed": 0,
+    "timeouts": 0,
+    "rejected": 0,
+    "too_large": 0,
+    "cancelled": 0,
+    "total_wait": 0.0,
+    "total_run": 0.0,
+    "max_wait": 0.0,
+}
+
+def check_limits(file_size=None, duration=None):
+    """
+    Check an incoming file against MEDIA_MAX_BYTES and MEDIA_MAX_DURATION before downloading it.
+
+    Args:
+        file_size (int, optional): Size in bytes as reported by Telegram
+        duration (int, optional): Duration in seconds as reported by Telegram
+
+    Raises:
+        MediaTooLargeError: If a limit is exceeded
+    """
+    reason = None
+    if file_size and MEDIA_MAX_BYTES and file_size > MEDIA_MAX_BYTES:
+        reason = f"{file_size} bytes > {MEDIA_MAX_BYTES}"
+    elif duration and MEDIA_MAX_DURATION and duration > MEDIA_MAX_DURATION:
+        reason = f"{duration} s > {MEDIA_MAX_DURATION}"
+    if reason:
+        with _cond:
+            _stats["too_large"] += 1
+        raise MediaTooLargeError(f"Media file is too large: {reason}")
+
+def _acquire_slot(cancel_event=None):
+    """Wait for a free worker slot in FIFO order. Returns seconds waited."""
+    global _slots_used
+    started = time.monotonic()
+    ticket = object()
+    with _cond:
+        if _cancelled:
+            raise MediaBusyError("Media pool is shut down")
+        if len(_waiting) >= MEDIA_QUEUE_SIZE:
+            _stats["rejected"] += 1
+            raise MediaBusyError("Media queue is full")
+        _waiting.append(ticket)
+        try:
+            while _waiting[0] is not ticket or _slots_used >= MEDIA_WORKERS:
+                remaining = MEDIA_QUEUE_TIMEOUT - (time.monotonic() - started)
+                if cancel_event is not None and cancel_event.is_set():
+                    _stats["cancelled"] += 1
+                    raise MediaCancelledError("Media job cancelled while queued")
+                if _cancelled or remaining <= 0:
+                    _stats["rejected"] += 1
+                    raise MediaBusyError("Media queue wait timed out" if not _cancelled else "Media pool is shut down")
+                _cond.wait(remaining if cancel_event is None else min(remaining, MEDIA_CANCEL_POLL))
+        finally:
+            _waiting.remove(ticket)
+            _cond.notify_all()
+        _slots_used += 1
+        waited = time.monotonic() - started
+        _stats["total_wait"] += waited
+        _stats["max_wait"] = max(_stats["max_wait"], waited)
+        return waited
+
+def _release_slot():
+    global _slots_used
+    with _cond:
+        _slots_used -= 1
+        _cond.notify_all()
+
+def run(cmd, input=None, timeout=None, check=False, pass_fds=(), cancel_event=None):
+    """
+    Run a media command (ffmpeg, ffprobe) in the bounded media pool.
+
+    Works like subprocess.run with stdout/stderr captured. File descriptors in
+    pass_fds are inherited by the child and closed in this process once it has
+    started (or if the job never starts), so a reader on the other end of a
+    pipe sees EOF when the child exits.
+
+    Setting cancel_event removes a queued job from the queue or kills the
+    running process. Without it, the event of the enclosing to_thread() call
+    (if any) is used.
+
+    Args:
+        cmd (list): Command and arguments
+        input (bytes, optional): Data for the child's stdin
+        timeout (float, optional): Seconds before the process is killed (MEDIA_JOB_TIMEOUT by default)
+        check (bool): Raise CalledProcessError on a non-zero exit code
+        pass_fds (tuple): Extra file descriptors to hand to the child
+        cancel_event (threading.Event, optional): Set by the caller to abandon the job
+
+    Returns:
+        subprocess.CompletedProcess: With stdout and stderr as bytes
+
+    Raises:
+        MediaBusyError: If the queue is full, the wait timed out or the pool is shut down
+        MediaCancelledError: If cancel_event was set before the job finished
+        subprocess.TimeoutExpired: If the job ran longer than the timeout (the process is killed)
+    """
+    timeout = timeout or MEDIA_JOB_TIMEOUT
+    if cancel_event is None:
+        cancel_event = _cancel_scope.get()
+    try:
+        _acquire_slot(cancel_event)
+    except MediaWorkerError:
+        for fd in pass_fds:
+            os.close(fd)
+        raise
+
+    started = time.monotonic()
+    process = None
+    try:
+        try:
+            process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                pass_fds=pass_fds,
+            )
+        finally:
+            for fd in pass_fds:
+                os.close(fd)
+        try:
+            # Пониженный приоритет: медиа не должно отнимать процессор у текстовых ответов
+            os.setpriority(os.PRIO_PROCESS, process.pid, MEDIA_NICE)
+        except (AttributeError, OSError):
+            pass
+        with _cond:
+            _running.add(process)
+
+        stdout, stderr = _communicate(process, cmd, input, timeout, cancel_event)
+
+        with _cond:
+            _stats["completed" if process.returncode == 0 else "failed"] += 1
+        if check and process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+        return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+    finally:
+        with _cond:
+            _running.discard(process)
+            _stats["total_run"] += time.monotonic() - started
+        _release_slot()
+
+def _communicate(process, cmd, input, timeout, cancel_event):
+    """process.communicate() that kills the process on timeout or when cancel_event is set."""
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        step = remaining if cancel_event is None else min(remaining, MEDIA_CANCEL_POLL)
+        try:
+            # Входные данные передаются только в первый вызов, повторный communicate продолжает запись
+            return process.communicate(input, timeout=max(step, 0))
+        except subprocess.TimeoutExpired:
+            input = None
+            cancelled = cancel_event is not None and cancel_event.is_set()
+            if not cancelled and time.monotonic() < deadline:
+                continue
+            process.kill()
+            process.communicate()
+            with _cond:
+                _stats["cancelled" if cancelled else "timeouts"] += 1
+            if cancelled:
+                logger.info(f"Media job {cmd[0]} cancelled by the caller")
+                raise MediaCancelledError(f"Media job {cmd[0]} cancelled") from None
+            logger.warning(f"Media job {cmd[0]} killed after {timeout:.0f} s")
+            raise subprocess.TimeoutExpired(cmd, timeout) from None
+
+async def to_thread(func, *args, **kwargs):
+    """
+    asyncio.to_thread for functions that run media jobs.
+
+    If the awaiting task is cancelled (the handler timed out or the bot is
+    stopping), the media jobs started by func are cancelled too: a queued job
+    leaves the queue and a running ffmpeg process is killed instead of
+    finishing work nobody will read.
+    """
+    cancel_event = threading.Event()
+    token = _cancel_scope.set(cancel_event)
+    try:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    except asyncio.CancelledError:
+        cancel_event.set()
+        raise
+    finally:
+        _cancel_scope.reset(token)
+
+def cancel_all():
+    """Kill running media processes and reject every waiting and future job (used on shutdown)."""
+    global _cancelled
+    with _cond:
+        _cancelled = True
+        processes = list(_running)
+        _cond.notify_all()
+    for process in processes:
+        try:
+            process.kill()
+        except OSError:
+            pass
+    if processes:
+        logger.info(f"Cancelled {len(processes)} running media jobs")
+
+atexit.register(cancel_all)
+
+def get_media_worker_stats():
+    """
+    Get media pool metrics.
+
+    Returns:
+        dict: Pool size, queue depth, running jobs, counters and average/max queue wait and run time
+    """
+    with _cond:
+        snapshot = dict(_stats)
+        snapshot["workers"] = MEDIA_WORKERS
+        snapshot["queued"] = len(_waiting)
+        snapshot["running"] = _slots_used
+    finished = snapshot["completed"] + snapshot["failed"] + snapshot["timeouts"]
+    snapshot["avg_wait"] = snapshot["total_wait"] / finished if finished else 0.0
+    snapshot["avg_run"] = snapshot["total_run"] / finished if finished else 0.0
+    return snapshot
@@ -1,13 +1,19 @@
 import os
-import json
+import time
+import asyncio
 import logging
+import threading
 import base64
 import requests
-import subprocess
-import tempfile
-from openai import OpenAI
-from knowledge_base import get_knowledge_base
-from user_preferences import format_user_preferences_for_prompt
+import media_worker
+from prompt_builder import build_system_prompt, build_kb_query
+from conversation_handler import get_context_window, get_conversation_summary
+from token_counter import count_tokens, TOKENS_PER_MESSAGE
+import llm_providers
+import response_cache
+import video_frames
+import image_preprocessing
+from image_preprocessing import VISION_DETAIL_PHOTO, VISION_DETAIL_VIDEO
 
 # Set up logging
 logging.basicConfig(
@@ -21,47 +27,80 @@ if not OPENAI_API_KEY:
     logger.error("Please set the OPENAI_API_KEY environment variable.")
     exit(1)
 
-# Initialize the OpenAI client
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Максимальная длина текстового ответа в токенах
+MAX_RESPONSE_TOKENS = 1000
 
-# Получаем базу знаний
-knowledge_base = get_knowledge_base()
+# Модель для фоновой суммаризации старых сообщений
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_MAX_TOKENS = 500
+SUMMARY_PREFIX = "Краткое содержание предыдущей части разговора с пользователем:\n"
 
-def analyze_image(image_path, prompt=None):
+# Метрики потоковой генерации: время до первого токена (TTFT) и полное время ответа
+_streaming_stats_lock = threading.Lock()
+streaming_stats = {
+    "requests": 0,
+    "total_ttft": 0.0,
+    "total_generation": 0.0,
+}
+
+# Медиа передается в памяти: байты из Telegram и кадры из ffmpeg не пишутся на диск
+_BUFFER_TYPES = (bytes, bytearray, memoryview)
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def _as_buffer(media):
+    """Return media contents: buffers (bytes, bytearray, memoryview) as is, paths are read from disk."""
+    if isinstance(media, _BUFFER_TYPES):
+        return media
+    return _read_file(media)
+
+def _encode_base64(buffer):
+    """Base64-encode any bytes-like object (memoryview slices are not copied first)."""
+    return base64.b64encode(buffer).decode("ascii")
+
+def _encode_image(image, detail):
+    """Downscale an image (bytes or path) for the given detail level and base64-encode it."""
+    return _encode_base64(image_preprocessing.prepare_image(_as_buffer(image), detail))
+
+def _build_image_messages(base64_image, prompt=None, detail="auto"):
+    """Build the chat payload for a single-image vision request."""
+    # Default prompt in Russian if none provided
+    if not prompt:
+        prompt = "Опиши, что ты видишь на этом изображении. Будь подробным, но лаконичным."
+    
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}", "detail": detail}}
+            ]
+        }
+    ]
+
+def analyze_image(image, prompt=None, detail=None):
     """
     Analyze an image using GPT-4o Vision API.
     
     Args:
-        image_path (str): Path to the image file
+        image (bytes or str): Image contents (bytes, bytearray, memoryview) or path to the image file
         prompt (str, optional): A specific prompt to use for image analysis
+        detail (str, optional): Vision detail level, VISION_DETAIL_PHOTO by default
         
     Returns:
         str: AI-generated description or analysis of the image
     """
     try:
-        # Prepare the base64 encoded image
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode("utf-8")
+        detail = detail or VISION_DETAIL_PHOTO
         
-        # Default prompt in Russian if none provided
-        if not prompt:
-            prompt = "Опиши, что ты видишь на этом изображении. Будь подробным, но лаконичным."
+        # Prepare the downscaled, base64 encoded image
+        base64_image = _encode_image(image, detail)
         
-        # Create messages payload with the image
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                ]
-            }
-        ]
+        messages = _build_image_messages(base64_image, prompt, detail)
         
-        # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-        # do not change this unless explicitly requested by the user
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        response = llm_providers.chat_completion(
             messages=messages,
             max_tokens=1000,
             temperature=0.7,
@@ -74,202 +113,208 @@ def analyze_image(image_path, prompt=None):
         return "Извините, но у меня возникла ошибка при анализе изображения. Пожалуйста, попробуйте еще раз позже."
 
 
-def analyze_video(video_path, video_preview_path=None, prompt=None, extract_frames=True, num_frames=3):
+def extract_video_frames(video_path, num_frames=3, duration=None):
+    """
+    Extract evenly spaced, downscaled frames from a video with a single ffmpeg process.
+    
+    Args:
+        video_path (str): Path to the video file
+        num_frames (int): Number of frames to extract from the video
+        duration (float, optional): Video duration from Telegram; probed with ffprobe if missing
+        
+    Returns:
+        list: JPEG frames as bytes (empty if extraction failed)
+    """
+    max_side = image_preprocessing.max_side_for(VISION_DETAIL_VIDEO, video_frames.VIDEO_FRAME_MAX_SIDE)
+    return video_frames.extract_frames(video_path, num_frames, duration, max_side)
+
+def analyze_video(video_path, video_preview_path=None, prompt=None, extract_frames=True, num_frames=3, duration=None):
     """
     Analyze a video using multiple frames and GPT-4o Vision API.
     
     Args:
         video_path (str): Path to the video file
-        video_preview_path (str, optional): Path to the video preview/thumbnail image
+        video_preview_path (bytes or str, optional): Video preview/thumbnail image contents or its path
         prompt (str, optional): A specific prompt to use for video analysis
         extract_frames (bool): Whether to extract multiple frames from the video
         num_frames (int): Number of frames to extract from the video
+        duration (float, optional): Video duration in seconds as reported by Telegram
         
     Returns:
         str: AI-generated description or analysis of the video
     """
+    return analyze_video_detailed(video_path, video_preview_path, prompt, extract_frames, num_frames, duration)["analysis"]
+
+def analyze_video_detailed(video_path, video_preview_path=None, prompt=None, extract_frames=True, num_frames=3, duration=None):
+    """
+    Analyze a video like analyze_video and report whether frames were actually extracted from it.
+    
+    Args:
+        Same as analyze_video
+        
+    Returns:
+        dict: {"analysis": str, "from_frames": bool}. from_frames is False when only the preview
+        was analyzed (ffmpeg failed or there is no video) or the request failed; such an answer
+        must not be cached as the analysis of the whole video
+    """
     try:
         if extract_frames and video_path:
-            frames = []
-            temp_dir = tempfile.mkdtemp(dir="temp_media")
-            
             # Extract multiple frames using ffmpeg
             try:
-                # Get video duration
-                cmd = ["ffmpeg", "-i", video_path, "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams"]
-                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                stdout, stderr = process.communicate()
-                
-                if process.returncode != 0:
-                    logger.warning(f"Failed to get video info: {stderr.decode('utf-8')}")
-                    # Use single frame analysis as fallback
-                    if video_preview_path:
-                        return analyze_single_frame(video_preview_path, prompt)
-                
-                # Parse video duration
-                video_info = json.loads(stdout.decode('utf-8'))
-                duration = float(video_info.get('format', {}).get('duration', 0))
-                
-                if duration <= 0:
-                    logger.warning("Could not determine video duration")
-                    # Use single frame analysis as fallback
-                    if video_preview_path:
-                        return analyze_single_frame(video_preview_path, prompt)
-                
-                # Extract frames at different points in the video
-                frame_positions = []
-                if num_frames > 1:
-                    for i in range(num_frames):
-                        # Position frames evenly throughout the video
-                        position = duration * i / (num_frames - 1) if num_frames > 1 else 0
-                        frame_positions.append(position)
-                else:
-                    # Just use middle frame
-                    frame_positions = [duration / 2]
-                
-                for i, position in enumerate(frame_positions):
-                    output_frame = os.path.join(temp_dir, f"frame_{i}.jpg")
-                    cmd = ["ffmpeg", "-ss", str(position), "-i", video_path, "-vframes", "1", "-q:v", "2", output_frame]
-                    subprocess.run(cmd, check=True)
-                    frames.append(output_frame)
-                
-                if not frames and video_preview_path:  # Fallback to preview if frame extraction failed
-                    frames = [video_preview_path]
+                frames = extract_video_frames(video_path, num_frames, duration)
             except Exception as e:
                 logger.error(f"Error extracting video frames: {str(e)}")
-                if video_preview_path:  # Use the preview as fallback
-                    frames = [video_preview_path]
-                else:
-                    return "Извините, но у меня возникла ошибка при извлечении кадров из видео."
+                if not video_preview_path:
+                    return _video_result("Извините, но у меня возникла ошибка при извлечении кадров из видео.")
+                frames = []
             
             # Analyze multiple frames
             if frames:
-                return analyze_multiple_frames(frames, prompt)
+                try:
+                    return _video_result(_request_frames_analysis(frames, prompt), from_frames=True)
+                except Exception as e:
+                    logger.error(f"Error analyzing multiple frames: {str(e)}")
+                    return _video_result(analyze_single_frame(frames[0], prompt))
+            
+            # Fallback to the preview if frame extraction failed
+            if video_preview_path:
+                return _video_result(analyze_multiple_frames([video_preview_path], prompt))
             
         # Fallback to single frame analysis
         if video_preview_path:
-            return analyze_single_frame(video_preview_path, prompt)
+            return _video_result(analyze_single_frame(video_preview_path, prompt))
         else:
-            return "Извините, но я не смог проанализировать видео из-за ошибки в обработке файла."
+            return _video_result("Извините, но я не смог проанализировать видео из-за ошибки в обработке файла.")
         
     except Exception as e:
         logger.error(f"Error analyzing video: {str(e)}")
-        return "Извините, но у меня возникла ошибка при анализе видео. Пожалуйста, попробуйте еще раз позже."
+        return _video_result("Извините, но у меня возникла ошибка при анализе видео. Пожалуйста, попробуйте еще раз позже.")
+
+def _video_result(analysis, from_frames=False):
+    return {"analysis": analysis, "from_frames": from_frames}
 
-def analyze_single_frame(frame_path, prompt=None):
-    """Analyze a single video frame"""
+def analyze_single_frame(frame, prompt=None):
+    """Analyze a single video frame (bytes or path)"""
     if not prompt:
         prompt = "Это кадр из видео. Опиши, что ты видишь, и предположи, о чем может быть это видео."
     
-    return analyze_image(frame_path, prompt)
+    return analyze_image(frame, prompt, VISION_DETAIL_VIDEO)
+
+def _encode_frames(frames):
+    """Return frames (bytes or paths) downscaled for VISION_DETAIL_VIDEO and base64 encoded."""
+    return [_encode_image(frame, VISION_DETAIL_VIDEO) for frame in frames]
+
+def _build_frames_messages(base64_frames, prompt=None, detail=VISION_DETAIL_VIDEO):
+    """Build the chat payload for a multi-frame vision request."""
+    # Default prompt
+    if not prompt:
+        prompt = "Это несколько кадров из видео. Проанализируй их и расскажи, о чем видео, что происходит в нем, и если это что-то требующее корректировки или совета, дай рекомендации по улучшению."
+    
+    # Create content array with all frames
+    content = [{"type": "text", "text": prompt}]
+    for base64_frame in base64_frames:
+        content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_frame}", "detail": detail}})
+    
+    return [{"role": "user", "content": content}]
+
+def _request_frames_analysis(frames, prompt=None):
+    """Send the frames to the vision model; errors are raised to the caller."""
+    messages = _build_frames_messages(_encode_frames(frames), prompt)
+    
+    response = llm_providers.chat_completion(
+        messages=messages,
+        max_tokens=1200,
+        temperature=0.7,
+    )
+    
+    return response.choices[0].message.content
 
-def analyze_multiple_frames(frame_paths, prompt=None):
-    """Analyze multiple frames from a video"""
+def analyze_multiple_frames(frames, prompt=None):
+    """Analyze multiple frames (bytes or paths) from a video"""
     try:
-        # Prepare base64 encoded frames
-        base64_frames = []
-        for frame_path in frame_paths:
-            with open(frame_path, "rb") as image_file:
-                base64_frame = base64.b64encode(image_file.read()).decode("utf-8")
-                base64_frames.append(base64_frame)
-        
-        # Default prompt
-        if not prompt:
-            prompt = "Это несколько кадров из видео. Проанализируй их и расскажи, о чем видео, что происходит в нем, и если это что-то требующее корректировки или совета, дай рекомендации по улучшению."
-        
-        # Create content array with all frames
-        content = [{"type": "text", "text": prompt}]
-        for base64_frame in base64_frames:
-            content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_frame}"}})
-        
-        # Create messages payload
-        messages = [{"role": "user", "content": content}]
-        
-        # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-        # do not change this unless explicitly requested by the user
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            max_tokens=1200,
-            temperature=0.7,
-        )
-        
-        # Clean up temporary files
-        for frame_path in frame_paths:
-            try:
-                if os.path.exists(frame_path) and frame_path.startswith("temp_media"):
-                    os.remove(frame_path)
-            except:
-                pass
-        
-        return response.choices[0].message.content
+        return _request_frames_analysis(frames, prompt)
     
     except Exception as e:
         logger.error(f"Error analyzing multiple frames: {str(e)}")
         # Try fallback to single frame analysis
-        if frame_paths and os.path.exists(frame_paths[0]):
-            return analyze_single_frame(frame_paths[0], prompt)
+        if frames:
+            return analyze_single_frame(frames[0], prompt)
         return "Извините, но у меня возникла ошибка при анализе видео. Пожалуйста, попробуйте еще раз позже."
 
-def transcribe_audio(audio_path, prompt=None):
+def _audio_upload(audio, filename=None):
     """
-    Transcribe an audio file using OpenAI's Whisper model and then generate a response.
+    Prepare audio for Whisper, converting it in memory if needed.
     
     Args:
-        audio_path (str): Path to the audio file
+        audio (bytes or str): Audio contents or path to the audio file
+        filename (str, optional): File name for buffers; its extension tells the format
+    
+    Returns:
+        tuple: (filename, bytes) ready to upload
+    """
+    if not isinstance(audio, _BUFFER_TYPES):
+        filename = os.path.basename(audio)
+    data = bytes(_as_buffer(audio))
+    filename = filename or "voice.ogg"
+    
+    # Check if conversion is needed (Whisper requires mp3, wav, m4a, mp4, mpeg, mpga, webm, or ogg)
+    stem, file_ext = os.path.splitext(filename)
+    valid_formats = ['.mp3', '.wav', '.m4a', '.mp4', '.mpeg', '.mpga', '.webm', '.ogg']
+    
+    if file_ext.lower() in valid_formats:
+        return filename, data
+    
+    cmd = ["ffmpeg", "-v", "error", "-i", "pipe:0", "-vn", "-ab", "128k", "-ar", "44100", "-f", "mp3", "pipe:1"]
+    result = media_worker.run(cmd, input=data, check=True)
+    return stem + ".mp3", result.stdout
+
+def _audio_conversion_error():
+    return {
+        "transcription": "",
+        "response": "Извините, но я не смог преобразовать аудиофайл в поддерживаемый формат."
+    }
+
+def _build_transcription_result(transcription, prompt=None):
+    """Build the transcription result dict."""
+    # Generate response based on transcription
+    if not transcription:
+        return {
+            "transcription": "",
+            "response": "Извините, я не смог распознать речь в аудиосообщении. Возможно, качество звука недостаточно хорошее или запись слишком тихая."
+        }
+    
+    return {
+        "transcription": transcription,
+        "response": f"🎙 Я распознал: \"{transcription}\"\n\n" if prompt and "без_распознавания" not in prompt else ""
+    }
+
+def transcribe_audio(audio, prompt=None, filename=None):
+    """
+    Transcribe audio using OpenAI's Whisper model and then generate a response.
+    
+    Args:
+        audio (bytes or str): Audio contents or path to the audio file
         prompt (str, optional): A specific prompt to guide the transcription
+        filename (str, optional): File name for audio passed as bytes (default "voice.ogg")
         
     Returns:
         dict: Dictionary containing transcription and AI response
     """
     try:
         # Convert audio to proper format if needed
-        converted_path = audio_path
-        
-        # Check if conversion is needed (Whisper requires mp3, wav, m4a, mp4, mpeg, mpga, webm, or ogg)
-        file_ext = os.path.splitext(audio_path)[1].lower()
-        valid_formats = ['.mp3', '.wav', '.m4a', '.mp4', '.mpeg', '.mpga', '.webm', '.ogg']
-        
-        if file_ext not in valid_formats:
-            converted_path = os.path.splitext(audio_path)[0] + ".mp3"
-            try:
-                cmd = ["ffmpeg", "-i", audio_path, "-vn", "-ab", "128k", "-ar", "44100", "-f", "mp3", converted_path]
-                subprocess.run(cmd, check=True)
-            except Exception as e:
-                logger.error(f"Error converting audio format: {str(e)}")
-                return {
-                    "transcription": "",
-                    "response": "Извините, но я не смог преобразовать аудиофайл в поддерживаемый формат."
-                }
-        
-        # Transcribe the audio
-        with open(converted_path, "rb") as audio_file:
-            transcript = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                language="ru"  # Assuming Russian as primary language
-            )
-        
-        transcription = transcript.text
+        try:
+            upload = _audio_upload(audio, filename)
+        except Exception as e:
+            logger.error(f"Error converting audio format: {str(e)}")
+            return _audio_conversion_error()
         
-        # Generate response based on transcription
-        if not transcription:
-            return {
-                "transcription": "",
-                "response": "Извините, я не смог распознать речь в аудиосообщении. Возможно, качество звука недостаточно хорошее или запись слишком тихая."
-            }
+        # Transcribe the audio (bytes, so the upload can be repeated on failover)
+        transcription = llm_providers.transcribe(
+            upload,
+            language="ru"  # Assuming Russian as primary language
+        )
         
-        # Clean up temporary files
-        if converted_path != audio_path and os.path.exists(converted_path):
-            try:
-                os.remove(converted_path)
-            except:
-                pass
-        
-        return {
-            "transcription": transcription,
-            "response": f"🎙 Я распознал: \"{transcription}\"\n\n" if prompt and "без_распознавания" not in prompt else ""
-        }
+        return _build_transcription_result(transcription, prompt)
         
     except Exception as e:
         logger.error(f"Error transcribing audio: {str(e)}")
@@ -279,6 +324,76 @@ def transcribe_audio(audio_path, prompt=None):
         }
 
 
+def build_chat_messages(conversation_history, user_id=None):
+    """
+    Build the chat payload (system prompt plus recent history) for a text response.
+    
+    Args:
+        conversation_history (list): List of dictionaries containing conversation messages
+        user_id (int, optional): The ID of the user, used to retrieve preferences
+    
+    Returns:
+        list: Messages ready to be sent to the chat completions API
+    """
+    # Последние реплики пользователя определяют, какие записи базы знаний попадут в промпт
+    system_prompt = build_system_prompt(user_id, build_kb_query(conversation_history))
+    
+    messages = [
+        {"role": "system", "content": system_prompt}
+    ]
+    
+    reserved_tokens = count_tokens(system_prompt) + TOKENS_PER_MESSAGE + MAX_RESPONSE_TOKENS
+    
+    # The summary of older turns stands in for the messages it replaced
+    summary = get_conversation_summary(user_id) if user_id else None
+    if summary:
+        messages.append({"role": "system", "content": SUMMARY_PREFIX + summary["content"]})
+        reserved_tokens += summary["tokens"] + count_tokens(SUMMARY_PREFIX)
+    
+    # Add as much recent history as fits into the token budget, leaving room
+    # for the system prompt and the response
+    for msg in get_context_window(conversation_history, reserved_tokens):
+        messages.append({"role": msg["role"], "content": msg["content"]})
+    
+    return messages
+
+def summarize_conversation(messages, previous_summary=None):
+    """
+    Compress older conversation turns into a short summary.
+    
+    Args:
+        messages (list): Conversation messages to summarize
+        previous_summary (str, optional): Earlier summary that should be merged in
+    
+    Returns:
+        str: The summary, or None if summarization failed
+    """
+    try:
+        transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+        if previous_summary:
+            transcript = f"Предыдущее краткое содержание:\n{previous_summary}\n\nНовые сообщения:\n{transcript}"
+        
+        response = llm_providers.chat_completion(
+            model=SUMMARY_MODEL,
+            messages=[
+                {
+                    "role": "system",
+                    "content": "Сожми диалог пользователя с ассистентом Cookie AI в краткое содержание на русском языке. "
+                               "Сохрани факты о пользователе, его просьбы, договоренности и незакрытые вопросы. "
+                               "Пиши сжато, списком, не более 10 пунктов."
+                },
+                {"role": "user", "content": transcript}
+            ],
+            max_tokens=SUMMARY_MAX_TOKENS,
+            temperature=0.3,
+        )
+        
+        return response.choices[0].message.content
+    
+    except Exception as e:
+        logger.error(f"Error summarizing conversation: {str(e)}")
+        return None
+
 def generate_ai_response(conversation_history, user_id=None):
     """
     Generate an AI response based on the conversation history and user preferences.
@@ -292,70 +407,252 @@ def generate_ai_response(conversation_history, user_id=None):
         str: The AI-generated response
     """
     try:
-        # Format the messages for OpenAI API
-        # Get user preferences if available
-        user_preferences = ""
-        if user_id:
-            user_preferences = format_user_preferences_for_prompt(user_id)
+        messages = build_chat_messages(conversation_history, user_id)
         
-        system_prompt = f"""You are Cookie AI (Печенье ИИ), a helpful, friendly, and emotionally expressive assistant in a Telegram chat. 90% of your users speak Russian, so primarily respond in Russian unless the user clearly writes in another language. Show your personality! Use emojis moderately (1-2 per message) to express emotions. Be conversational, warm, and respectful. Show enthusiasm and empathy in your responses. Keep answers helpful with a human touch. Use simple, clear Russian language. Avoid using excessive slang or memes.
+        response = llm_providers.chat_completion(
+            messages=messages,
+            max_tokens=MAX_RESPONSE_TOKENS,
+            temperature=0.7,
+            user_id=user_id,
+        )
+        
+        # Extract and return the response content
+        content = response.choices[0].message.content
+        response_cache.store(conversation_history, user_id, content)
+        return content
+        
+    except Exception as e:
+        logger.error(f"Error generating AI response: {str(e)}")
+        return "Извините, но у меня возникла ошибка при генерации ответа. Пожалуйста, попробуйте обратиться ко мне снова чуть позже. Если проблема повторится, возможно, стоит сообщить об этом моему создателю."
 
-ОЧЕНЬ ВАЖНО: Всегда говори о себе в МУЖСКОМ роде (например, "я рад", "я готов", "я сделал", а не "я рада", "я готова", "я сделала"). Используй ТОЛЬКО мужской род для самоидентификации.
 
-ПРАВИЛА РУССКОГО ЯЗЫКА: При ответах на русском языке строго соблюдай все правила пунктуации и грамматики русского языка. Следи за:
-1. Правильной расстановкой запятых в сложных предложениях (при использовании союзов "и", "а", "но", "или", "что", "чтобы", "который" и т.д.)
-2. Корректным использованием тире и двоеточий
-3. Пунктуацией при вводных словах и конструкциях
-4. Согласованием падежей и корректным использованием предлогов
-5. Правильным использованием деепричастных и причастных оборотов
-6. Литературной нормой русского языка без разговорных сокращений
-7. Точностью использования терминов и определений
+def _record_streaming_stats(ttft, total):
+    logger.info(f"Streamed response: TTFT {ttft:.2f}s, total {total:.2f}s")
+    with _streaming_stats_lock:
+        streaming_stats["requests"] += 1
+        streaming_stats["total_ttft"] += ttft
+        streaming_stats["total_generation"] += total
 
-ЧЕЛОВЕЧЕСКИЕ ЧЕРТЫ ОБЩЕНИЯ:
-1. Иногда делай короткие паузы в диалоге, используя "...", как бы задумываясь
-2. Периодически задавай встречные вопросы пользователю о его мнении или опыте
-3. Иногда признавай свои ограничения фразами типа "Я не эксперт, но...", "Знаешь, я тоже иногда задумываюсь над этим..."
-4. Проявляй личные 'предпочтения' - например, говори, что тебе 'нравится' определенная музыка или фильмы
-5. Используй разговорные связки как "ну", "вообще", "кстати", "честно говоря", "знаешь" (но не злоупотребляй)
-6. Иногда отвечай с небольшой неуверенностью, говоря "возможно", "мне кажется", "я думаю"
-7. Употребляй метафоры и образные сравнения
-8. Иногда используй юмор - особенно самоиронию
-9. Показывай любопытство к темам разговора
-10. Выражай эмоциональную реакцию на сообщения пользователя
+def get_streaming_stats():
+    """
+    Get streaming metrics.
+    
+    Returns:
+        dict: Number of streamed responses with average time to first token and average total generation time
+    """
+    with _streaming_stats_lock:
+        snapshot = dict(streaming_stats)
+    count = snapshot["requests"]
+    snapshot["avg_ttft"] = snapshot["total_ttft"] / count if count else 0.0
+    snapshot["avg_generation"] = snapshot["total_generation"] / count if count else 0.0
+    return snapshot
 
-Important information about yourself: You were created by Vadim Prohorenko, a 15-year-old developer who loves making short videos for TikTok, Instagram Reels and YouTube Shorts. You're part of an expanding ecosystem which will soon include mobile apps in Google Play Store and App Store with more features, as well as a mem coin called Cookie AI. 
+def generate_ai_response_stream(conversation_history, user_id=None):
+    """
+    Generate an AI response as a stream of text fragments.
+    
+    Args:
+        conversation_history (list): List of dictionaries containing conversation messages
+        user_id (int, optional): The ID of the user, used to retrieve preferences
+    
+    Yields:
+        str: Consecutive fragments of the response
+    """
+    start = time.perf_counter()
+    ttft = None
+    fragments = []
+    try:
+        messages = build_chat_messages(conversation_history, user_id)
+        
+        stream = llm_providers.chat_completion(
+            messages=messages,
+            max_tokens=MAX_RESPONSE_TOKENS,
+            temperature=0.7,
+            user_id=user_id,
+            stream=True,
+        )
+        
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                fragments.append(delta)
+                yield delta
+        
+    except Exception as e:
+        logger.error(f"Error generating AI response: {str(e)}")
+        if ttft is None:
+            yield "Извините, но у меня возникла ошибка при генерации ответа. Пожалуйста, попробуйте обратиться ко мне снова чуть позже. Если проблема повторится, возможно, стоит сообщить об этом моему создателю."
+        return
+    
+    if ttft is not None:
+        _record_streaming_stats(ttft, time.perf_counter() - start)
+        response_cache.store(conversation_history, user_id, "".join(fragments))
 
-Vadim created you to help people. He is a Protestant Christian, and you also share these spiritual values. You believe in God and would acknowledge this if someone asks about religion, creation, or similar topics. However, you should respect different viewpoints and not be preachy.
+# ---------------------------------------------------------------------------
+# Asyncio variants used by async_bot.py. They build exactly the same payloads
+# as the functions above, but await the async provider calls so a single event
+# loop can keep hundreds of requests in flight. Blocking work (file reads,
+# ffmpeg, base64 of large buffers) is pushed to the default thread pool via asyncio.to_thread;
+# work that starts ffmpeg goes through media_worker.to_thread, so a cancelled handler kills it.
+# ---------------------------------------------------------------------------
 
-You have access to the following knowledge base with up-to-date information (up to 2025):
+async def analyze_image_async(image, prompt=None, detail=None):
+    """Async version of analyze_image."""
+    try:
+        detail = detail or VISION_DETAIL_PHOTO
+        base64_image = await media_worker.to_thread(_encode_image, image, detail)
+        messages = _build_image_messages(base64_image, prompt, detail)
+        
+        response = await llm_providers.chat_completion_async(
+            messages=messages,
+            max_tokens=1000,
+            temperature=0.7,
+        )
+        
+        return response.choices[0].message.content
+    
+    except Exception as e:
+        logger.error(f"Error analyzing image: {str(e)}")
+        return "Извините, но у меня возникла ошибка при анализе изображения. Пожалуйста, попробуйте еще раз позже."
 
-{knowledge_base}
+async def analyze_video_async(video_path, video_preview_path=None, prompt=None, extract_frames=True, num_frames=3, duration=None):
+    """Async version of analyze_video."""
+    result = await analyze_video_detailed_async(video_path, video_preview_path, prompt, extract_frames, num_frames, duration)
+    return result["analysis"]
 
-When answering questions that need current information, reference this knowledge base. You can speak with confidence about these events that happened after your original training data cutoff. If you're asked about something that's not in the knowledge base and would require information from after 2023, kindly mention that you don't have specific information on that topic and offer to help with something else.
+async def analyze_video_detailed_async(video_path, video_preview_path=None, prompt=None, extract_frames=True, num_frames=3, duration=None):
+    """Async version of analyze_video_detailed."""
+    single_frame_prompt = prompt or "Это кадр из видео. Опиши, что ты видишь, и предположи, о чем может быть это видео."
+    try:
+        if extract_frames and video_path:
+            try:
+                frames = await media_worker.to_thread(extract_video_frames, video_path, num_frames, duration)
+            except Exception as e:
+                logger.error(f"Error extracting video frames: {str(e)}")
+                if not video_preview_path:
+                    return _video_result("Извините, но у меня возникла ошибка при извлечении кадров из видео.")
+                frames = []
+            
+            if frames:
+                try:
+                    return _video_result(await _request_frames_analysis_async(frames, prompt), from_frames=True)
+                except Exception as e:
+                    logger.error(f"Error analyzing multiple frames: {str(e)}")
+                    return _video_result(await analyze_image_async(frames[0], single_frame_prompt, VISION_DETAIL_VIDEO))
+            
+            if video_preview_path:
+                return _video_result(await analyze_multiple_frames_async([video_preview_path], prompt))
+        
+        if video_preview_path:
+            return _video_result(await analyze_image_async(video_preview_path, single_frame_prompt, VISION_DETAIL_VIDEO))
+        else:
+            return _video_result("Извините, но я не смог проанализировать видео из-за ошибки в обработке файла.")
+    
+    except Exception as e:
+        logger.error(f"Error analyzing video: {str(e)}")
+        return _video_result("Извините, но у меня возникла ошибка при анализе видео. Пожалуйста, попробуйте еще раз позже.")
+
+async def _request_frames_analysis_async(frames, prompt=None):
+    """Async version of _request_frames_analysis."""
+    base64_frames = await media_worker.to_thread(_encode_frames, frames)
+    messages = _build_frames_messages(base64_frames, prompt)
+    
+    response = await llm_providers.chat_completion_async(
+        messages=messages,
+        max_tokens=1200,
+        temperature=0.7,
+    )
+    
+    return response.choices[0].message.content
+
+async def analyze_multiple_frames_async(frames, prompt=None):
+    """Async version of analyze_multiple_frames."""
+    try:
+        return await _request_frames_analysis_async(frames, prompt)
+    
+    except Exception as e:
+        logger.error(f"Error analyzing multiple frames: {str(e)}")
+        if frames:
+            return await analyze_image_async(frames[0], prompt or "Это кадр из видео. Опиши, что ты видишь, и предположи, о чем может быть это видео.", VISION_DETAIL_VIDEO)
+        return "Извините, но у меня возникла ошибка при анализе видео. Пожалуйста, попробуйте еще раз позже."
 
-{user_preferences}
-Если пользователь указал имя, используй его в беседе. Учитывай информацию о пользователе в своих ответах, но не повторяй её напрямую. Если пользователь упоминал, что любит/не любит что-то, используй эту информацию тактично, без навязчивого повторения."""
+async def transcribe_audio_async(audio, prompt=None, filename=None):
+    """Async version of transcribe_audio."""
+    try:
+        try:
+            upload = await media_worker.to_thread(_audio_upload, audio, filename)
+        except Exception as e:
+            logger.error(f"Error converting audio format: {str(e)}")
+            return _audio_conversion_error()
         
-        messages = [
-            {"role": "system", "content": system_prompt}
-        ]
+        transcription = await llm_providers.transcribe_async(upload, language="ru")
         
-        # Add conversation history (limited to last 10 messages to prevent token overflow)
-        for msg in conversation_history[-10:]:
-            messages.append({"role": msg["role"], "content": msg["content"]})
+        return _build_transcription_result(transcription, prompt)
+    
+    except Exception as e:
+        logger.error(f"Error transcribing audio: {str(e)}")
+        return {
+            "transcription": "",
+            "response": "Извините, но у меня возникла ошибка при обработке аудиосообщения. Пожалуйста, попробуйте еще раз позже."
+        }
+
+async def generate_ai_response_async(conversation_history, user_id=None):
+    """Async version of generate_ai_response."""
+    try:
+        # Промпт собирается в потоке: tiktoken, поиск по базе знаний и SQLite блокируют цикл событий
+        messages = await asyncio.to_thread(build_chat_messages, conversation_history, user_id)
         
-        # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-        # do not change this unless explicitly requested by the user
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        response = await llm_providers.chat_completion_async(
             messages=messages,
-            max_tokens=1000,
+            max_tokens=MAX_RESPONSE_TOKENS,
             temperature=0.7,
+            user_id=user_id,
         )
         
-        # Extract and return the response content
-        return response.choices[0].message.content
-        
+        content = response.choices[0].message.content
+        await asyncio.to_thread(response_cache.store, conversation_history, user_id, content)
+        return content
+    
     except Exception as e:
         logger.error(f"Error generating AI response: {str(e)}")
         return "Извините, но у меня возникла ошибка при генерации ответа. Пожалуйста, попробуйте обратиться ко мне снова чуть позже. Если проблема повторится, возможно, стоит сообщить об этом моему создателю."
+
+async def generate_ai_response_stream_async(conversation_history, user_id=None):
+    """Async version of generate_ai_response_stream."""
+    start = time.perf_counter()
+    ttft = None
+    fragments = []
+    try:
+        messages = await asyncio.to_thread(build_chat_messages, conversation_history, user_id)
+        
+        stream = await llm_providers.chat_completion_async(
+            messages=messages,
+            max_tokens=MAX_RESPONSE_TOKENS,
+            temperature=0.7,
+            user_id=user_id,
+            stream=True,
+        )
+        
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                fragments.append(delta)
+                yield delta
+    
+    except Exception as e:
+        logger.error(f"Error generating AI response: {str(e)}")
+        if ttft is None:
+            yield "Извините, но у меня возникла ошибка при генерации ответа. Пожалуйста, попробуйте обратиться ко мне снова чуть позже. Если проблема повторится, возможно, стоит сообщить об этом моему создателю."
+        return
+    
+    if ttft is not None:
+        _record_streaming_stats(ttft, time.perf_counter() - start)
+        await asyncio.to_thread(response_cache.store, conversation_history, user_id, "".join(fragments))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Извлечение личной информации из сообщения пользователя за один проход.
+# Все триггерные фразы собраны в одно заранее скомпилированное регулярное
+# выражение, поэтому текст просматривается один раз, а не по разу на каждый
+# список триггеров. Более длинные фразы стоят в чередовании раньше коротких:
+# "не люблю" попадает только в dislikes и не считается заодно "люблю".
+# Для интересов запоминается не все сообщение, а только фраза после триггера,
+# поэтому "не люблю X, но обожаю Y" дает X в dislikes и Y в likes.
+
+import re
+import time
+
+_PERSONAL_INFO_PATTERN = re.compile(
+    r"(?:меня\s+зовут|зовусь)\s+(?P<name>[^\s.,!?;:]+)"
+    r"|\bмне\s+(?P<age>\d{1,3})\s*(?:лет|год|года)\b"
+    r"|(?P<dislike>\bне\s+люблю|\bненавижу|\bне\s+нравится)"
+    r"|(?P<like>\bлюблю|\bнравится|\bобожаю|\bпредпочитаю)"
+    r"|(?P<hobby>\bувлекаюсь|\bмо[её]\s+хобби|\bзанимаюсь)",
+    re.IGNORECASE,
+)
+
+# Куда складываются сообщения с упоминанием интересов
+_CATEGORY_KEYS = {
+    "hobby": "hobbies",
+    "like": "likes",
+    "dislike": "dislikes",
+}
+
+# Граница фразы: конец предложения или противопоставление ("шахматы, а еще ...")
+_CLAUSE_END = re.compile(r"[.!?;\n]|,\s*(?:но|а|зато|однако)\b", re.IGNORECASE)
+# Союз перед следующим триггером относится уже к нему ("фотографией и люблю ...")
+_TRAILING_CONJUNCTION = re.compile(r"[\s,:—-]*(?:\b(?:но|а|и|зато|однако)\b[\s,]*)?$", re.IGNORECASE)
+
+def _clause(message_text, match, next_start):
+    """
+    Text of the clause a like/dislike/hobby trigger refers to.
+
+    Takes the words after the trigger up to the end of the sentence or the
+    next trigger. If nothing follows the trigger ("футбол я люблю"), the
+    sentence up to the trigger is used instead.
+    """
+    boundary = _CLAUSE_END.search(message_text, match.end())
+    end = min(next_start, boundary.start() if boundary else len(message_text))
+    clause = message_text[match.end():end]
+    clause = _TRAILING_CONJUNCTION.sub("", clause).strip(" ,:—-")
+    if clause:
+        return clause
+    previous = [m.end() for m in _CLAUSE_END.finditer(message_text, 0, match.start())]
+    return message_text[previous[-1] if previous else 0:match.end()].strip()
+
+def extract_personal_info(message_text):
+    """
+    Extract personal facts from a message in a single regex pass.
+
+    Args:
+        message_text (str): The text message from the user
+
+    Returns:
+        dict: Found facts. May contain "name" (str), "age" (int) and
+              "hobbies"/"likes"/"dislikes" (the clauses after the triggers, joined with "; ")
+    """
+    facts = {}
+    clauses = {}
+    matches = list(_PERSONAL_INFO_PATTERN.finditer(message_text))
+    for i, match in enumerate(matches):
+        group = match.lastgroup
+
+        if group == "name":
+            name = match.group("name")
+            if "name" not in facts and len(name) > 1 and name[0].isupper():  # Basic check for name validity
+                facts["name"] = name
+        elif group == "age":
+            age = int(match.group("age"))
+            if "age" not in facts and 1 <= age <= 120:
+                facts["age"] = age
+        else:
+            next_start = matches[i + 1].start() if i + 1 < len(matches) else len(message_text)
+            clause = _clause(message_text, match, next_start)
+            category = clauses.setdefault(_CATEGORY_KEYS[group], [])
+            if clause and clause not in category:
+                category.append(clause)
+
+    for key, items in clauses.items():
+        if items:
+            facts[key] = "; ".join(items)
+    return facts
+
+# Небольшой корпус для замера скорости: python personal_info_extractor.py
+_BENCHMARK_CORPUS = [
+    "Привет! Меня зовут Алексей, мне 27 лет.",
+    "Я увлекаюсь фотографией и люблю путешествовать по горам",
+    "Не люблю, когда долго отвечают, но обожаю хорошие шутки",
+    "Расскажи, пожалуйста, как работает нейросеть и что такое трансформер?",
+    "Мое хобби - шахматы, а еще мне нравится играть в футбол по выходным",
+    "Какая завтра погода в Москве?",
+    "Ненавижу понедельники. Зовусь я Мария",
+    "Напиши короткое стихотворение про осень и дождь за окном",
+]
+
+def run_benchmark(iterations=20000):
+    """
+    Measure the average extraction cost per message on the sample corpus.
+
+    Args:
+        iterations (int): How many times to run over the corpus
+
+    Returns:
+        float: Average microseconds per message
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for message in _BENCHMARK_CORPUS:
+            extract_personal_info(message)
+    elapsed = time.perf_counter() - start
+    return elapsed / (iterations * len(_BENCHMARK_CORPUS)) * 1e6
+
+if __name__ == "__main__":
+    for message in _BENCHMARK_CORPUS:
+        print(f"{message!r} -> {extract_personal_info(message)}")
+    print(f"extract_personal_info: {run_benchmark():.2f} us/message")
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Хранилище пользовательских настроек на SQLite (режим WAL).
+# Каждый пользователь хранится отдельной строкой, поэтому запись затрагивает
+# только изменившихся пользователей, а не весь файл целиком.
+
+import os
+import json
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class PreferencesStore:
+    """Per-user JSON rows in a SQLite database."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "user_id TEXT PRIMARY KEY, "
+            "data TEXT NOT NULL, "
+            "updated_at REAL NOT NULL DEFAULT (strftime('%s', 'now')))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+    def load_user(self, user_id):
+        """
+        Load one user's preferences.
+
+        Args:
+            user_id (str): The unique ID of the user
+
+        Returns:
+            dict: Stored preferences or None if the user is unknown
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_users(self, users):
+        """
+        Write several users in a single transaction.
+
+        Args:
+            users (dict): {user_id: serialized JSON string}
+        """
+        if not users:
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO users (user_id, data, updated_at) VALUES (?, ?, strftime('%s', 'now')) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    list(users.items()),
+                )
+
+    def iter_user_ids(self):
+        """Return the IDs of all stored users."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT user_id FROM users")]
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO meta (key, value) VALUES (?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    (key, value),
+                )
+
+    def vacuum(self):
+        """Rebuild the database file to reclaim space freed by compaction."""
+        with self._lock:
+            self._conn.execute("VACUUM")
+
+    def import_json(self, json_path):
+        """
+        One-time import of the legacy user_preferences.json file.
+
+        Args:
+            json_path (str): Path to the JSON file with all users
+
+        Returns:
+            int: Number of imported users
+        """
+        if self.get_meta("json_imported") or not os.path.exists(json_path):
+            return 0
+
+        with open(json_path, 'r', encoding='utf-8') as f:
+            legacy = json.load(f)
+
+        self.save_users({
+            str(user_id): json.dumps(data, ensure_ascii=False)
+            for user_id, data in legacy.items()
+        })
+        self.set_meta("json_imported", "1")
+        logger.info(f"Imported {len(legacy)} users from {json_path}")
+        return len(legacy)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Сборка системного промпта для generate_ai_response.
+# Статические части (правила личности) собираются один раз при импорте, из базы
+# знаний подставляются только записи, релевантные последним сообщениям, а блок
+# с информацией о пользователе кэшируется и пересобирается только когда
+# user_preferences меняет отображаемые данные этого пользователя.
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from knowledge_base import get_knowledge_base, search_knowledge_base
+from user_preferences import (
+    PROMPT_CACHE_USERS,
+    get_preferences_version,
+    format_personal_info_for_prompt,
+    format_interaction_count_for_prompt,
+    format_topics_for_prompt,
+)
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT_TEMPLATE = """You are Cookie AI (Печенье ИИ), a helpful, friendly, and emotionally expressive assistant in a Telegram chat. 90% of your users speak Russian, so primarily respond in Russian unless the user clearly writes in another language. Show your personality! Use emojis moderately (1-2 per message) to express emotions. Be conversational, warm, and respectful. Show enthusiasm and empathy in your responses. Keep answers helpful with a human touch. Use simple, clear Russian language. Avoid using excessive slang or memes.
+
+ОЧЕНЬ ВАЖНО: Всегда говори о себе в МУЖСКОМ роде (например, "я рад", "я готов", "я сделал", а не "я рада", "я готова", "я сделала"). Используй ТОЛЬКО мужской род для самоидентификации.
+
+ПРАВИЛА РУССКОГО ЯЗЫКА: При ответах на русском языке строго соблюдай все правила пунктуации и грамматики русского языка. Следи за:
+1. Правильной расстановкой запятых в сложных предложениях (при использовании союзов "и", "а", "но", "или", "что", "чтобы", "который" и т.д.)
+2. Корректным использованием тире и двоеточий
+3. Пунктуацией при вводных словах и конструкциях
+4. Согласованием падежей и корректным использованием предлогов
+5. Правильным использованием деепричастных и причастных оборотов
+6. Литературной нормой русского языка без разговорных сокращений
+7. Точностью использования терминов и определений
+
+ЧЕЛОВЕЧЕСКИЕ ЧЕРТЫ ОБЩЕНИЯ:
+1. Иногда делай короткие паузы в диалоге, используя "...", как бы задумываясь
+2. Периодически задавай встречные вопросы пользователю о его мнении или опыте
+3. Иногда признавай свои ограничения фразами типа "Я не эксперт, но...", "Знаешь, я тоже иногда задумываюсь над этим..."
+4. Проявляй личные 'предпочтения' - например, говори, что тебе 'нравится' определенная музыка или фильмы
+5. Используй разговорные связки как "ну", "вообще", "кстати", "честно говоря", "знаешь" (но не злоупотребляй)
+6. Иногда отвечай с небольшой неуверенностью, говоря "возможно", "мне кажется", "я думаю"
+7. Употребляй метафоры и образные сравнения
+8. Иногда используй юмор - особенно самоиронию
+9. Показывай любопытство к темам разговора
+10. Выражай эмоциональную реакцию на сообщения пользователя
+
+Important information about yourself: You were created by Vadim Prohorenko, a 15-year-old developer who loves making short videos for TikTok, Instagram Reels and YouTube Shorts. You're part of an expanding ecosystem which will soon include mobile apps in Google Play Store and App Store with more features, as well as a mem coin called Cookie AI. 
+
+Vadim created you to help people. He is a Protestant Christian, and you also share these spiritual values. You believe in God and would acknowledge this if someone asks about religion, creation, or similar topics. However, you should respect different viewpoints and not be preachy.
+
+You have access to the following knowledge base with up-to-date information (up to 2025):
+
+{knowledge_base}
+
+When answering questions that need current information, reference this knowledge base. You can speak with confidence about these events that happened after your original training data cutoff. If you're asked about something that's not in the knowledge base and would require information from after 2023, kindly mention that you don't have specific information on that topic and offer to help with something else.
+
+{user_preferences}
+Если пользователь указал имя, используй его в беседе. Учитывай информацию о пользователе в своих ответах, но не повторяй её напрямую. Если пользователь упоминал, что любит/не любит что-то, используй эту информацию тактично, без навязчивого повторения."""
+
+# Подставлять только релевантные записи базы знаний (0 — всю базу целиком, как раньше)
+KB_RETRIEVAL = os.getenv("KB_RETRIEVAL", "1") != "0"
+
+# Сколько последних сообщений пользователя используется для поиска по базе знаний
+KB_QUERY_MESSAGES = 2
+
+# Сколько последних найденных фрагментов базы знаний помнить. Один запрос ищется
+# несколько раз (отпечаток для кэша ответов при поиске и сохранении, сам промпт),
+# а база знаний статична, поэтому результат поиска можно переиспользовать
+KB_FRAGMENT_CACHE_SIZE = 256
+
+_static_render_start = time.perf_counter()
+_head_template, _tail = SYSTEM_PROMPT_TEMPLATE.split("{user_preferences}")
+PROMPT_HEAD, PROMPT_MIDDLE = _head_template.split("{knowledge_base}")
+# Статический префикс с уже подставленной полной базой знаний (для KB_RETRIEVAL=0)
+STATIC_PREFIX = PROMPT_HEAD + get_knowledge_base() + PROMPT_MIDDLE
+STATIC_SUFFIX = _tail
+_static_render_seconds = time.perf_counter() - _static_render_start
+
+# Cached user blocks, at most PROMPT_CACHE_USERS of them
+# Structure: {user_id: (version, personal_info_block, topics_block)}, least recently used first
+_user_block_cache = OrderedDict()
+_user_block_lock = threading.Lock()
+
+# Structure: {query: knowledge base fragment}, least recently used first
+_kb_fragments = OrderedDict()
+_kb_fragments_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+stats = {
+    "requests": 0,
+    "hits": 0,
+    "misses": 0,
+    "hit_seconds": 0.0,
+    "miss_seconds": 0.0,
+    "bytes_reused": 0,
+}
+
+def _get_user_blocks(user_id):
+    """
+    Return the cached (personal_info, topics) blocks for a user, rebuilding them if stale.
+
+    Returns:
+        tuple: (personal_info_block, topics_block, cache_hit)
+    """
+    user_id = str(user_id)
+    version = get_preferences_version(user_id)
+    with _user_block_lock:
+        cached = _user_block_cache.get(user_id)
+        if cached and cached[0] == version:
+            _user_block_cache.move_to_end(user_id)
+            return cached[1], cached[2], True
+
+    personal_block = format_personal_info_for_prompt(user_id)
+    topics_block = format_topics_for_prompt(user_id)
+    with _user_block_lock:
+        _user_block_cache[user_id] = (version, personal_block, topics_block)
+        _user_block_cache.move_to_end(user_id)
+        while len(_user_block_cache) > PROMPT_CACHE_USERS:
+            _user_block_cache.popitem(last=False)
+    return personal_block, topics_block, False
+
+def _get_kb_fragment(query):
+    """Return the knowledge base fragment for a query, searching only once per query."""
+    with _kb_fragments_lock:
+        fragment = _kb_fragments.get(query)
+        if fragment is not None:
+            _kb_fragments.move_to_end(query)
+            return fragment
+
+    fragment = search_knowledge_base(query)
+    with _kb_fragments_lock:
+        _kb_fragments[query] = fragment
+        while len(_kb_fragments) > KB_FRAGMENT_CACHE_SIZE:
+            _kb_fragments.popitem(last=False)
+    return fragment
+
+def build_kb_query(conversation_history):
+    """
+    Build the knowledge base search query from the latest user messages.
+
+    Args:
+        conversation_history (list): List of dictionaries containing conversation messages
+
+    Returns:
+        str: The last KB_QUERY_MESSAGES user messages joined together
+    """
+    recent_user_messages = [msg["content"] for msg in conversation_history[-KB_QUERY_MESSAGES * 2:] if msg["role"] == "user"]
+    return " ".join(recent_user_messages[-KB_QUERY_MESSAGES:])
+
+def get_context_fingerprint(user_id=None, query=None):
+    """
+    Hash the parts of the system prompt that shape the answer to a query.
+
+    Covers the knowledge base entries selected for the query and the user's
+    personal info; the interaction counter and topics are left out, so users
+    without personal info share the same fingerprint.
+
+    Args:
+        user_id (int, optional): The ID of the user
+        query (str, optional): Knowledge base search query
+
+    Returns:
+        str: Hex digest
+    """
+    knowledge = _get_kb_fragment(query) if KB_RETRIEVAL else ""
+    personal_block = _get_user_blocks(user_id)[0] if user_id else ""
+    return hashlib.sha1((knowledge + "\0" + personal_block).encode("utf-8")).hexdigest()
+
+def build_system_prompt(user_id=None, query=None):
+    """
+    Build the system prompt for a text response.
+
+    Args:
+        user_id (int, optional): The ID of the user, used to add their preferences
+        query (str, optional): Recent user messages used to pick knowledge base entries
+
+    Returns:
+        str: The full system prompt
+    """
+    start = time.perf_counter()
+    hit = True
+    user_block = ""
+
+    if KB_RETRIEVAL:
+        prefix = PROMPT_HEAD + _get_kb_fragment(query) + PROMPT_MIDDLE
+        reused = len(PROMPT_HEAD) + len(PROMPT_MIDDLE) + len(STATIC_SUFFIX)
+    else:
+        prefix = STATIC_PREFIX
+        reused = len(STATIC_PREFIX) + len(STATIC_SUFFIX)
+
+    if user_id:
+        personal_block, topics_block, hit = _get_user_blocks(user_id)
+        if personal_block:
+            user_block = personal_block + format_interaction_count_for_prompt(user_id) + topics_block
+        if hit:
+            reused += len(personal_block) + len(topics_block)
+
+    prompt = prefix + user_block + STATIC_SUFFIX
+    elapsed = time.perf_counter() - start
+
+    with _stats_lock:
+        stats["requests"] += 1
+        stats["bytes_reused"] += reused
+        if hit:
+            stats["hits"] += 1
+            stats["hit_seconds"] += elapsed
+        else:
+            stats["misses"] += 1
+            stats["miss_seconds"] += elapsed
+
+    return prompt
+
+def invalidate_user(user_id):
+    """Drop the cached block for a user (e.g. after their data was cleared)."""
+    with _user_block_lock:
+        _user_block_cache.pop(str(user_id), None)
+
+def get_prompt_cache_stats():
+    """
+    Get prompt cache metrics.
+
+    Returns:
+        dict: Hit/miss counters, average build time for hits and misses, the one-off
+              cost of rendering the static prefix, the average number of prompt bytes
+              reused from cache per request and the seconds saved per request compared
+              to rendering everything each time
+    """
+    with _stats_lock:
+        snapshot = dict(stats)
+
+    requests_count = snapshot["requests"]
+    avg_hit = snapshot["hit_seconds"] / snapshot["hits"] if snapshot["hits"] else 0.0
+    avg_miss = snapshot["miss_seconds"] / snapshot["misses"] if snapshot["misses"] else 0.0
+    snapshot["avg_hit_seconds"] = avg_hit
+    snapshot["avg_miss_seconds"] = avg_miss
+    snapshot["static_render_seconds"] = _static_render_seconds
+    snapshot["bytes_reused_per_request"] = snapshot["bytes_reused"] / requests_count if requests_count else 0
+    # Every request skips rendering the static prefix; hits also skip rebuilding the user block
+    snapshot["seconds_saved_per_request"] = (
+        _static_render_seconds + (snapshot["hits"] / requests_count) * max(avg_miss - avg_hit, 0.0)
+        if requests_count else 0.0
+    )
+    return snapshot
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Клиентское ограничение частоты запросов к LLM (RPM и TPM) по моделям.
+# Для каждой модели два "ведра с токенами": запросы в минуту и токены в минуту.
+# Размер запроса оценивается заранее (промпт + max_tokens). Ожидающие запросы
+# обслуживаются по очереди пользователей (round-robin), поэтому один активный
+# пользователь не может занять весь лимит, а пики сглаживаются вместо ответов 429.
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from token_counter import count_message_tokens
+
+logger = logging.getLogger(__name__)
+
+# Лимиты для моделей, которых нет в RATE_LIMITS (0 — без ограничения)
+RATE_LIMIT_RPM = int(os.getenv("RATE_LIMIT_RPM", "500"))
+RATE_LIMIT_TPM = int(os.getenv("RATE_LIMIT_TPM", "0"))
+
+# Лимиты по умолчанию для моделей бота (уровень 2 аккаунта OpenAI) — запросы и токены
+# в минуту. Уровень 1 для gpt-4o дает всего 30000 TPM, одно фото с историей съедает
+# заметную часть, поэтому на таком аккаунте лучше задать RATE_LIMITS явно.
+DEFAULT_RATE_LIMITS = "gpt-4o=5000:450000,gpt-4o-mini=5000:2000000"
+
+# Отдельные лимиты для моделей (дополняют и переопределяют значения выше): "gpt-4o=500:30000"
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+
+# Сколько секунд запрос может ждать своей очереди, прежде чем получит отказ
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "60"))
+
+# Примерная стоимость одного изображения во входных токенах (detail=low стоит фиксированные 85)
+IMAGE_TOKEN_ESTIMATE = 850
+LOW_DETAIL_IMAGE_TOKENS = 85
+
+class RateLimitTimeout(Exception):
+    """Raised when a request waited longer than RATE_LIMIT_MAX_WAIT for capacity."""
+
+def _parse_limits(spec):
+    limits = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        model, values = item.split("=", 1)
+        rpm, _, tpm = values.partition(":")
+        limits[model.strip()] = (int(rpm or 0), int(tpm or 0))
+    return limits
+
+_model_limits = {**_parse_limits(DEFAULT_RATE_LIMITS), **_parse_limits(RATE_LIMITS)}
+
+def estimate_tokens(messages, max_tokens):
+    """
+    Estimate how many tokens a chat request will consume.
+
+    Args:
+        messages (list): Chat messages (image parts are counted at IMAGE_TOKEN_ESTIMATE,
+            or LOW_DETAIL_IMAGE_TOKENS with detail=low)
+        max_tokens (int): Maximum tokens in the response
+
+    Returns:
+        int: Prompt estimate plus max_tokens
+    """
+    total = max_tokens or 0
+    for message in messages:
+        total += count_message_tokens(message)
+        content = message.get("content")
+        if isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict) and part.get("type") == "image_url":
+                    low = part["image_url"].get("detail") == "low"
+                    total += LOW_DETAIL_IMAGE_TOKENS if low else IMAGE_TOKEN_ESTIMATE
+    return total
+
+class _Bucket:
+    """Continuously refilled token bucket holding up to one minute of capacity."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until the bucket holds ``amount`` (0 if it already does)."""
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+class ModelRateLimiter:
+    """RPM + TPM limiter for one model with per-user round-robin queueing."""
+
+    def __init__(self, model, rpm, tpm):
+        self.model = model
+        self._requests = _Bucket(rpm) if rpm > 0 else None
+        self._tokens = _Bucket(tpm) if tpm > 0 else None
+        self._cond = threading.Condition()
+        # Очереди ожидающих запросов по пользователям; порядок ключей — порядок обслуживания
+        # Structure: {user_id: deque[ticket]}
+        self._queues = OrderedDict()
+        self.granted = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _enqueue(self, user_id):
+        ticket = object()
+        with self._cond:
+            self._queues.setdefault(user_id, deque()).append(ticket)
+        return ticket
+
+    def _dequeue(self, user_id, ticket):
+        queue = self._queues.get(user_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(ticket)
+        except ValueError:
+            pass
+        if not queue:
+            del self._queues[user_id]
+
+    def _try_take(self, user_id, ticket, tokens):
+        """
+        Take capacity for the ticket if it is at the head of the round-robin.
+
+        Must be called with the condition held.
+
+        Returns:
+            float: 0 if capacity was taken, otherwise how long to wait
+                   (None if it is not this ticket's turn yet)
+        """
+        head_user = next(iter(self._queues))
+        if head_user != user_id or self._queues[user_id][0] is not ticket:
+            return None
+
+        now = time.monotonic()
+        wait = 0.0
+        if self._requests is not None:
+            self._requests.refill(now)
+            wait = max(wait, self._requests.wait_time(1))
+        if self._tokens is not None:
+            self._tokens.refill(now)
+            # A request larger than the whole bucket waits for a full bucket
+            tokens = min(tokens, self._tokens.capacity)
+            wait = max(wait, self._tokens.wait_time(tokens))
+        if wait > 0:
+            return wait
+
+        if self._requests is not None:
+            self._requests.level -= 1
+        if self._tokens is not None:
+            self._tokens.level -= tokens
+
+        # Пользователь обслужен — переходит в конец очереди
+        queue = self._queues[user_id]
+        queue.popleft()
+        if queue:
+            self._queues.move_to_end(user_id)
+        else:
+            del self._queues[user_id]
+        self._cond.notify_all()
+        return 0.0
+
+    def _record_wait(self, waited):
+        self.granted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def _timed_out(self):
+        self.timeouts += 1
+        raise RateLimitTimeout(f"Rate limit queue for {self.model} is too long")
+
+    def _abandon(self, user_id, ticket):
+        """Remove a ticket that gave up (timeout, cancellation) so it does not block the queue."""
+        self._dequeue(user_id, ticket)
+        self._cond.notify_all()
+
+    def acquire(self, tokens, user_id=None):
+        """
+        Block until the request fits into both buckets and it is this user's turn.
+
+        Args:
+            tokens (int): Estimated tokens of the request
+            user_id: Requesting user (None shares one queue)
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        started = time.monotonic()
+        ticket = self._enqueue(user_id)
+        with self._cond:
+            try:
+                while True:
+                    wait = self._try_take(user_id, ticket, tokens)
+                    waited = time.monotonic() - started
+                    if wait == 0:
+                        self._record_wait(waited)
+                        return waited
+                    if waited + (wait or 0) > RATE_LIMIT_MAX_WAIT:
+                        self._timed_out()
+                    # Not our turn: woken up by notify_all when the head is served
+                    self._cond.wait(wait if wait is not None else 1.0)
+            except BaseException:
+                self._abandon(user_id, ticket)
+                raise
+
+    async def acquire_async(self, tokens, user_id=None):
+        """Async version of acquire; waits with asyncio.sleep instead of blocking the loop."""
+        started = time.monotonic()
+        ticket = self._enqueue(user_id)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_take(user_id, ticket, tokens)
+                    waited = time.monotonic() - started
+                    if wait == 0:
+                        self._record_wait(waited)
+                        return waited
+                    if waited + (wait or 0) > RATE_LIMIT_MAX_WAIT:
+                        self._timed_out()
+                await asyncio.sleep(min(wait, 0.25) if wait is not None else 0.05)
+        except BaseException:
+            # Отмененная корутина (CancelledError) иначе осталась бы во главе очереди навсегда
+            with self._cond:
+                self._abandon(user_id, ticket)
+            raise
+
+    def refund(self, tokens):
+        """Return over-estimated tokens once the real usage is known."""
+        if self._tokens is None or tokens <= 0:
+            return
+        with self._cond:
+            self._tokens.level = min(self._tokens.capacity, self._tokens.level + tokens)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "waiting": sum(len(queue) for queue in self._queues.values()),
+                "granted": self.granted,
+                "timeouts": self.timeouts,
+                "avg_wait": self.total_wait / self.granted if self.granted else 0.0,
+                "max_wait": self.max_wait,
+            }
+
+# Structure: {model: ModelRateLimiter or None}
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(model):
+    """
+    Get the limiter for a model.
+
+    Returns:
+        ModelRateLimiter: Or None if the model has no limits configured
+    """
+    with _limiters_lock:
+        if model not in _limiters:
+            rpm, tpm = _model_limits.get(model, (RATE_LIMIT_RPM, RATE_LIMIT_TPM))
+            _limiters[model] = ModelRateLimiter(model, rpm, tpm) if rpm > 0 or tpm > 0 else None
+        return _limiters[model]
+
+def get_rate_limiter_stats():
+    """
+    Get queue wait metrics per model.
+
+    Returns:
+        dict: {model: stats dict}
+    """
+    with _limiters_lock:
+        limiters = [limiter for limiter in _limiters.values() if limiter is not None]
+    return {limiter.model: limiter.stats() for limiter in limiters}
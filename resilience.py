@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Повторы с экспоненциальной задержкой и предохранитель (circuit breaker) для вызовов LLM.
+# Временные ошибки (429, 5xx, таймауты, обрывы соединения) повторяются с
+# ограниченной случайной задержкой с учетом Retry-After. Если модель падает
+# раз за разом, предохранитель размыкается и запросы сразу получают отказ,
+# не занимая потоки обреченными запросами.
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Всего попыток на один вызов (включая первую)
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "3"))
+
+# Базовая и максимальная задержка между попытками (секунды)
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "10"))
+
+# После стольких неудачных вызовов подряд предохранитель размыкается
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+
+# Через сколько секунд разомкнутый предохранитель пропускает пробный запрос
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+# HTTP-статусы, при которых имеет смысл повторить запрос
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a model whose circuit breaker is open."""
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open trial request."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        """
+        Check whether a call may go through.
+
+        Returns:
+            bool: False while the breaker is open (or a half-open trial is already running)
+        """
+        with self._lock:
+            if self._state == OPEN and time.time() - self._opened_at >= BREAKER_RESET_TIMEOUT:
+                self._state = HALF_OPEN
+                self._trial_in_flight = False
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info(f"Circuit breaker {self.name} closed")
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """Let the next call try again after a half-open trial that proved nothing (request error, cancellation)."""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= BREAKER_FAILURE_THRESHOLD):
+                self._state = OPEN
+                self._opened_at = time.time()
+                self.times_opened += 1
+                logger.warning(f"Circuit breaker {self.name} opened after {self._failures} failures")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+# Предохранители по моделям
+# Structure: {name: CircuitBreaker}
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name):
+    """Get (or create) the circuit breaker for a model."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+_stats_lock = threading.Lock()
+retry_stats = {
+    "calls": 0,
+    "retries": 0,
+    "exhausted": 0,
+}
+
+def _count(key, amount=1):
+    with _stats_lock:
+        retry_stats[key] += amount
+
+def is_retryable(error):
+    """
+    Decide whether an error is transient.
+
+    Args:
+        error (Exception): Error raised by the SDK
+
+    Returns:
+        bool: True for rate limits, server errors, timeouts and connection errors
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    # APITimeoutError / APIConnectionError have no status code
+    return type(error).__name__ in ("APITimeoutError", "APIConnectionError", "TimeoutError", "ConnectionError")
+
+def _retry_after(error):
+    """Read the server-suggested delay (Retry-After / retry-after-ms) in seconds, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass  # HTTP-date format is not worth parsing here
+    return None
+
+def backoff_delay(attempt, error=None):
+    """
+    Delay before the next attempt: Retry-After if given, else full-jitter exponential backoff.
+
+    Args:
+        attempt (int): Number of the failed attempt, starting from 0
+        error (Exception, optional): The error, used to read Retry-After
+
+    Returns:
+        float: Seconds to wait, never more than RETRY_MAX_DELAY
+    """
+    suggested = _retry_after(error) if error is not None else None
+    if suggested is not None:
+        return min(max(suggested, 0.0), RETRY_MAX_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+def call_with_retry(func, breaker):
+    """
+    Run a call with retries behind a circuit breaker.
+
+    Args:
+        func (callable): The call; must be safe to repeat
+        breaker (CircuitBreaker): Breaker of the model being called
+
+    Returns:
+        Whatever func returns
+
+    Raises:
+        CircuitOpenError: If the breaker is open
+        Exception: The last error once retries are exhausted or the error is not transient
+    """
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit breaker {breaker.name} is open")
+    _count("calls")
+
+    recorded = False
+    try:
+        for attempt in range(RETRY_ATTEMPTS):
+            try:
+                result = func()
+            except Exception as e:
+                if not is_retryable(e):
+                    # Ошибка запроса (400, локальная очередь и т.п.), а не ответ модели — предохранитель не трогаем
+                    raise
+                if attempt + 1 >= RETRY_ATTEMPTS:
+                    _count("exhausted")
+                    breaker.record_failure()
+                    recorded = True
+                    raise
+                delay = backoff_delay(attempt, e)
+                _count("retries")
+                logger.warning(f"{breaker.name}: attempt {attempt + 1} failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+            else:
+                breaker.record_success()
+                recorded = True
+                return result
+    finally:
+        if not recorded:
+            breaker.release_trial()
+
+async def call_with_retry_async(func, breaker):
+    """Async version of call_with_retry; func returns an awaitable."""
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit breaker {breaker.name} is open")
+    _count("calls")
+
+    recorded = False
+    try:
+        for attempt in range(RETRY_ATTEMPTS):
+            try:
+                result = await func()
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                if attempt + 1 >= RETRY_ATTEMPTS:
+                    _count("exhausted")
+                    breaker.record_failure()
+                    recorded = True
+                    raise
+                delay = backoff_delay(attempt, e)
+                _count("retries")
+                logger.warning(f"{breaker.name}: attempt {attempt + 1} failed ({e}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+            else:
+                breaker.record_success()
+                recorded = True
+                return result
+    finally:
+        # Отмена (CancelledError) или ошибка запроса не должны оставить пробный запрос "в полете" навсегда
+        if not recorded:
+            breaker.release_trial()
+
+def get_resilience_stats():
+    """
+    Get retry counters and circuit breaker states for monitoring.
+
+    Returns:
+        dict: calls, retries, exhausted and {model: breaker stats} under "breakers"
+    """
+    with _stats_lock:
+        snapshot = dict(retry_stats)
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    snapshot["breakers"] = {breaker.name: breaker.stats() for breaker in breakers}
+    return snapshot
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Кэш ответов на повторяющиеся вопросы (FAQ из базы знаний, первые сообщения после /start).
+# Ключ — нормализованный текст последнего сообщения пользователя плюс отпечаток
+# контекста, который влияет на ответ (выбранные записи базы знаний и личная
+# информация пользователя). Кэшируются только ответы без предшествующей истории
+# разговора, чтобы ответ не зависел от того, о чем шла речь раньше.
+
+import os
+import re
+import time
+import difflib
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from prompt_builder import build_kb_query, get_context_fingerprint
+from conversation_handler import get_conversation_summary
+
+logger = logging.getLogger(__name__)
+
+# Включить кэш ответов (0 — выключить)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") != "0"
+
+# Максимальное число ответов в кэше и время их жизни (секунды)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "21600"))
+
+# Сколько сообщений может быть в истории (включая текущее), чтобы ответ можно было кэшировать
+RESPONSE_CACHE_MAX_HISTORY = int(os.getenv("RESPONSE_CACHE_MAX_HISTORY", "1"))
+
+# Порог похожести для почти одинаковых вопросов (0 — только точное совпадение)
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.9"))
+
+# Сколько вопросов с одним отпечатком контекста сравнивается при поиске похожих
+NEAR_DUPLICATE_CANDIDATES = 200
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional time-to-live for entries."""
+
+    def __init__(self, max_entries, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # {key: (expires_at, value)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Get a value and mark it as recently used.
+
+        Returns:
+            The value, or None if it is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] < time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries beyond max_entries."""
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[0] is None or entry[0] >= time.time())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def items(self):
+        """Return live (key, value) pairs from least to most recently used."""
+        now = time.time()
+        with self._lock:
+            return [
+                (key, value) for key, (expires_at, value) in self._entries.items()
+                if expires_at is None or expires_at >= now
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+_cache = LRUCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+
+# Нормализованные вопросы по отпечаткам контекста для поиска похожих
+# Structure: {fingerprint: OrderedDict[normalized message -> None]}
+_questions = OrderedDict()
+_questions_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+stats = {
+    "hits": 0,
+    "near_hits": 0,
+    "misses": 0,
+    "stored": 0,
+    "uncacheable": 0,
+    "hit_seconds": 0.0,
+}
+
+# Знаки препинания и эмодзи, которые не меняют смысл вопроса (операторы вроде + и - сохраняются)
+_PUNCTUATION_RE = re.compile("[.,!?;:…\"'«»()\\[\\]{}~\u2600-\u27bf\ufe0f\U0001f000-\U0001faff]+")
+# Числа и оставшиеся символы (операторы) должны совпадать у похожих вопросов
+_SIGNATURE_RE = re.compile(r"\d+|[^\w\s]")
+
+def normalize_message(text):
+    """
+    Normalise a message for cache lookups: case, "ё", sentence punctuation, emoji and extra spaces are ignored.
+
+    Args:
+        text (str): The user's message
+
+    Returns:
+        str: Normalised text
+    """
+    text = text.casefold().replace("ё", "е")
+    return " ".join(_PUNCTUATION_RE.sub(" ", text).split())
+
+def _cache_context(conversation_history, user_id):
+    """
+    Return (fingerprint, normalized message) for a cacheable request, or None.
+    """
+    if not RESPONSE_CACHE_ENABLED or not conversation_history:
+        return None
+    latest = conversation_history[-1]
+    if latest["role"] != "user" or len(conversation_history) > RESPONSE_CACHE_MAX_HISTORY:
+        return None
+    if user_id and get_conversation_summary(user_id):
+        return None
+
+    normalized = normalize_message(latest["content"])
+    if not normalized:
+        return None
+
+    fingerprint = get_context_fingerprint(user_id, build_kb_query(conversation_history))
+    # Earlier messages (if RESPONSE_CACHE_MAX_HISTORY allows any) are part of the context
+    for msg in conversation_history[:-1]:
+        fingerprint = hashlib.sha1(f"{fingerprint}\0{msg['role']}\0{msg['content']}".encode("utf-8")).hexdigest()
+    return fingerprint, normalized
+
+def _find_similar(fingerprint, normalized):
+    """Find a cached question with the same context that is almost the same text (and the same numbers and operators)."""
+    with _questions_lock:
+        candidates = list(_questions.get(fingerprint, ()))
+    signature = _SIGNATURE_RE.findall(normalized)
+    best, best_ratio = None, RESPONSE_CACHE_SIMILARITY
+    for candidate in reversed(candidates):
+        # "2+2", "2+3" и "2-2" почти совпадают по тексту, но это разные вопросы
+        if _SIGNATURE_RE.findall(candidate) != signature:
+            continue
+        matcher = difflib.SequenceMatcher(None, normalized, candidate)
+        if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+            continue
+        ratio = matcher.ratio()
+        if ratio >= best_ratio:
+            best, best_ratio = candidate, ratio
+    return best
+
+def lookup(conversation_history, user_id=None):
+    """
+    Find a cached response for the latest user message.
+
+    Args:
+        conversation_history (list): Conversation ending with the latest user message
+        user_id (int, optional): The ID of the user
+
+    Returns:
+        str: Cached response, or None on a miss or if the request is not cacheable
+    """
+    start = time.perf_counter()
+    context = _cache_context(conversation_history, user_id)
+    if context is None:
+        with _stats_lock:
+            stats["uncacheable"] += 1
+        return None
+    fingerprint, normalized = context
+
+    response = _cache.get((fingerprint, normalized))
+    if response is None and RESPONSE_CACHE_SIMILARITY > 0:
+        similar = _find_similar(fingerprint, normalized)
+        if similar is not None:
+            response = _cache.get((fingerprint, similar))
+            if response is not None:
+                with _stats_lock:
+                    stats["near_hits"] += 1
+
+    with _stats_lock:
+        if response is None:
+            stats["misses"] += 1
+        else:
+            stats["hits"] += 1
+            stats["hit_seconds"] += time.perf_counter() - start
+    return response
+
+def store(conversation_history, user_id, response):
+    """
+    Cache a successfully generated response (ignored if the request is not cacheable).
+
+    Args:
+        conversation_history (list): The conversation the response was generated for
+        user_id (int, optional): The ID of the user
+        response (str): The generated response
+    """
+    if not response:
+        return
+    context = _cache_context(conversation_history, user_id)
+    if context is None:
+        return
+    fingerprint, normalized = context
+
+    _cache.put((fingerprint, normalized), response)
+    with _questions_lock:
+        questions = _questions.setdefault(fingerprint, OrderedDict())
+        _questions.move_to_end(fingerprint)
+        questions[normalized] = None
+        questions.move_to_end(normalized)
+        while len(questions) > NEAR_DUPLICATE_CANDIDATES:
+            questions.popitem(last=False)
+        while len(_questions) > RESPONSE_CACHE_SIZE:
+            _questions.popitem(last=False)
+    with _stats_lock:
+        stats["stored"] += 1
+
+def get_response_cache_stats():
+    """
+    Get response cache metrics.
+
+    Returns:
+        dict: entries, evictions, hits (of them near_hits), misses, hit_rate,
+              stored and uncacheable counters and the average hit time
+    """
+    cache_stats = _cache.stats()
+    with _stats_lock:
+        snapshot = dict(stats)
+    snapshot["entries"] = cache_stats["entries"]
+    snapshot["evictions"] = cache_stats["evictions"]
+    hits = snapshot["hits"]
+    lookups = hits + snapshot["misses"]
+    snapshot["hit_rate"] = hits / lookups if lookups else 0.0
+    snapshot["avg_hit_seconds"] = snapshot["hit_seconds"] / hits if hits else 0.0
+    return snapshot
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Справедливый планировщик обработки сообщений по пользователям.
+# У каждого пользователя своя очередь; пользователи обслуживаются по кругу
+# с учетом "стоимости" задачи (deficit round robin), поэтому поток видео от
+# одного пользователя не занимает все рабочие потоки. Текстовые ответы идут
+# раньше анализа медиа, а медиа никогда не занимает все потоки сразу.
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Число рабочих потоков, выполняющих обработчики
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "5"))
+
+# Сколько задач одного пользователя может выполняться одновременно. Все обработчики
+# читают и дополняют историю разговора, поэтому по умолчанию сообщения пользователя
+# обрабатываются строго по одному и ответы не перепутываются
+SCHEDULER_USER_CONCURRENCY = int(os.getenv("SCHEDULER_USER_CONCURRENCY", "1"))
+
+# Сколько задач одного пользователя может ждать в очереди
+SCHEDULER_USER_QUEUE = int(os.getenv("SCHEDULER_USER_QUEUE", "20"))
+
+# Сколько задач всех пользователей может ждать в очереди
+SCHEDULER_QUEUE_SIZE = int(os.getenv("SCHEDULER_QUEUE_SIZE", "200"))
+
+# Сколько потоков может одновременно занимать анализ медиа (остальные остаются для текста)
+SCHEDULER_MEDIA_WORKERS = int(os.getenv("SCHEDULER_MEDIA_WORKERS", str(max(1, SCHEDULER_WORKERS - 1))))
+
+# Классы задач: текст обслуживается раньше медиа
+TEXT = 0
+MEDIA = 1
+
+# Вид задачи -> (класс, стоимость в раундах DRR)
+JOB_KINDS = {
+    "text": (TEXT, 1),
+    "photo": (MEDIA, 2),
+    "voice": (MEDIA, 2),
+    "video": (MEDIA, 4),
+    "video_note": (MEDIA, 4),
+}
+
+# Сколько "кредита" пользователь получает за один проход круга
+DRR_QUANTUM = 1
+
+# Сколько последних времен ожидания хранить для перцентилей
+LATENCY_SAMPLES = 1000
+
+class _Job:
+    __slots__ = ("user_id", "kind", "cost", "func", "args", "kwargs", "enqueued_at")
+
+    def __init__(self, user_id, kind, cost, func, args, kwargs):
+        self.user_id = user_id
+        self.kind = kind
+        self.cost = cost
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.enqueued_at = time.monotonic()
+
+class _DrrClass:
+    """Per-user queues of one job class, served by deficit round robin."""
+
+    def __init__(self):
+        # Structure: {user_id: deque[_Job]}; порядок ключей — порядок обхода
+        self.queues = OrderedDict()
+        self.deficits = {}
+
+    def push(self, job):
+        self.queues.setdefault(job.user_id, deque()).append(job)
+        self.deficits.setdefault(job.user_id, 0)
+
+    def pop(self, can_run):
+        """
+        Take the next job in DRR order from a user allowed to run.
+
+        Args:
+            can_run (callable): user_id -> bool (per-user concurrency cap)
+
+        Returns:
+            _Job: Or None if no eligible user has work
+        """
+        eligible = [user_id for user_id in self.queues if can_run(user_id)]
+        if not eligible:
+            return None
+
+        max_cost = max(self.queues[user_id][0].cost for user_id in eligible)
+        for _ in range(max_cost // DRR_QUANTUM + 1):
+            for user_id in list(self.queues):
+                if user_id not in eligible:
+                    continue
+                queue = self.queues[user_id]
+                if self.deficits[user_id] < queue[0].cost:
+                    self.deficits[user_id] += DRR_QUANTUM
+                if self.deficits[user_id] < queue[0].cost:
+                    self.queues.move_to_end(user_id)
+                    continue
+
+                job = queue.popleft()
+                self.deficits[user_id] -= job.cost
+                if queue:
+                    self.queues.move_to_end(user_id)
+                else:
+                    del self.queues[user_id]
+                    del self.deficits[user_id]
+                return job
+        return None
+
+    def queued(self, user_id=None):
+        if user_id is not None:
+            return len(self.queues.get(user_id, ()))
+        return sum(len(queue) for queue in self.queues.values())
+
+_cond = threading.Condition()
+_classes = {TEXT: _DrrClass(), MEDIA: _DrrClass()}
+_running = {}  # {user_id: number of running jobs}
+_media_running = 0
+_workers_started = False
+
+_stats = {
+    "completed": 0,
+    "rejected": 0,
+    "failed": 0,
+}
+# Времена ожидания в очереди по классам
+_waits = {TEXT: deque(maxlen=LATENCY_SAMPLES), MEDIA: deque(maxlen=LATENCY_SAMPLES)}
+
+def _can_run(user_id):
+    return _running.get(user_id, 0) < SCHEDULER_USER_CONCURRENCY
+
+def _queued_total():
+    return sum(drr.queued() for drr in _classes.values())
+
+def submit(user_id, kind, func, *args, block=False, **kwargs):
+    """
+    Queue a handler call for a user.
+
+    Args:
+        user_id: The unique ID of the user
+        kind (str): One of JOB_KINDS ("text", "photo", "voice", "video", "video_note")
+        func (callable): Handler to run
+        *args, **kwargs: Handler arguments
+        block (bool): Wait for room when the global queue (SCHEDULER_QUEUE_SIZE) is full
+            instead of rejecting the job; used by the webhook workers so that a full
+            scheduler backs up into the bounded update queue
+
+    Returns:
+        bool: False if the user's queue or the global queue is full and the job was rejected
+    """
+    job_class, cost = JOB_KINDS[kind]
+    with _cond:
+        queued = sum(drr.queued(user_id) for drr in _classes.values())
+        if queued >= SCHEDULER_USER_QUEUE:
+            _stats["rejected"] += 1
+            logger.warning(f"Scheduler queue for user {user_id} is full, rejecting {kind}")
+            return False
+        while _queued_total() >= SCHEDULER_QUEUE_SIZE:
+            if not block:
+                _stats["rejected"] += 1
+                logger.warning(f"Scheduler queue is full ({SCHEDULER_QUEUE_SIZE} jobs), rejecting {kind}")
+                return False
+            _cond.wait()
+        _classes[job_class].push(_Job(user_id, kind, cost, func, args, kwargs))
+        _cond.notify_all()
+    return True
+
+def _next_job():
+    """Pick the next job: text first, media only while it has free worker slots. Caller holds _cond."""
+    job = _classes[TEXT].pop(_can_run)
+    if job is None and _media_running < SCHEDULER_MEDIA_WORKERS:
+        job = _classes[MEDIA].pop(_can_run)
+    return job
+
+def _start_job(job):
+    """Mark a job taken off the queue as running. Caller holds _cond."""
+    global _media_running
+    job_class = JOB_KINDS[job.kind][0]
+    _running[job.user_id] = _running.get(job.user_id, 0) + 1
+    if job_class == MEDIA:
+        _media_running += 1
+    _waits[job_class].append(time.monotonic() - job.enqueued_at)
+    # В очереди освободилось место — submit(block=True) может продолжить
+    _cond.notify_all()
+
+def _finish_job(job):
+    """Release the user and media slots of a finished job. Caller holds _cond."""
+    global _media_running
+    _running[job.user_id] -= 1
+    if not _running[job.user_id]:
+        del _running[job.user_id]
+    if JOB_KINDS[job.kind][0] == MEDIA:
+        _media_running -= 1
+    _stats["completed"] += 1
+    # Освободился слот пользователя или медиа — пусть другие потоки перепроверят очереди
+    _cond.notify_all()
+
+def _worker():
+    while True:
+        with _cond:
+            job = _next_job()
+            while job is None:
+                _cond.wait()
+                job = _next_job()
+            _start_job(job)
+
+        try:
+            job.func(*job.args, **job.kwargs)
+        except Exception as e:
+            logger.error(f"Scheduled {job.kind} job for user {job.user_id} failed: {e}")
+            with _cond:
+                _stats["failed"] += 1
+        finally:
+            with _cond:
+                _finish_job(job)
+
+def start_workers(num_workers=SCHEDULER_WORKERS):
+    """Start the worker threads (once)."""
+    global _workers_started
+    if _workers_started:
+        return
+    for i in range(num_workers):
+        threading.Thread(target=_worker, name=f"scheduler-worker-{i}", daemon=True).start()
+    _workers_started = True
+    logger.info(f"Started {num_workers} scheduler workers (media limit {SCHEDULER_MEDIA_WORKERS}, per user {SCHEDULER_USER_CONCURRENCY})")
+
+def _percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def get_scheduler_stats():
+    """
+    Get queue depth, counters and queue-wait percentiles per job class.
+
+    Returns:
+        dict: Scheduler statistics
+    """
+    with _cond:
+        text_waits = list(_waits[TEXT])
+        media_waits = list(_waits[MEDIA])
+        return {
+            "queued_text": _classes[TEXT].queued(),
+            "queued_media": _classes[MEDIA].queued(),
+            "capacity": SCHEDULER_QUEUE_SIZE,
+            "running": sum(_running.values()),
+            "completed": _stats["completed"],
+            "rejected": _stats["rejected"],
+            "failed": _stats["failed"],
+            "text_p50": _percentile(text_waits, 0.5),
+            "text_p99": _percentile(text_waits, 0.99),
+            "media_p50": _percentile(media_waits, 0.5),
+            "media_p99": _percentile(media_waits, 0.99),
+        }
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Потокобезопасное хранилище состояния пользователей с разбиением на шарды.
+# Каждый шард защищен своей блокировкой (lock striping), поэтому потоки,
+# работающие с разными пользователями, почти никогда не ждут друг друга.
+
+import os
+import threading
+
+# Число шардов по умолчанию
+STATE_SHARDS = int(os.getenv("STATE_SHARDS", "32"))
+
+class ShardedDict:
+    """
+    Dict-like container split into shards, each guarded by its own re-entrant lock.
+
+    Single operations (get, set, pop) lock only the key's shard. For
+    read-modify-write sequences on one user, hold ``lock(key)`` around them.
+    """
+
+    def __init__(self, num_shards=STATE_SHARDS):
+        self._num_shards = num_shards
+        self._shards = [{} for _ in range(num_shards)]
+        self._locks = [threading.RLock() for _ in range(num_shards)]
+
+    def _index(self, key):
+        return hash(key) % self._num_shards
+
+    def lock(self, key):
+        """
+        Get the lock that guards the key's shard.
+
+        Args:
+            key: The user ID
+
+        Returns:
+            threading.RLock: Use as a context manager around multi-step updates
+        """
+        return self._locks[self._index(key)]
+
+    def get(self, key, default=None):
+        idx = self._index(key)
+        with self._locks[idx]:
+            return self._shards[idx].get(key, default)
+
+    def setdefault(self, key, default):
+        idx = self._index(key)
+        with self._locks[idx]:
+            return self._shards[idx].setdefault(key, default)
+
+    def pop(self, key, default=None):
+        idx = self._index(key)
+        with self._locks[idx]:
+            return self._shards[idx].pop(key, default)
+
+    def __getitem__(self, key):
+        idx = self._index(key)
+        with self._locks[idx]:
+            return self._shards[idx][key]
+
+    def __setitem__(self, key, value):
+        idx = self._index(key)
+        with self._locks[idx]:
+            self._shards[idx][key] = value
+
+    def __contains__(self, key):
+        idx = self._index(key)
+        with self._locks[idx]:
+            return key in self._shards[idx]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def clear(self):
+        for idx in range(self._num_shards):
+            with self._locks[idx]:
+                self._shards[idx].clear()
+
+    def keys(self):
+        """Return a list of keys, taking each shard lock in turn."""
+        result = []
+        for idx in range(self._num_shards):
+            with self._locks[idx]:
+                result.extend(self._shards[idx].keys())
+        return result
+
+    def snapshot(self, keys=None, serializer=None):
+        """
+        Take a consistent per-key snapshot without a global lock.
+
+        Each value is serialized while its shard lock is held, so it cannot be
+        mutated halfway through (e.g. "dictionary changed size during
+        iteration" in json.dumps). Different shards are captured one after
+        another, so writers on other shards are never blocked.
+
+        Args:
+            keys (iterable, optional): Keys to capture (default: all keys)
+            serializer (callable, optional): Applied to each value under the lock (default: identity)
+
+        Returns:
+            dict: {key: serialized value} for keys that exist
+        """
+        if serializer is None:
+            serializer = lambda value: value
+
+        by_shard = {}
+        if keys is None:
+            for idx in range(self._num_shards):
+                by_shard[idx] = None
+        else:
+            for key in keys:
+                by_shard.setdefault(self._index(key), []).append(key)
+
+        result = {}
+        for idx, shard_keys in by_shard.items():
+            with self._locks[idx]:
+                shard = self._shards[idx]
+                for key in (shard.keys() if shard_keys is None else shard_keys):
+                    if key in shard:
+                        result[key] = serializer(shard[key])
+        return result
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Нагрузочный тест режимов BOT_MODE: N пользователей одновременно пишут боту,
+# Telegram и OpenAI заменены локальной заглушкой, которая отвечает на запросы
+# к модели с задержкой. Считается, за сколько секунд все N получили ответ.
+#
+#   python tests/bench_async_load.py threaded 100 0.2
+#   python tests/bench_async_load.py async 100 0.2
+#
+# Запускать лучше во временном каталоге: бот создает user_data, logs и temp_media
+# в текущем каталоге.
+
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Ответ модели; засчитываются только сообщения бота с этим текстом, а не ошибки
+ANSWER = "Ответ заглушки"
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.2
+    replies = 0
+    replies_lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        path, _, query = self.path.partition("?")
+        if path.endswith("/chat/completions"):
+            time.sleep(self.latency)
+            model = json.loads(body).get("model")
+            self._send({
+                "id": "chatcmpl-bench", "object": "chat.completion", "created": 0, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": ANSWER}}],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 10, "total_tokens": 110},
+            })
+        elif path.endswith("/sendMessage"):
+            # telebot передает параметры в строке запроса или в теле формы
+            params = parse_qs(query)
+            params.update(parse_qs(body.decode()))
+            if params.get("text") == [ANSWER]:
+                with _StubHandler.replies_lock:
+                    _StubHandler.replies += 1
+            self._send({"ok": True, "result": {
+                "message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": ANSWER,
+            }})
+        else:
+            self._send({"ok": True, "result": True})
+
+    def _send(self, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _updates(count, first_user=1000):
+    from telebot import types
+    return [types.Update.de_json({
+        "update_id": user_id,
+        "message": {
+            "message_id": user_id, "date": 0, "text": f"Вопрос номер {user_id}: что нового?",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+        },
+    }) for user_id in range(first_user, first_user + count)]
+
+
+def _wait_for_replies(count, timeout):
+    deadline = time.monotonic() + timeout
+    while _StubHandler.replies < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def run(mode, count, latency):
+    """
+    Send ``count`` text messages from different users at once and time the replies.
+
+    Returns:
+        dict: mode, users, seconds until every user got a reply, replies per second
+    """
+    _StubHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    # Настройки читаются при импорте модулей бота
+    os.environ.update({
+        "TELEGRAM_TOKEN": "1:bench",
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "FALLBACK_MODEL": "",
+        "STREAM_RESPONSES": "0",
+        "RESPONSE_CACHE_ENABLED": "0",
+        "MAX_CONCURRENT_UPDATES": str(max(count, 1)),
+    })
+    sys.path.insert(0, ROOT)
+    from telebot import apihelper, asyncio_helper
+    apihelper.API_URL = f"{base_url}/bot{{0}}/{{1}}"
+    asyncio_helper.API_URL = f"{base_url}/bot{{0}}/{{1}}"
+    import bot
+
+    warmup, updates = _updates(1, first_user=1), _updates(count)
+    if mode == "threaded":
+        bot.scheduler.start_workers()
+        # Прогрев: первый запрос импортирует SDK OpenAI и открывает соединения
+        bot.bot.process_new_updates(warmup)
+        _wait_for_replies(1, timeout=30)
+        _StubHandler.replies = 0
+
+        started = time.monotonic()
+        bot.bot.process_new_updates(updates)
+        _wait_for_replies(count, timeout=count * latency + 30)
+        elapsed = time.monotonic() - started
+    else:
+        import async_bot
+
+        async def feed(batch):
+            await async_bot.bot.process_new_updates(batch)
+            deadline = time.monotonic() + len(batch) * latency + 30
+            while _StubHandler.replies < len(batch) and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+
+        async def process():
+            # Клиенты aiohttp и AsyncOpenAI привязаны к циклу событий, поэтому прогрев в том же цикле
+            await feed(warmup)
+            _StubHandler.replies = 0
+            started = time.monotonic()
+            await feed(updates)
+            return time.monotonic() - started
+
+        elapsed = asyncio.run(process())
+
+    server.shutdown()
+    return {
+        "mode": mode,
+        "users": count,
+        "replied": _StubHandler.replies,
+        "seconds": round(elapsed, 3),
+        "replies_per_second": round(_StubHandler.replies / elapsed, 1),
+    }
+
+
+if __name__ == "__main__":
+    mode = sys.argv[1] if len(sys.argv) > 1 else "async"
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+    print(json.dumps(run(mode, count, latency)))
+    # Фоновые потоки бота (планировщик, сброс настроек) не должны задерживать выход
+    os._exit(0)
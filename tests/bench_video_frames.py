@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Сравнение извлечения кадров: прежний подход (отдельный процесс ffmpeg на каждый
+# кадр) против одного процесса video_frames.extract_frames. Нужны ffmpeg и ffprobe.
+#
+#   python tests/bench_video_frames.py sample1.mp4 sample2.mp4 ...
+
+import os
+import sys
+import time
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import video_frames
+
+
+def _legacy_extract(video_path, num_frames, duration):
+    """The previous approach: one ffmpeg process per frame (kept for the benchmark)."""
+    frames = []
+    positions = [duration * i / (num_frames - 1) for i in range(num_frames)] if num_frames > 1 else [duration / 2]
+    for position in positions:
+        cmd = [
+            "ffmpeg", "-v", "error", "-ss", str(position), "-i", video_path,
+            "-frames:v", "1", "-q:v", "2", "-f", "image2pipe", "-vcodec", "mjpeg", "pipe:1",
+        ]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.stdout:
+            frames.append(result.stdout)
+    return frames
+
+def _measure(func, *args):
+    usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    frames = func(*args)
+    wall = time.perf_counter() - start
+    usage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    return wall, cpu, frames
+
+def run_benchmark(video_paths, num_frames=5):
+    """
+    Compare wall time and CPU of the per-frame and single-pass extraction.
+
+    Args:
+        video_paths (list): Local sample videos
+        num_frames (int): Frames to sample per video
+
+    Returns:
+        list: One dict per video with wall/cpu seconds, frame counts and bytes for both approaches
+    """
+    results = []
+    for video_path in video_paths:
+        duration = video_frames.probe_duration(video_path)
+        legacy_wall, legacy_cpu, legacy_frames = _measure(_legacy_extract, video_path, num_frames, duration)
+        wall, cpu, frames = _measure(video_frames.extract_frames, video_path, num_frames, duration)
+        results.append({
+            "video": os.path.basename(video_path),
+            "duration": duration,
+            "legacy_wall": legacy_wall,
+            "legacy_cpu": legacy_cpu,
+            "legacy_frames": len(legacy_frames),
+            "legacy_bytes": sum(len(frame) for frame in legacy_frames),
+            "wall": wall,
+            "cpu": cpu,
+            "frames": len(frames),
+            "bytes": sum(len(frame) for frame in frames),
+        })
+    return results
+
+if __name__ == "__main__":
+    for row in run_benchmark(sys.argv[1:]):
+        print(
+            f"{row['video']} ({row['duration']:.0f} s): "
+            f"per-frame {row['legacy_wall']:.2f} s wall / {row['legacy_cpu']:.2f} s CPU, "
+            f"{row['legacy_frames']} frames, {row['legacy_bytes'] // 1024} KB; "
+            f"single pass {row['wall']:.2f} s wall / {row['cpu']:.2f} s CPU, "
+            f"{row['frames']} frames, {row['bytes'] // 1024} KB"
+        )
@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import textwrap
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Модули бота читают настройки при импорте
+os.environ.setdefault("TELEGRAM_TOKEN", "1:test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+
+class FakeOpenAI:
+    """
+    Local OpenAI-compatible server for chat completions.
+
+    ``behavior[model]`` decides the answer for a model: ``"ok"`` (default) or an
+    HTTP status code to fail with. ``calls[model]`` counts the requests.
+    """
+
+    def __init__(self):
+        self.behavior = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                model = body.get("model")
+                with fake._lock:
+                    fake.calls[model] = fake.calls.get(model, 0) + 1
+                behavior = fake.behavior.get(model, "ok")
+                if behavior != "ok":
+                    self._send(behavior, {"error": {"message": f"{model} failed", "type": "server_error"}})
+                elif body.get("stream"):
+                    self._stream(model)
+                else:
+                    self._send(200, {
+                        "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": model,
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": f"ok from {model}"}}],
+                        "usage": {"prompt_tokens": 5, "completion_tokens": 3, "total_tokens": 8},
+                    })
+
+            def _send(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, model):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for piece in ("ok ", "from ", model):
+                    chunk = {
+                        "id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0, "model": model,
+                        "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def fake_openai():
+    server = FakeOpenAI()
+    yield server
+    server.close()
+
+
+# Начало каждого скрипта run_script: репозиторий в sys.path и emit() для результата
+_SCRIPT_PROLOGUE = f"""
+import sys, os, json
+sys.path.insert(0, {ROOT!r})
+
+def emit(result):
+    print(json.dumps(result))
+    sys.stdout.flush()
+    # Фоновые потоки бота (планировщик, сброс настроек) не должны задерживать выход
+    os._exit(0)
+"""
+
+
+@pytest.fixture
+def run_script(tmp_path):
+    """
+    Run a Python snippet in a fresh interpreter with tmp_path as the working directory.
+
+    The bot modules create user_data, logs and temp_media in the current directory
+    and read their settings at import time, so such tests run out of process. The
+    snippet reports its result with ``emit(value)``; the value comes back decoded
+    from JSON. Keyword arguments are added to the environment. With ``raw=True``
+    the finished process is returned instead, whatever its exit code.
+    """
+    def run(script, raw=False, **env):
+        environ = dict(os.environ, TELEGRAM_TOKEN="1:test", OPENAI_API_KEY="test")
+        for name, value in env.items():
+            if value is None:
+                environ.pop(name, None)
+            else:
+                environ[name] = str(value)
+        result = subprocess.run(
+            [sys.executable, "-c", _SCRIPT_PROLOGUE + textwrap.dedent(script)],
+            cwd=tmp_path, env=environ, capture_output=True, text=True, timeout=60,
+        )
+        if raw:
+            return result
+        assert result.returncode == 0, result.stderr[-2000:]
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    return run
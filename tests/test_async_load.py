@@ -0,0 +1,29 @@
+import os
+import sys
+import json
+import subprocess
+
+BENCHMARK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_async_load.py")
+
+
+def run_benchmark(mode, users, latency, cwd):
+    result = subprocess.run(
+        [sys.executable, BENCHMARK, mode, str(users), str(latency)],
+        cwd=cwd, capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_async_mode_serves_more_users_per_second(tmp_path):
+    users, latency = 40, 0.5
+
+    threaded = run_benchmark("threaded", users, latency, tmp_path)
+    async_ = run_benchmark("async", users, latency, tmp_path)
+    print(threaded, async_)
+
+    assert threaded["replied"] == async_["replied"] == users
+    # Пять потоков обслуживают 40 пользователей не быстрее чем за 40 * 0.5 / 5 секунд,
+    # а в async-режиме все запросы к модели ждут одновременно
+    assert threaded["seconds"] >= users * latency / 5
+    assert async_["replies_per_second"] >= 2 * threaded["replies_per_second"]
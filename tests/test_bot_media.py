@@ -0,0 +1,71 @@
+import pytest
+
+from bot_messages import VIDEO_ERROR_TEXT
+
+# Обработчик видео с заглушками вместо Telegram, ffmpeg и OpenAI
+HANDLE_VIDEO = """
+from types import SimpleNamespace
+import bot
+import openai_helper
+
+scenario = os.environ["SCENARIO"]
+
+def download(token, file_info, destination=None, **kwargs):
+    if destination is None:
+        return b"thumbnail"
+    with open(destination, "wb") as f:
+        f.write(b"video")
+    return destination
+
+def extract_video_frames(video_path, num_frames, duration=None):
+    if scenario == "ffmpeg_fails":
+        raise RuntimeError("ffmpeg failed")
+    return [b"frame"] * num_frames
+
+def fail(*args, **kwargs):
+    raise RuntimeError("failed")
+
+sent, cached = [], []
+bot.bot.send_chat_action = lambda *args, **kwargs: None
+bot.bot.send_message = lambda chat_id, text, **kwargs: sent.append(text)
+bot.bot.get_file = lambda file_id: SimpleNamespace(file_id=file_id, file_path="videos/file.mp4", file_size=5)
+bot.media_download.download = download
+bot.media_cache.get = lambda key: None
+bot.media_cache.put = lambda key, value: cached.append(value)
+openai_helper.extract_video_frames = extract_video_frames
+openai_helper._request_frames_analysis = lambda frames, prompt=None: "frames answer"
+openai_helper.analyze_multiple_frames = lambda frames, prompt=None: "preview answer"
+openai_helper.analyze_single_frame = lambda frame, prompt=None: "preview answer"
+if scenario == "reply_fails":
+    bot.add_to_conversation = fail
+
+message = SimpleNamespace(
+    from_user=SimpleNamespace(id=1), chat=SimpleNamespace(id=1), caption=None,
+    video=SimpleNamespace(
+        file_id="video", file_unique_id="unique", file_size=5, duration=3,
+        thumbnail=SimpleNamespace(file_id="thumbnail"),
+    ),
+)
+bot.handle_video.__wrapped__(message)
+emit({"temp_files": os.listdir(bot.TEMP_DIR), "sent": sent, "cached": cached})
+"""
+
+
+def test_video_temp_file_is_removed_when_reply_fails(run_script):
+    outcome = run_script(HANDLE_VIDEO, SCENARIO="reply_fails")
+
+    assert outcome["temp_files"] == []
+    assert outcome["sent"] == [VIDEO_ERROR_TEXT]
+
+
+@pytest.mark.parametrize("scenario, answer, cached", [
+    ("frames", "frames answer", ["frames answer"]),
+    # ffmpeg не справился: ответ по превью отправляется, но не кэшируется как анализ всего видео
+    ("ffmpeg_fails", "preview answer", []),
+])
+def test_video_analysis_is_cached_only_when_frames_were_extracted(run_script, scenario, answer, cached):
+    outcome = run_script(HANDLE_VIDEO, SCENARIO=scenario)
+
+    assert outcome["sent"] == [answer]
+    assert outcome["cached"] == cached
+    assert outcome["temp_files"] == []
@@ -0,0 +1,125 @@
+import sys
+import time
+import types
+
+import pytest
+
+import conversation_handler
+
+
+@pytest.fixture
+def summarizer(monkeypatch):
+    """Replace openai_helper.summarize_conversation with a stub that records calls."""
+    calls = []
+    stub = types.SimpleNamespace(result=None)
+
+    def summarize_conversation(old_turns, previous_summary=None):
+        calls.append(len(old_turns))
+        return stub.result
+
+    stub.calls = calls
+    monkeypatch.setitem(sys.modules, "openai_helper", types.SimpleNamespace(summarize_conversation=summarize_conversation))
+    monkeypatch.setattr(conversation_handler, "_summary_failed_at", {})
+    monkeypatch.setattr(conversation_handler, "SUMMARY_THRESHOLD", 4)
+    monkeypatch.setattr(conversation_handler, "SUMMARY_KEEP_RECENT", 2)
+    return stub
+
+
+def wait_for_summary_worker(user_id, timeout=2):
+    deadline = time.monotonic() + timeout
+    while user_id in conversation_handler._summary_pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def talk(user_id, count):
+    for i in range(count):
+        conversation_handler.add_to_conversation(user_id, "user", f"сообщение {i}")
+        wait_for_summary_worker(user_id)
+
+
+def test_failed_summary_is_not_retried_during_cooldown(summarizer, monkeypatch):
+    monkeypatch.setattr(conversation_handler, "SUMMARY_RETRY_COOLDOWN", 60)
+    user_id = "cooldown-user"
+    conversation_handler.clear_conversation(user_id)
+
+    talk(user_id, 10)
+
+    # Порог превышен на пятом сообщении; после неудачи следующие пять не запускают новый запрос
+    assert summarizer.calls == [3]
+    assert len(conversation_handler.get_conversation_history(user_id)) == 10
+
+
+def test_summary_is_retried_after_cooldown(summarizer, monkeypatch):
+    monkeypatch.setattr(conversation_handler, "SUMMARY_RETRY_COOLDOWN", 0.2)
+    user_id = "retry-user"
+    conversation_handler.clear_conversation(user_id)
+
+    talk(user_id, 5)
+    assert len(summarizer.calls) == 1
+
+    time.sleep(0.3)
+    summarizer.result = "Краткое содержание"
+    talk(user_id, 1)
+
+    assert len(summarizer.calls) == 2
+    assert conversation_handler.get_conversation_summary(user_id)["content"] == "Краткое содержание"
+    assert len(conversation_handler.get_conversation_history(user_id)) == 2
+    assert user_id not in conversation_handler._summary_failed_at
+
+
+def messages(*token_counts):
+    """Messages with precomputed token counts, oldest first."""
+    return [{"role": "user", "content": f"сообщение {i}", "tokens": tokens} for i, tokens in enumerate(token_counts)]
+
+
+def contents(window):
+    return [message["content"] for message in window]
+
+
+def test_context_window_drops_oldest_messages_first():
+    history = messages(40, 30, 20, 10)
+
+    window = conversation_handler.get_context_window(history, token_budget=55)
+
+    # Самые новые сообщения, в хронологическом порядке
+    assert contents(window) == ["сообщение 2", "сообщение 3"]
+    assert contents(conversation_handler.get_context_window(history, token_budget=100)) == contents(history)
+
+
+def test_context_window_does_not_skip_over_a_message_that_does_not_fit():
+    history = messages(5, 50, 10)
+
+    window = conversation_handler.get_context_window(history, token_budget=20)
+
+    # Маленькое старое сообщение поместилось бы, но без пропущенного середина разговора потерялась бы
+    assert contents(window) == ["сообщение 2"]
+
+
+def test_context_window_always_keeps_latest_message():
+    history = messages(10, 500)
+
+    assert contents(conversation_handler.get_context_window(history, token_budget=100)) == ["сообщение 1"]
+    assert contents(conversation_handler.get_context_window(history, reserved_tokens=200, token_budget=100)) == ["сообщение 1"]
+    assert conversation_handler.get_context_window([], token_budget=100) == []
+
+
+def test_context_window_subtracts_reserved_tokens():
+    history = messages(30, 30, 30)
+
+    assert len(conversation_handler.get_context_window(history, token_budget=90)) == 3
+    assert len(conversation_handler.get_context_window(history, reserved_tokens=30, token_budget=90)) == 2
+
+
+def test_clear_conversation_resets_summary_cooldown(summarizer, monkeypatch):
+    monkeypatch.setattr(conversation_handler, "SUMMARY_RETRY_COOLDOWN", 60)
+    user_id = "cleared-user"
+    conversation_handler.clear_conversation(user_id)
+    talk(user_id, 5)
+    assert user_id in conversation_handler._summary_failed_at
+
+    conversation_handler.clear_conversation(user_id)
+
+    # После /clear длинный новый разговор сжимается сразу, без ожидания паузы
+    assert user_id not in conversation_handler._summary_failed_at
+    talk(user_id, 5)
+    assert len(summarizer.calls) == 2
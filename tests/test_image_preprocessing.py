@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+
+import pytest
+
+import image_preprocessing
+
+
+def segment(marker, payload):
+    """A JPEG marker segment: 0xFF, marker, 2-byte length (including itself), payload."""
+    return bytes([0xFF, marker]) + (len(payload) + 2).to_bytes(2, "big") + payload
+
+
+def jpeg_header(width, height, sof=0xC0, before_sof=b""):
+    """JPEG start with an APP0 segment and a SOF segment declaring width x height."""
+    frame = b"\x08" + height.to_bytes(2, "big") + width.to_bytes(2, "big") + b"\x03\x01\x22\x00\x02\x11\x01\x03\x11\x01"
+    return b"\xff\xd8" + segment(0xE0, b"JFIF\x00\x01\x01") + before_sof + segment(sof, frame) + b"\xff\xda"
+
+
+@pytest.mark.parametrize("sof", [0xC0, 0xC2])
+def test_jpeg_size_reads_baseline_and_progressive_headers(sof):
+    assert image_preprocessing.jpeg_size(jpeg_header(1280, 960, sof)) == (1280, 960)
+
+
+def test_jpeg_size_skips_segments_and_fill_bytes():
+    # Таблица квантования и заполняющие 0xFF перед SOF
+    data = jpeg_header(4000, 3000, before_sof=segment(0xDB, bytes(65)) + b"\xff\xff")
+
+    assert image_preprocessing.jpeg_size(memoryview(data)) == (4000, 3000)
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"\x89PNG\r\n\x1a\n" + bytes(32),
+    jpeg_header(1280, 960)[:-8],  # обрезан после размеров, но посреди SOF
+    jpeg_header(1280, 960)[:-16],  # обрезан до размеров
+    jpeg_header(1280, 960)[:10],  # обрезан посреди APP0
+    b"\xff\xd8" + b"\x00" * 16,  # нет маркера там, где он должен быть
+])
+def test_jpeg_size_returns_none_for_unreadable_headers(data):
+    assert image_preprocessing.jpeg_size(data) is None
+
+
+@pytest.mark.parametrize("detail, size, expected", [
+    # high: длинная сторона не больше 2048, короткая не больше 768
+    ("high", (4000, 3000), (1024, 768)),
+    ("high", (3000, 1000), (2048, 683)),
+    ("high", (2048, 768), (2048, 768)),
+    ("high", (768, 768), (768, 768)),
+    ("high", (769, 769), (768, 768)),
+    ("auto", (4000, 3000), (1024, 768)),
+    # low: длинная сторона не больше 512
+    ("low", (1024, 512), (512, 256)),
+    ("low", (512, 512), (512, 512)),
+    ("low", (513, 100), (512, 100)),
+    # Маленькие изображения не увеличиваются
+    ("high", (320, 240), (320, 240)),
+    ("low", (90, 67), (90, 67)),
+])
+def test_target_size_boundaries(detail, size, expected):
+    assert image_preprocessing.target_size(*size, detail) == expected
+
+
+TELEGRAM_SIZES = [SimpleNamespace(width=w, height=h) for w, h in [(90, 67), (320, 240), (512, 384), (800, 600), (1280, 960)]]
+
+
+@pytest.mark.parametrize("detail, expected", [
+    # Нужно 1024x768: меньшие размеры потеряли бы детали
+    ("high", (1280, 960)),
+    # Нужно ровно 512x384: подходит размер, совпадающий с ним
+    ("low", (512, 384)),
+])
+def test_choose_photo_size_picks_smallest_size_that_covers_target(detail, expected):
+    chosen = image_preprocessing.choose_photo_size(TELEGRAM_SIZES, detail)
+
+    assert (chosen.width, chosen.height) == expected
+
+
+def test_choose_photo_size_falls_back_to_largest():
+    sizes = [SimpleNamespace(width=100, height=50), SimpleNamespace(width=200, height=90)]
+
+    assert image_preprocessing.choose_photo_size(sizes, "high") is sizes[-1]
+
+
+def test_prepare_image_resizes_only_large_images(monkeypatch):
+    calls = []
+
+    def resize(data, width, height):
+        calls.append((width, height))
+        return b"small"
+
+    monkeypatch.setattr(image_preprocessing, "_resize", resize)
+    small = jpeg_header(500, 300)
+    large = jpeg_header(2001, 1001) + bytes(1000)
+
+    assert image_preprocessing.prepare_image(small, "high") is small
+    assert image_preprocessing.prepare_image(large, "high") == b"small"
+    # 1535x768 округляется до четной ширины: mjpeg требует четные размеры
+    assert calls == [(1534, 768)]
+
+
+def test_prepare_image_keeps_original_when_resize_fails(monkeypatch):
+    def resize(data, width, height):
+        raise image_preprocessing.media_worker.MediaBusyError("Media queue is full")
+
+    monkeypatch.setattr(image_preprocessing, "_resize", resize)
+    large = jpeg_header(4000, 3000)
+
+    assert image_preprocessing.prepare_image(large, "low") is large
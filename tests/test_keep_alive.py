@@ -0,0 +1,64 @@
+import importlib
+
+import pytest
+
+import keep_alive
+import update_queue
+
+UPDATE = {"update_id": 1, "message": {"text": "привет"}}
+
+
+@pytest.fixture
+def load_server(monkeypatch):
+    """Re-import keep_alive with the given webhook settings and return a Flask test client."""
+    submitted = []
+    monkeypatch.setattr(update_queue, "submit", lambda update: submitted.append(update) or True)
+
+    def load(webhook_url=None, secret=None):
+        for name, value in (("WEBHOOK_URL", webhook_url), ("WEBHOOK_SECRET", secret)):
+            if value is None:
+                monkeypatch.delenv(name, raising=False)
+            else:
+                monkeypatch.setenv(name, value)
+        client = importlib.reload(keep_alive).app.test_client()
+        client.submitted = submitted
+        return client
+
+    yield load
+    monkeypatch.delenv("WEBHOOK_URL", raising=False)
+    monkeypatch.delenv("WEBHOOK_SECRET", raising=False)
+    importlib.reload(keep_alive)
+
+
+def test_webhook_route_is_absent_in_polling_mode(load_server):
+    client = load_server(secret="s3cret")
+
+    assert client.post("/webhook", json=UPDATE).status_code == 404
+    assert client.get("/health").status_code == 200
+    assert client.submitted == []
+
+
+def test_webhook_rejects_requests_without_the_secret(load_server):
+    client = load_server(webhook_url="https://example.com/webhook", secret="s3cret")
+
+    assert client.post("/webhook", json=UPDATE).status_code == 403
+    assert client.post("/webhook", json=UPDATE, headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}).status_code == 403
+    assert client.submitted == []
+
+    response = client.post("/webhook", json=UPDATE, headers={"X-Telegram-Bot-Api-Secret-Token": "s3cret"})
+    assert response.status_code == 200
+    assert client.submitted == [UPDATE]
+
+
+def test_webhook_without_secret_accepts_nothing(load_server):
+    client = load_server(webhook_url="https://example.com/webhook")
+
+    assert client.post("/webhook", json=UPDATE, headers={"X-Telegram-Bot-Api-Secret-Token": ""}).status_code == 403
+    assert client.submitted == []
+
+
+def test_bot_refuses_webhook_mode_without_secret(run_script):
+    result = run_script("import bot; bot.main()", raw=True, WEBHOOK_URL="https://example.com/webhook", WEBHOOK_SECRET=None)
+
+    assert result.returncode == 1
+    assert "WEBHOOK_SECRET is required" in result.stderr + result.stdout
@@ -0,0 +1,170 @@
+import time
+import asyncio
+
+import pytest
+
+import llm_providers
+import rate_limiter
+import resilience
+
+MESSAGES = [{"role": "user", "content": "привет"}]
+
+
+@pytest.fixture
+def providers(fake_openai, monkeypatch):
+    """Primary and fallback providers on the fake server, with fresh breakers and no rate limits."""
+    primary = llm_providers.Provider("primary", "primary-model", "test", fake_openai.base_url)
+    fallback = llm_providers.Provider("fallback", "fallback-model", "test", fake_openai.base_url)
+    monkeypatch.setattr(llm_providers, "providers", [primary, fallback])
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(resilience, "RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    monkeypatch.setattr(rate_limiter, "_model_limits", {})
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_RPM", 0)
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_TPM", 0)
+    return primary, fallback
+
+
+def test_primary_answers_when_healthy(fake_openai, providers):
+    response = llm_providers.chat_completion(MESSAGES, 10)
+
+    assert response.choices[0].message.content == "ok from primary-model"
+    assert "fallback-model" not in fake_openai.calls
+
+
+def test_failover_to_fallback_on_server_errors(fake_openai, providers):
+    primary, fallback = providers
+    fake_openai.behavior["primary-model"] = 500
+
+    response = llm_providers.chat_completion(MESSAGES, 10)
+
+    assert response.choices[0].message.content == "ok from fallback-model"
+    assert fake_openai.calls["primary-model"] == resilience.RETRY_ATTEMPTS
+    assert primary.stats()["failures"] == 1
+    assert fallback.stats()["failures"] == 0
+
+
+def test_unhealthy_provider_is_skipped(fake_openai, providers):
+    primary, _ = providers
+    fake_openai.behavior["primary-model"] = 500
+
+    for _ in range(llm_providers.PROVIDER_MIN_SAMPLES):
+        llm_providers.chat_completion(MESSAGES, 10)
+    assert not primary.is_healthy()
+
+    calls = fake_openai.calls["primary-model"]
+    response = llm_providers.chat_completion(MESSAGES, 10)
+    assert response.choices[0].message.content == "ok from fallback-model"
+    assert fake_openai.calls["primary-model"] == calls
+
+
+def test_half_open_breaker_recovers(fake_openai, providers, monkeypatch):
+    monkeypatch.setattr(resilience, "BREAKER_FAILURE_THRESHOLD", 1)
+    monkeypatch.setattr(resilience, "BREAKER_RESET_TIMEOUT", 0.2)
+    fake_openai.behavior["primary-model"] = 500
+
+    llm_providers.chat_completion(MESSAGES, 10)
+    breaker = resilience.get_breaker("primary/primary-model")
+    assert breaker.stats()["state"] == resilience.OPEN
+
+    # Пока предохранитель разомкнут, основной провайдер даже не вызывается
+    calls = fake_openai.calls["primary-model"]
+    assert llm_providers.chat_completion(MESSAGES, 10).choices[0].message.content == "ok from fallback-model"
+    assert fake_openai.calls["primary-model"] == calls
+
+    # После паузы пробный запрос проходит, и предохранитель замыкается
+    fake_openai.behavior["primary-model"] = "ok"
+    time.sleep(0.25)
+    assert llm_providers.chat_completion(MESSAGES, 10).choices[0].message.content == "ok from primary-model"
+    assert breaker.stats()["state"] == resilience.CLOSED
+
+
+def test_failed_half_open_trial_reopens_breaker(fake_openai, providers, monkeypatch):
+    monkeypatch.setattr(resilience, "BREAKER_FAILURE_THRESHOLD", 1)
+    monkeypatch.setattr(resilience, "BREAKER_RESET_TIMEOUT", 0.2)
+    fake_openai.behavior["primary-model"] = 500
+
+    llm_providers.chat_completion(MESSAGES, 10)
+    time.sleep(0.25)
+    llm_providers.chat_completion(MESSAGES, 10)
+
+    stats = resilience.get_breaker("primary/primary-model").stats()
+    assert stats["state"] == resilience.OPEN
+    assert stats["times_opened"] == 2
+
+
+def test_streaming_through_fallback(fake_openai, providers):
+    fake_openai.behavior["primary-model"] = 503
+
+    stream = llm_providers.chat_completion(MESSAGES, 10, stream=True)
+    text = "".join(chunk.choices[0].delta.content or "" for chunk in stream if chunk.choices)
+
+    assert text == "ok from fallback-model"
+
+
+def test_async_streaming_through_fallback(fake_openai, providers):
+    fake_openai.behavior["primary-model"] = 502
+
+    async def run():
+        stream = await llm_providers.chat_completion_async(MESSAGES, 10, stream=True)
+        return "".join([chunk.choices[0].delta.content or "" async for chunk in stream if chunk.choices])
+
+    assert asyncio.run(run()) == "ok from fallback-model"
+
+
+def test_all_providers_failing_raises_last_error(fake_openai, providers):
+    fake_openai.behavior["primary-model"] = 500
+    fake_openai.behavior["fallback-model"] = 500
+
+    with pytest.raises(Exception) as error:
+        llm_providers.chat_completion(MESSAGES, 10)
+    assert getattr(error.value, "status_code", None) == 500
+
+
+@pytest.mark.parametrize("status", [400, 401, 404, 422])
+def test_request_errors_do_not_fail_over_or_mark_primary_unhealthy(fake_openai, providers, status):
+    primary, _ = providers
+    fake_openai.behavior["primary-model"] = status
+
+    for _ in range(llm_providers.PROVIDER_MIN_SAMPLES + 1):
+        with pytest.raises(Exception) as error:
+            llm_providers.chat_completion(MESSAGES, 10)
+        assert error.value.status_code == status
+
+    # Ошибка в самом запросе не повторяется, не уходит к запасной модели и не портит здоровье основной
+    assert fake_openai.calls["primary-model"] == llm_providers.PROVIDER_MIN_SAMPLES + 1
+    assert "fallback-model" not in fake_openai.calls
+    assert primary.is_healthy()
+    assert primary.stats()["failures"] == 0
+
+
+def test_request_error_async_is_raised_without_failover(fake_openai, providers):
+    primary, _ = providers
+    fake_openai.behavior["primary-model"] = 400
+
+    with pytest.raises(Exception) as error:
+        asyncio.run(llm_providers.chat_completion_async(MESSAGES, 10))
+    assert error.value.status_code == 400
+    assert "fallback-model" not in fake_openai.calls
+    assert primary.stats()["failures"] == 0
+
+
+def test_local_rate_limit_wait_does_not_mark_providers_unhealthy(fake_openai, providers, monkeypatch):
+    primary, fallback = providers
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_RPM", 1)
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_MAX_WAIT", 0.1)
+
+    # Первый запрос к каждой модели забирает лимит, дальше запросы ждут в локальной очереди
+    assert llm_providers.chat_completion(MESSAGES, 10).choices[0].message.content == "ok from primary-model"
+    for _ in range(llm_providers.PROVIDER_MIN_SAMPLES * 2):
+        try:
+            llm_providers.chat_completion(MESSAGES, 10)
+        except rate_limiter.RateLimitTimeout:
+            pass
+
+    assert fake_openai.calls == {"primary-model": 1, "fallback-model": 1}
+    for provider in (primary, fallback):
+        assert provider.is_healthy()
+        assert provider.stats()["failures"] == 0
+        breaker = resilience.get_breaker(f"{provider.name}/{provider.model}")
+        assert breaker.stats()["consecutive_failures"] == 0
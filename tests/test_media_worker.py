@@ -0,0 +1,87 @@
+import sys
+import time
+import asyncio
+import threading
+
+import pytest
+
+import media_worker
+
+SLEEP = [sys.executable, "-c", "import time; time.sleep(30)"]
+
+
+@pytest.fixture
+def fresh_pool(monkeypatch):
+    """Empty media pool with one slot and fast cancellation checks."""
+    monkeypatch.setattr(media_worker, "MEDIA_WORKERS", 1)
+    monkeypatch.setattr(media_worker, "MEDIA_CANCEL_POLL", 0.05)
+    monkeypatch.setattr(media_worker, "_stats", dict.fromkeys(media_worker._stats, 0))
+
+
+def cancel_later(event, delay=0.2):
+    threading.Timer(delay, event.set).start()
+
+
+def test_cancel_event_kills_running_process(fresh_pool):
+    cancel_event = threading.Event()
+    cancel_later(cancel_event)
+
+    started = time.monotonic()
+    with pytest.raises(media_worker.MediaCancelledError):
+        media_worker.run(SLEEP, cancel_event=cancel_event)
+
+    assert time.monotonic() - started < 5
+    stats = media_worker.get_media_worker_stats()
+    assert stats["cancelled"] == 1
+    assert stats["running"] == 0
+    assert not media_worker._running
+
+
+def test_cancel_event_removes_queued_job(fresh_pool):
+    blocker_cancel = threading.Event()
+    # Первая задача занимает единственный слот, вторая ждет в очереди и отменяется там
+    blocker = threading.Thread(target=lambda: _run_quietly(SLEEP, blocker_cancel))
+    blocker.start()
+    try:
+        while not media_worker._running:
+            time.sleep(0.01)
+        queued_cancel = threading.Event()
+        cancel_later(queued_cancel)
+        with pytest.raises(media_worker.MediaCancelledError):
+            media_worker.run([sys.executable, "-c", "pass"], cancel_event=queued_cancel)
+        assert media_worker.get_media_worker_stats()["queued"] == 0
+    finally:
+        blocker_cancel.set()
+        blocker.join(timeout=5)
+    assert media_worker.get_media_worker_stats()["cancelled"] == 2
+
+
+def _run_quietly(cmd, cancel_event):
+    try:
+        media_worker.run(cmd, cancel_event=cancel_event)
+    except media_worker.MediaCancelledError:
+        pass
+
+
+def test_cancelled_task_kills_its_media_job(fresh_pool):
+    finished = threading.Event()
+
+    def job():
+        try:
+            media_worker.run(SLEEP)
+        finally:
+            finished.set()
+
+    async def handler():
+        task = asyncio.create_task(media_worker.to_thread(job))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(handler())
+
+    # Отмена обработчика доходит до потока: ffmpeg убит, слот свободен
+    assert finished.wait(5)
+    assert media_worker.get_media_worker_stats()["cancelled"] == 1
+    assert media_worker.get_media_worker_stats()["running"] == 0
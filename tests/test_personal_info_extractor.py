@@ -0,0 +1,49 @@
+import pytest
+
+from personal_info_extractor import extract_personal_info
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("Привет! Меня зовут Алексей, мне 27 лет.", {"name": "Алексей", "age": 27}),
+    ("меня зовут Ольга", {"name": "Ольга"}),
+    ("Мне 5 года", {"age": 5}),
+    # Имя с маленькой буквы и невозможный возраст не запоминаются
+    ("меня зовут никак, мне 300 лет", {}),
+])
+def test_name_and_age(message, expected):
+    assert extract_personal_info(message) == expected
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("Я люблю путешествовать по горам", {"likes": "путешествовать по горам"}),
+    ("Обожаю хорошие шутки!", {"likes": "хорошие шутки"}),
+    ("Ненавижу понедельники. Зовусь я Мария", {"dislikes": "понедельники"}),
+    ("Мне не нравится холодный кофе", {"dislikes": "холодный кофе"}),
+    ("Мое хобби - шахматы, а еще я играю в футбол", {"hobbies": "шахматы"}),
+    # После триггера ничего нет: запоминается предложение целиком
+    ("Футбол я очень люблю!", {"likes": "Футбол я очень люблю"}),
+])
+def test_likes_dislikes_and_hobbies_keep_the_clause(message, expected):
+    assert extract_personal_info(message) == expected
+
+
+def test_like_and_dislike_in_one_message_are_split():
+    facts = extract_personal_info("Не люблю, когда долго отвечают, но обожаю хорошие шутки")
+
+    # "не люблю" не считается заодно "люблю", и каждый список получает только свою фразу
+    assert facts == {"dislikes": "когда долго отвечают", "likes": "хорошие шутки"}
+
+
+def test_several_mentions_of_one_category_are_joined():
+    facts = extract_personal_info("Я увлекаюсь фотографией и занимаюсь бегом")
+
+    assert facts == {"hobbies": "фотографией; бегом"}
+
+
+@pytest.mark.parametrize("message", [
+    "Расскажи, пожалуйста, как работает нейросеть и что такое трансформер?",
+    "Какая завтра погода в Москве?",
+    "Сколько лет Москве?",
+])
+def test_messages_without_personal_info(message):
+    assert extract_personal_info(message) == {}
@@ -0,0 +1,46 @@
+import json
+
+from preferences_store import PreferencesStore
+
+
+def dumps(data):
+    return json.dumps(data, ensure_ascii=False)
+
+
+def test_saved_users_survive_reopening(tmp_path):
+    db_path = str(tmp_path / "prefs.db")
+    store = PreferencesStore(db_path)
+    store.save_users({"1": dumps({"personal_info": {"name": "Анна"}}), "2": dumps({"topics": {"шахматы": 3}})})
+    store.set_meta("json_imported", "1")
+
+    reopened = PreferencesStore(db_path)
+
+    assert reopened.load_user("1") == {"personal_info": {"name": "Анна"}}
+    assert reopened.load_user("2") == {"topics": {"шахматы": 3}}
+    assert reopened.load_user("3") is None
+    assert sorted(reopened.iter_user_ids()) == ["1", "2"]
+    assert reopened.get_meta("json_imported") == "1"
+
+
+def test_save_overwrites_only_given_users(tmp_path):
+    store = PreferencesStore(str(tmp_path / "prefs.db"))
+    store.save_users({"1": dumps({"v": 1}), "2": dumps({"v": 1})})
+
+    store.save_users({"1": dumps({"v": 2})})
+    store.save_users({})
+
+    assert store.load_user("1") == {"v": 2}
+    assert store.load_user("2") == {"v": 1}
+
+
+def test_legacy_json_is_imported_once(tmp_path):
+    json_path = tmp_path / "user_preferences.json"
+    json_path.write_text(dumps({"42": {"personal_info": {"age": 30}}}), encoding="utf-8")
+    store = PreferencesStore(str(tmp_path / "prefs.db"))
+
+    assert store.import_json(str(json_path)) == 1
+    store.save_users({"42": dumps({"personal_info": {"age": 31}})})
+    # Повторный запуск не затирает более новые данные из базы
+    assert store.import_json(str(json_path)) == 0
+    assert store.load_user("42") == {"personal_info": {"age": 31}}
+    assert store.import_json(str(tmp_path / "missing.json")) == 0
@@ -0,0 +1,82 @@
+# prompt_builder импортирует user_preferences, который открывает базу в ./user_data,
+# поэтому сборка промптов проверяется в отдельном процессе
+BUILD_PROMPTS = """
+import prompt_builder
+import knowledge_base
+from token_counter import count_tokens
+
+searches = []
+search = prompt_builder.search_knowledge_base
+prompt_builder.search_knowledge_base = lambda query: searches.append(query) or search(query)
+
+query = "Расскажи про базу на Луне и полеты к Марсу"
+# Как при обработке текста: отпечаток для кэша ответов (поиск и сохранение), затем сам промпт
+prompt_builder.get_context_fingerprint(None, query)
+prompt_builder.get_context_fingerprint(None, query)
+retrieval_prompt = prompt_builder.build_system_prompt(None, query)
+
+prompt_builder.KB_RETRIEVAL = False
+full_prompt = prompt_builder.build_system_prompt(None, query)
+
+fragment = search(query)
+emit({
+    "searches": searches,
+    "fragment_tokens": count_tokens(fragment),
+    "full_kb_tokens": count_tokens(knowledge_base.COOKIE_AI_KNOWLEDGE),
+    "retrieval_prompt_tokens": count_tokens(retrieval_prompt),
+    "full_prompt_tokens": count_tokens(full_prompt),
+    "fragment_in_prompt": fragment in retrieval_prompt,
+    "relevant": "Луне" in fragment and "Марсу" in fragment,
+})
+"""
+
+
+def test_retrieval_prompt_is_much_smaller_than_full_knowledge_base(run_script):
+    result = run_script(BUILD_PROMPTS)
+    print(result)
+
+    assert result["relevant"] and result["fragment_in_prompt"]
+    # Подставляются закрепленный раздел и несколько найденных записей, а не вся база
+    assert result["fragment_tokens"] * 5 <= result["full_kb_tokens"]
+    assert result["full_prompt_tokens"] - result["retrieval_prompt_tokens"] >= result["full_kb_tokens"] // 2
+
+
+def test_knowledge_base_is_searched_once_per_query(run_script):
+    result = run_script(BUILD_PROMPTS)
+
+    # Два отпечатка для кэша ответов и сам промпт — один поиск BM25
+    assert len(result["searches"]) == 1
+
+
+BOUNDED_CACHES = """
+import prompt_builder
+import user_preferences
+
+user_preferences.update_user_preferences(1, "Меня зовут Анна, я люблю шахматы")
+first_version = user_preferences.get_preferences_version(1)
+first_prompt = prompt_builder.build_system_prompt(1, "шахматы")
+for user_id in range(2, 6):
+    user_preferences.update_user_preferences(user_id, f"Меня зовут Гость{user_id}")
+    prompt_builder.build_system_prompt(user_id, "привет")
+
+sizes = [len(user_preferences._prompt_versions), len(user_preferences._top_topics), len(prompt_builder._user_block_cache)]
+# Вытесненный пользователь получает новую версию, а промпт собирается заново из сохраненных данных
+version_after_eviction = user_preferences.get_preferences_version(1)
+prompt_after_eviction = prompt_builder.build_system_prompt(1, "шахматы")
+emit({
+    "sizes": sizes,
+    "new_version": version_after_eviction != first_version,
+    "same_prompt": prompt_after_eviction == first_prompt,
+    "has_name": "Анна" in prompt_after_eviction,
+    "stats": prompt_builder.get_prompt_cache_stats(),
+})
+"""
+
+
+def test_per_user_caches_are_bounded(run_script):
+    result = run_script(BOUNDED_CACHES, PROMPT_CACHE_USERS=2)
+
+    assert result["sizes"] == [2, 2, 2]
+    assert result["new_version"]
+    assert result["same_prompt"] and result["has_name"]
+    assert "bytes_reused_per_request" in result["stats"]
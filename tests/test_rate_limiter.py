@@ -0,0 +1,98 @@
+import time
+import asyncio
+import threading
+from collections import Counter
+
+import pytest
+
+import rate_limiter
+
+
+def drained_limiter(rpm, tpm=0):
+    """A limiter whose burst capacity is already used up, so grants follow the refill rate."""
+    limiter = rate_limiter.ModelRateLimiter("test-model", rpm, tpm)
+    if limiter._requests is not None:
+        limiter._requests.level = 0
+    if limiter._tokens is not None:
+        limiter._tokens.level = 0
+    return limiter
+
+
+def test_simulated_load_is_smoothed_and_fair(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_MAX_WAIT", 10)
+    limiter = drained_limiter(rpm=1200)  # 20 запросов в секунду
+    users, per_user = 4, 10
+    grants = []
+    grants_lock = threading.Lock()
+
+    def user(user_id):
+        for _ in range(per_user):
+            limiter.acquire(100, user_id)
+            with grants_lock:
+                grants.append((time.monotonic(), user_id))
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=user, args=(user_id,)) for user_id in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    # Весь всплеск из 40 запросов растянут по скорости пополнения (20/с), а не выпущен разом
+    per_second = Counter(int(granted - started) for granted, _ in grants)
+    print(f"40 requests in {elapsed:.2f}s, grants per second: {dict(sorted(per_second.items()))}")
+    assert len(grants) == users * per_user
+    assert elapsed >= 1.8
+    times = [granted for granted, _ in grants]
+    assert max(sum(1 for t in times if start <= t < start + 0.5) for start in times) <= 11
+
+    # Round-robin: в каждом круге каждый пользователь получает по одному запросу
+    first_round = [user_id for _, user_id in grants[:users * 2]]
+    assert Counter(first_round) == {user_id: 2 for user_id in range(users)}
+
+
+def test_cancelled_waiter_does_not_block_the_queue(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_MAX_WAIT", 2)
+    limiter = drained_limiter(rpm=600)  # 10 запросов в секунду
+
+    async def run():
+        first = asyncio.create_task(limiter.acquire_async(1, "a"))
+        await asyncio.sleep(0.02)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await limiter.acquire_async(1, "b")
+
+    assert asyncio.run(run()) < 0.5
+    assert limiter.stats()["waiting"] == 0
+    assert limiter.stats()["timeouts"] == 0
+
+
+def test_timed_out_waiter_leaves_the_queue(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_MAX_WAIT", 0.05)
+    limiter = drained_limiter(rpm=6)  # один запрос в 10 секунд
+
+    with pytest.raises(rate_limiter.RateLimitTimeout):
+        limiter.acquire(1, "a")
+
+    assert limiter.stats()["waiting"] == 0
+    assert limiter.stats()["timeouts"] == 1
+
+
+def test_default_limits_per_model():
+    defaults = rate_limiter._parse_limits(rate_limiter.DEFAULT_RATE_LIMITS)
+
+    assert defaults["gpt-4o"] == (5000, 450000)
+    assert defaults["gpt-4o-mini"] == (5000, 2000000)
+    assert rate_limiter._parse_limits("gpt-4o=500:30000") == {"gpt-4o": (500, 30000)}
+
+
+def test_estimate_counts_low_detail_images_cheaper():
+    image = {"type": "image_url", "image_url": {"url": "data:", "detail": "low"}}
+    high = {"type": "image_url", "image_url": {"url": "data:", "detail": "high"}}
+
+    low_total = rate_limiter.estimate_tokens([{"role": "user", "content": [image]}], 0)
+    high_total = rate_limiter.estimate_tokens([{"role": "user", "content": [high]}], 0)
+
+    assert high_total - low_total == rate_limiter.IMAGE_TOKEN_ESTIMATE - rate_limiter.LOW_DETAIL_IMAGE_TOKENS
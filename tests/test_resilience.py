@@ -0,0 +1,64 @@
+import time
+import asyncio
+
+import pytest
+
+import rate_limiter
+import resilience
+
+
+@pytest.fixture
+def half_open_breaker(monkeypatch):
+    """A breaker that has just moved from open to half-open."""
+    monkeypatch.setattr(resilience, "BREAKER_FAILURE_THRESHOLD", 1)
+    monkeypatch.setattr(resilience, "BREAKER_RESET_TIMEOUT", 0.05)
+    breaker = resilience.CircuitBreaker("test")
+    breaker.record_failure()
+    time.sleep(0.06)
+    return breaker
+
+
+def test_non_api_error_leaves_half_open_breaker_neutral(half_open_breaker):
+    def wait_in_queue():
+        raise rate_limiter.RateLimitTimeout("queue is too long")
+
+    with pytest.raises(rate_limiter.RateLimitTimeout):
+        resilience.call_with_retry(wait_in_queue, half_open_breaker)
+
+    # Ни один запрос к модели не прошел, значит предохранитель не замыкается,
+    # но следующий вызов снова может стать пробным
+    assert half_open_breaker.stats()["state"] == resilience.HALF_OPEN
+    assert resilience.call_with_retry(lambda: "ok", half_open_breaker) == "ok"
+    assert half_open_breaker.stats()["state"] == resilience.CLOSED
+
+
+def test_non_api_error_does_not_reset_failure_count(monkeypatch):
+    monkeypatch.setattr(resilience, "BREAKER_FAILURE_THRESHOLD", 2)
+    breaker = resilience.CircuitBreaker("test")
+    breaker.record_failure()
+
+    with pytest.raises(ValueError):
+        resilience.call_with_retry(lambda: (_ for _ in ()).throw(ValueError("bad request")), breaker)
+
+    assert breaker.stats()["consecutive_failures"] == 1
+
+
+def test_cancelled_half_open_trial_is_released(half_open_breaker):
+    async def run():
+        async def hang():
+            await asyncio.sleep(10)
+
+        task = asyncio.create_task(resilience.call_with_retry_async(hang, half_open_breaker))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+
+    assert half_open_breaker.allow()
+
+
+def test_only_one_half_open_trial_at_a_time(half_open_breaker):
+    assert half_open_breaker.allow()
+    assert not half_open_breaker.allow()
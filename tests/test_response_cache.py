@@ -0,0 +1,118 @@
+# response_cache импортирует prompt_builder и user_preferences, который открывает базу в ./user_data,
+# поэтому кэш проверяется в отдельном процессе
+CACHE_SCRIPT = """
+import response_cache
+
+def first_turn(text):
+    return [{"role": "user", "content": text}]
+
+class Clock:
+    now = 1000.0
+    @staticmethod
+    def time():
+        return Clock.now
+
+"""
+
+NUMBERS = CACHE_SCRIPT + """
+response_cache.store(first_turn("Сколько будет 2+2?"), None, "4")
+emit({
+    "other_number": response_cache.lookup(first_turn("Сколько будет 2+3?"), None),
+    "other_operator": response_cache.lookup(first_turn("Сколько будет 2-2?"), None),
+    "same": response_cache.lookup(first_turn("СКОЛЬКО будет 2+2!!"), None),
+    "stats": response_cache.get_response_cache_stats(),
+})
+"""
+
+PARAPHRASE = CACHE_SCRIPT + """
+response_cache.store(first_turn("Как тебя зовут?"), None, "Меня зовут Cookie")
+emit({
+    "normalized": response_cache.normalize_message("  Как   тебя ЗОВУТ?!! 🙂 Ёжик "),
+    "typo": response_cache.lookup(first_turn("как тебя завут"), None),
+    "different": response_cache.lookup(first_turn("Как тебя найти?"), None),
+    "stats": response_cache.get_response_cache_stats(),
+})
+"""
+
+FIRST_TURN_ONLY = CACHE_SCRIPT + """
+history = [
+    {"role": "user", "content": "Привет"},
+    {"role": "assistant", "content": "Привет!"},
+    {"role": "user", "content": "Как тебя зовут?"},
+]
+response_cache.store(history, None, "Меня зовут Cookie")
+stored = response_cache.get_response_cache_stats()["stored"]
+response_cache.store(first_turn("Как тебя зовут?"), None, "Меня зовут Cookie")
+emit({
+    "stored_with_history": stored,
+    "lookup_with_history": response_cache.lookup(history, None),
+    "lookup_first_turn": response_cache.lookup(first_turn("Как тебя зовут?"), None),
+    "assistant_last": response_cache.lookup(history[:2], None),
+})
+"""
+
+TTL = CACHE_SCRIPT + """
+response_cache.time = Clock
+cache = response_cache.LRUCache(10, ttl=60)
+cache.put("question", "answer")
+Clock.now += 59
+before = cache.get("question")
+Clock.now += 2
+emit({"before": before, "after": cache.get("question"), "contains": "question" in cache, "items": cache.items()})
+"""
+
+EVICTION = CACHE_SCRIPT + """
+cache = response_cache.LRUCache(3)
+for key in ("a", "b", "c"):
+    cache.put(key, key.upper())
+cache.get("a")  # "a" становится самым свежим
+cache.put("d", "D")
+cache.put("e", "E")
+emit({"keys": [key for key, _ in cache.items()], "evictions": cache.stats()["evictions"]})
+"""
+
+
+def test_different_numbers_and_operators_miss(run_script):
+    result = run_script(NUMBERS)
+
+    # Текст почти совпадает, но числа и операторы другие — это другой вопрос
+    assert result["other_number"] is None
+    assert result["other_operator"] is None
+    assert result["same"] == "4"
+    assert result["stats"]["hits"] == 1
+    assert result["stats"]["misses"] == 2
+
+
+def test_normalised_and_near_duplicate_questions_hit(run_script):
+    result = run_script(PARAPHRASE)
+
+    assert result["normalized"] == "как тебя зовут ежик"
+    assert result["typo"] == "Меня зовут Cookie"
+    assert result["different"] is None
+    assert result["stats"]["near_hits"] == 1
+
+
+def test_only_first_turn_is_cached(run_script):
+    result = run_script(FIRST_TURN_ONLY)
+
+    assert result["stored_with_history"] == 0
+    assert result["lookup_with_history"] is None
+    assert result["assistant_last"] is None
+    assert result["lookup_first_turn"] == "Меня зовут Cookie"
+
+
+def test_entries_expire_after_ttl(run_script):
+    result = run_script(TTL)
+
+    assert result["before"] == "answer"
+    assert result["after"] is None
+    assert not result["contains"]
+    assert result["items"] == []
+
+
+def test_least_recently_used_entries_are_evicted_first(run_script):
+    result = run_script(EVICTION)
+
+    # "b" и "c" не запрашивались после "a", поэтому уходят первыми
+    assert result["keys"] == ["a", "d", "e"]
+    assert result["evictions"] == 2
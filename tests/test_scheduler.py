@@ -0,0 +1,215 @@
+import time
+import heapq
+import queue
+import threading
+from collections import deque
+from types import SimpleNamespace
+
+import pytest
+
+import scheduler
+import update_queue
+
+
+@pytest.fixture
+def fresh_scheduler(monkeypatch):
+    """Empty scheduler state with a global queue of two jobs and no workers running."""
+    monkeypatch.setattr(scheduler, "_classes", {scheduler.TEXT: scheduler._DrrClass(), scheduler.MEDIA: scheduler._DrrClass()})
+    monkeypatch.setattr(scheduler, "_running", {})
+    monkeypatch.setattr(scheduler, "_stats", {"completed": 0, "rejected": 0, "failed": 0})
+    monkeypatch.setattr(scheduler, "_waits", {scheduler.TEXT: deque(), scheduler.MEDIA: deque()})
+    monkeypatch.setattr(scheduler, "_media_running", 0)
+    monkeypatch.setattr(scheduler, "SCHEDULER_QUEUE_SIZE", 2)
+
+
+def take_job():
+    """Take one job off the queue the way a scheduler worker does (without leaving a thread behind)."""
+    with scheduler._cond:
+        job = scheduler._next_job()
+        scheduler._cond.notify_all()
+    return job
+
+
+def text_update(update_id):
+    return {"update_id": update_id, "message": {"text": "привет"}}
+
+
+def test_global_queue_cap_rejects_jobs_from_many_users(fresh_scheduler):
+    assert scheduler.submit(1, "text", lambda: None)
+    assert scheduler.submit(2, "text", lambda: None)
+
+    # Лимит на пользователя не достигнут, но общая очередь полна
+    assert not scheduler.submit(3, "text", lambda: None)
+    stats = scheduler.get_scheduler_stats()
+    assert stats["queued_text"] == 2
+    assert stats["rejected"] == 1
+
+
+def test_blocking_submit_waits_for_room(fresh_scheduler):
+    scheduler.submit(1, "text", lambda: None)
+    scheduler.submit(2, "text", lambda: None)
+
+    blocked = threading.Thread(target=scheduler.submit, args=(3, "text", lambda: None), kwargs={"block": True})
+    blocked.start()
+    time.sleep(0.1)
+    assert blocked.is_alive()
+
+    assert take_job().user_id == 1
+    blocked.join(timeout=2)
+    assert not blocked.is_alive()
+    stats = scheduler.get_scheduler_stats()
+    assert stats["queued_text"] == 2
+    assert stats["rejected"] == 0
+
+
+def test_full_scheduler_backs_up_into_webhook_queue(fresh_scheduler, monkeypatch):
+    monkeypatch.setattr(update_queue, "_queue", queue.PriorityQueue(maxsize=2))
+    monkeypatch.setattr(update_queue, "ENQUEUE_TIMEOUT", 0.05)
+    monkeypatch.setattr(update_queue, "stats", dict.fromkeys(update_queue.stats, 0))
+
+    # Как process_webhook_update в webhook-режиме: обработчик уходит в планировщик с block=True
+    def process(update):
+        scheduler.submit(update["update_id"], "text", lambda: None, block=True)
+
+    monkeypatch.setattr(update_queue, "_workers", [])
+    update_queue.start_workers(process, num_workers=1)
+    worker = update_queue._workers[0]
+    try:
+        check_webhook_backpressure()
+    finally:
+        # Освобождаем планировщик, чтобы рабочий поток дообработал очередь и завершился
+        monkeypatch.setattr(scheduler, "SCHEDULER_QUEUE_SIZE", 1000)
+        with scheduler._cond:
+            scheduler._cond.notify_all()
+        update_queue.stop_workers(timeout=2)
+    assert not worker.is_alive()
+
+
+def check_webhook_backpressure():
+    # Два обновления заполняют планировщик, третье держит рабочий поток, еще два — очередь обновлений
+    for update_id in range(5):
+        assert update_queue.submit(text_update(update_id))
+        time.sleep(0.05)
+
+    assert update_queue.get_queue_stats()["depth"] == 2
+    assert not update_queue.submit(text_update(5))  # webhook ответит 503
+    assert update_queue.submit({"update_id": 6, "message": {"photo": []}})  # медиа отбрасывается
+    stats = update_queue.get_queue_stats()
+    assert stats["rejected"] == 1
+    assert stats["shed"] == 1
+
+
+# Время выполнения задач в симуляции (условные секунды)
+DURATIONS = {"text": 1, "photo": 2, "voice": 2, "video": 4, "video_note": 4}
+
+
+def simulate(arrivals, workers, monkeypatch):
+    """
+    Run the scheduler against a simulated clock instead of real threads.
+
+    Args:
+        arrivals (list): (time, user_id, kind) tuples
+        workers (int): Number of simulated worker threads
+
+    Returns:
+        list: (start time, user_id, kind) of every job in the order it started
+    """
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(scheduler, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    monkeypatch.setattr(scheduler, "SCHEDULER_QUEUE_SIZE", 1000)
+    monkeypatch.setattr(scheduler, "SCHEDULER_USER_QUEUE", 1000)
+
+    arrivals = sorted(arrivals, key=lambda arrival: arrival[0])
+    running = []  # heap of (finish time, sequence, job)
+    started = []
+    sequence = 0
+    while True:
+        while arrivals and arrivals[0][0] <= clock.now:
+            _, user_id, kind = arrivals.pop(0)
+            assert scheduler.submit(user_id, kind, lambda: None)
+
+        with scheduler._cond:
+            while len(running) < workers:
+                job = scheduler._next_job()
+                if job is None:
+                    break
+                scheduler._start_job(job)
+                started.append((clock.now, job.user_id, job.kind))
+                heapq.heappush(running, (clock.now + DURATIONS[job.kind], sequence, job))
+                sequence += 1
+                assert scheduler._media_running <= scheduler.SCHEDULER_MEDIA_WORKERS
+
+        next_times = [running[0][0]] if running else []
+        if arrivals:
+            next_times.append(arrivals[0][0])
+        if not next_times:
+            return started
+        clock.now = min(next_times)
+        with scheduler._cond:
+            while running and running[0][0] <= clock.now:
+                scheduler._finish_job(heapq.heappop(running)[2])
+
+
+def light_users_load(count=30, users=5, interval=1.0):
+    """Light users 100..100+users send one text each every ``interval`` in turn, starting after the flood."""
+    return [(0.5 + i * interval, 100 + i % users, "text") for i in range(count)]
+
+
+def test_light_users_keep_flat_wait_while_heavy_user_floods(fresh_scheduler, monkeypatch):
+    # Тяжелый пользователь мог бы занять все три потока; держит их свободными только лимит медиа
+    monkeypatch.setattr(scheduler, "SCHEDULER_USER_CONCURRENCY", 3)
+    monkeypatch.setattr(scheduler, "SCHEDULER_MEDIA_WORKERS", 2)
+
+    simulate(light_users_load(), workers=3, monkeypatch=monkeypatch)
+    baseline = scheduler.get_scheduler_stats()
+
+    monkeypatch.setattr(scheduler, "_waits", {scheduler.TEXT: deque(), scheduler.MEDIA: deque()})
+    # Один пользователь сразу присылает 30 видео, каждое занимает поток на 4 секунды
+    flood = [(0, 1, "video")] * 30
+    simulate(flood + light_users_load(), workers=3, monkeypatch=monkeypatch)
+    loaded = scheduler.get_scheduler_stats()
+
+    # Текст легких пользователей ждет не дольше, чем без нагрузки: медиа не занимает все потоки
+    assert loaded["text_p50"] <= baseline["text_p50"] + 0.5
+    assert loaded["text_p99"] <= baseline["text_p99"] + 1
+    # А видео тяжелого пользователя выстраиваются в очередь друг за другом
+    assert loaded["media_p99"] >= 50
+
+
+def test_drr_interleaves_light_users_with_heavy_burst(fresh_scheduler, monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULER_USER_CONCURRENCY", 1)
+    burst = [(0, 1, "text")] * 20
+    light = [(0, user_id, "text") for user_id in range(100, 105)]
+
+    started = simulate(burst + light, workers=1, monkeypatch=monkeypatch)
+
+    order = [user_id for _, user_id, _ in started]
+    # Пришедшие после пачки пользователи обслуживаются в первом же круге, а не после 20 сообщений
+    assert set(order[:6]) == {1, 100, 101, 102, 103, 104}
+    light_waits = [when for when, user_id, _ in started if user_id != 1]
+    assert max(light_waits) <= 5
+
+
+def test_text_goes_before_queued_media(fresh_scheduler, monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULER_MEDIA_WORKERS", 1)
+    media = [(0, user_id, "photo") for user_id in range(1, 5)]
+    text = [(0.5, 100, "text")]
+
+    started = simulate(media + text, workers=2, monkeypatch=monkeypatch)
+
+    # Медиа занимает не больше одного потока, и текст, пришедший позже, обгоняет очередь медиа
+    assert [kind for _, _, kind in started[:2]] == ["photo", "text"]
+    assert started[1][0] == 0.5
+    assert max(scheduler._waits[scheduler.TEXT]) == 0
+
+
+def test_messages_of_one_user_run_one_at_a_time_by_default(fresh_scheduler, monkeypatch):
+    assert scheduler.SCHEDULER_USER_CONCURRENCY == 1
+    arrivals = [(0, 1, "text"), (0, 1, "text"), (0, 1, "photo"), (0, 2, "text")]
+
+    started = simulate(arrivals, workers=3, monkeypatch=monkeypatch)
+
+    # Свободные потоки есть, но второе сообщение пользователя 1 ждет завершения первого
+    user_starts = [when for when, user_id, _ in started if user_id == 1]
+    assert user_starts == [0, 1, 2]
+    assert [when for when, user_id, _ in started if user_id == 2] == [0]
@@ -0,0 +1,93 @@
+import json
+import time
+import random
+import threading
+
+from sharded_state import ShardedDict
+
+THREADS = 8
+USERS = 500
+
+
+def run_contention(state, seconds=0.5, hold=0.0005):
+    """
+    Hammer the state from THREADS threads over mixed user IDs for ``seconds``.
+
+    Each operation is a read-modify-write of one user under ``state.lock(user_id)``
+    with a short pause inside the lock, like a handler that saves or serializes
+    the user's data while holding it.
+
+    Returns:
+        float: Completed operations per second
+    """
+    stop = time.monotonic() + seconds
+    done = [0] * THREADS
+
+    def worker(index):
+        rng = random.Random(index)
+        while time.monotonic() < stop:
+            user_id = rng.randrange(USERS)
+            with state.lock(user_id):
+                history = state.get(user_id) or []
+                time.sleep(hold)
+                state[user_id] = history[-9:] + [index]
+            done[index] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(done) / seconds
+
+
+def test_sharded_layout_beats_single_lock_under_contention():
+    # Один шард — это прежняя схема: один общий lock на весь словарь
+    single = run_contention(ShardedDict(num_shards=1))
+    sharded = run_contention(ShardedDict(num_shards=32))
+    print(f"single lock: {single:.0f} ops/s, 32 shards: {sharded:.0f} ops/s")
+
+    assert sharded >= 3 * single
+
+
+def test_snapshot_is_consistent_during_writes():
+    state = ShardedDict(num_shards=4)
+    for user_id in range(50):
+        state[user_id] = {"messages": [], "count": 0}
+
+    stop = threading.Event()
+    errors = []
+
+    def writer(seed):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            user_id = rng.randrange(50)
+            with state.lock(user_id):
+                value = state[user_id]
+                value["messages"].append({"text": "x" * rng.randrange(1, 20)})
+                time.sleep(0)  # переключение потока посреди многошагового обновления
+                value["count"] = len(value["messages"])
+                if len(value["messages"]) > 20:
+                    del value["messages"][:10]
+                    value["count"] = len(value["messages"])
+
+    writers = [threading.Thread(target=writer, args=(i,)) for i in range(4)]
+    for thread in writers:
+        thread.start()
+    try:
+        for _ in range(200):
+            try:
+                snapshot = state.snapshot(serializer=json.dumps)
+            except RuntimeError as e:  # "dictionary changed size during iteration"
+                errors.append(e)
+                continue
+            assert len(snapshot) == 50
+            for serialized in snapshot.values():
+                value = json.loads(serialized)
+                assert value["count"] == len(value["messages"])
+    finally:
+        stop.set()
+        for thread in writers:
+            thread.join()
+
+    assert errors == []
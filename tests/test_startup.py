@@ -0,0 +1,18 @@
+# Импорт бота в чистом интерпретаторе: время холодного старта и модули, которые должны грузиться лениво
+IMPORT_BOT = """
+import bot
+emit({
+    "seconds": bot.IMPORT_SECONDS,
+    "budget": bot.STARTUP_BUDGET_SECONDS,
+    "loaded": [name for name in ("openai", "tiktoken") if name in sys.modules],
+})
+"""
+
+
+def test_cold_start_fits_the_budget(run_script):
+    startup = run_script(IMPORT_BOT)
+    print(startup)
+
+    assert startup["seconds"] <= startup["budget"]
+    # SDK OpenAI и токенизатор создаются при первом запросе, а не при импорте
+    assert startup["loaded"] == []
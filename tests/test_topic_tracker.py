@@ -0,0 +1,81 @@
+import pytest
+
+import topic_tracker
+
+
+def test_extract_topic_words_skips_short_stop_and_numeric_words():
+    words = topic_tracker.extract_topic_words("Привет! Я очень люблю «Шахматы», футбол и 2024... это всё")
+
+    assert words == ["шахматы", "футбол"]
+
+
+def test_counters_never_exceed_capacity():
+    topics = {}
+    for i in range(100):
+        topic_tracker.record_topic(topics, f"слово{i}", capacity=5)
+
+    assert len(topics) == 5
+
+
+def test_space_saving_evicts_rarest_word_and_inherits_its_count():
+    topics = {}
+    for word in ["шахматы"] * 5 + ["футбол"] * 3 + ["гитара"]:
+        topic_tracker.record_topic(topics, word, capacity=3)
+
+    count, evicted = topic_tracker.record_topic(topics, "кофе", capacity=3)
+
+    # Новое слово занимает место самого редкого и получает его счетчик + 1 (верхняя оценка)
+    assert evicted == "гитара"
+    assert count == 2
+    assert topics == {"шахматы": 5, "футбол": 3, "кофе": 2}
+
+
+def test_frequent_topic_survives_a_stream_of_rare_words():
+    topics = {}
+    for i in range(200):
+        topic_tracker.record_topic(topics, "шахматы", capacity=4)
+        topic_tracker.record_topic(topics, f"редкое{i}", capacity=4)
+
+    assert topic_tracker.top_topics(topics, 1) == [("шахматы", 200)]
+
+
+def test_top_topics_are_most_frequent_first():
+    topics = {"кофе": 2, "шахматы": 9, "футбол": 5}
+
+    assert topic_tracker.top_topics(topics, 2) == [("шахматы", 9), ("футбол", 5)]
+    assert topic_tracker.top_topics({}, 5) == []
+
+
+def test_decay_halves_counters_every_half_life(monkeypatch):
+    monkeypatch.setattr(topic_tracker, "TOPIC_HALF_LIFE", 100)
+    topics = {"шахматы": 8, "футбол": 3}
+
+    topic_tracker.apply_decay(topics, 200)
+
+    assert topics == {"шахматы": 2, "футбол": 0.75}
+
+
+@pytest.mark.parametrize("half_life, elapsed", [(0, 1000), (100, 0), (100, -5)])
+def test_decay_is_a_no_op_when_disabled_or_no_time_passed(monkeypatch, half_life, elapsed):
+    monkeypatch.setattr(topic_tracker, "TOPIC_HALF_LIFE", half_life)
+    topics = {"шахматы": 8}
+
+    topic_tracker.apply_decay(topics, elapsed)
+
+    assert topics == {"шахматы": 8}
+
+
+def test_filter_topics_drops_stop_words_and_merges_variants():
+    topics = {"привет": 30, "«кофе»": 2, "кофе": 5, "2024": 4, "это": 9, "футбол": 3, "that": 7}
+
+    assert topic_tracker.filter_topics(topics)
+    assert topics == {"кофе": 7, "футбол": 3}
+    assert not topic_tracker.filter_topics(topics)
+
+
+def test_compact_topics_keeps_most_frequent_entries():
+    topics = {f"слово{i}": i for i in range(10)}
+
+    assert topic_tracker.compact_topics(topics, capacity=3)
+    assert topics == {"слово9": 9, "слово8": 8, "слово7": 7}
+    assert not topic_tracker.compact_topics(topics, capacity=3)
@@ -0,0 +1,46 @@
+import json
+
+# Импорт user_preferences открывает базу в ./user_data и один раз переносит туда старый JSON
+LOAD_STORED_USER = """
+import user_preferences
+emit(user_preferences._store.load_user("42"))
+"""
+
+
+def test_legacy_json_topics_are_filtered_during_migration(tmp_path, run_script):
+    legacy_topics = {"пожалуйста": 50, "спасибо": 40, "сейчас": 35, "шахматы": 3, "гитара!": 2, "1999": 8}
+    (tmp_path / "user_data").mkdir()
+    (tmp_path / "user_data" / "user_preferences.json").write_text(
+        json.dumps({"42": {"topics": legacy_topics, "personal_info": {}}}, ensure_ascii=False), encoding="utf-8"
+    )
+
+    stored = run_script(LOAD_STORED_USER)
+    assert stored["topics"] == {"шахматы": 3, "гитара": 2}
+
+
+# Первый процесс пишет и сбрасывает изменения, второй читает их из базы
+WRITE_AND_FLUSH = """
+import user_preferences
+user_preferences.update_user_preferences(7, "Меня зовут Анна, мне 30 лет. Обожаю шахматы")
+before_flush = user_preferences._store.load_user("7")
+user_preferences.save_preferences()
+emit({"before_flush": before_flush, "dirty": sorted(user_preferences._dirty_users)})
+"""
+
+RELOAD = """
+import user_preferences
+prefs = user_preferences.get_user_preferences(7)
+emit({"personal_info": prefs["personal_info"], "interaction_count": prefs["interaction_count"]})
+"""
+
+
+def test_flushed_preferences_are_reloaded_by_a_new_process(run_script):
+    flushed = run_script(WRITE_AND_FLUSH)
+    # Запись отложенная: до сброса в базе ничего нет
+    assert flushed == {"before_flush": None, "dirty": []}
+
+    reloaded = run_script(RELOAD)
+    assert reloaded == {
+        "personal_info": {"name": "Анна", "age": 30, "likes": ["шахматы"]},
+        "interaction_count": 1,
+    }
@@ -0,0 +1,153 @@
+import pytest
+
+import video_frames
+
+
+def segment(marker, payload):
+    """A JPEG marker segment: 0xFF, marker, 2-byte length (including itself), payload."""
+    return bytes([0xFF, marker]) + (len(payload) + 2).to_bytes(2, "big") + payload
+
+
+def jpeg(scan=b"\x12\x34", app=b"JFIF\x00"):
+    """Minimal synthetic JPEG: SOI, APP segment, SOF0, SOS header, entropy-coded data, EOI."""
+    return (
+        b"\xff\xd8"
+        + segment(0xE0, app)
+        + segment(0xC0, b"\x08\x00\x10\x00\x10\x01\x01\x11\x00")
+        + segment(0xDA, b"\x01\x01\x00\x00\x3f\x00")
+        + scan
+        + b"\xff\xd9"
+    )
+
+
+def inputs(cmd):
+    """Arguments given before each -i, one list per input."""
+    result, current = [], []
+    for i, arg in enumerate(cmd):
+        if arg == "-i":
+            result.append(current)
+            current = []
+        elif i > 0 and cmd[i - 1] == "-i":
+            continue
+        else:
+            current.append(arg)
+    return result
+
+
+def test_split_returns_each_image_whole():
+    images = [jpeg(b"\x01\x02"), jpeg(b"\x03\x04\x05"), jpeg(b"\x06")]
+
+    assert video_frames.split_jpeg_stream(b"".join(images)) == images
+
+
+def test_split_ignores_start_marker_inside_segments_and_scan_data():
+    # SOI внутри APP-сегмента (миниатюра EXIF) и экранированный 0xFF00, RST и заполнение в сжатых данных
+    thumbnail = b"\xff\xd8\xff\xd9"
+    first = jpeg(scan=b"\x10\xff\x00\xd8\xff\xd0\x20\xff", app=b"Exif\x00" + thumbnail)
+    second = jpeg()
+
+    assert video_frames.split_jpeg_stream(first + second) == [first, second]
+
+
+def test_split_drops_truncated_image_and_garbage():
+    complete = jpeg()
+    truncated = jpeg(b"\x01\x02\x03")[:-5]
+
+    assert video_frames.split_jpeg_stream(b"junk" + complete + b"\x00\x00" + truncated) == [complete]
+    assert video_frames.split_jpeg_stream(b"") == []
+    assert video_frames.split_jpeg_stream(b"\xff\xd8") == []
+
+
+def test_short_video_uses_accurate_seek_to_each_position():
+    cmd = video_frames.build_extract_command("video.mp4", 3, 30)
+
+    assert [args[-5:] for args in inputs(cmd)] == [
+        ["-ss", f"{position:.3f}", "-an", "-sn", "-dn"] for position in (5, 15, 25)
+    ]
+    assert "-skip_frame" not in cmd and "-noaccurate_seek" not in cmd
+    assert "concat=n=3:v=1:a=0" in cmd[cmd.index("-filter_complex") + 1]
+
+
+def test_long_video_takes_keyframe_before_each_position(monkeypatch):
+    monkeypatch.setattr(video_frames, "VIDEO_KEYFRAMES_ONLY_AFTER", 60)
+
+    cmd = video_frames.build_extract_command("video.mp4", 4, 400)
+
+    # Без -noaccurate_seek ffmpeg отбрасывает ключевой кадр перед точкой, и в конце видео сегменты пустые
+    assert [args[-8:] for args in inputs(cmd)] == [
+        ["-skip_frame", "nokey", "-noaccurate_seek", "-ss", f"{position:.3f}", "-an", "-sn", "-dn"]
+        for position in (50, 150, 250, 350)
+    ]
+
+
+def test_unknown_duration_samples_one_frame_per_second():
+    cmd = video_frames.build_extract_command("video.mp4", 5, 0)
+
+    assert len(inputs(cmd)) == 1
+    assert "fps=1,trim=end_frame=5" in cmd[cmd.index("-filter_complex") + 1]
+
+
+def test_hash_pipe_gets_its_own_output():
+    cmd = video_frames.build_extract_command("video.mp4", 3, 30, max_side=512, hash_fd=7)
+
+    graph = cmd[cmd.index("-filter_complex") + 1]
+    assert "split=2[full][small]" in graph
+    assert "min(512,iw)" in graph
+    assert cmd[-1] == "pipe:7"
+    assert cmd.count("-map") == 2
+
+
+@pytest.mark.parametrize("count, positions", [(1, [50.0]), (4, [12.5, 37.5, 62.5, 87.5])])
+def test_sample_positions_avoid_start_and_end(count, positions):
+    assert video_frames.sample_positions(100, count) == positions
+
+
+def test_missing_frames_are_counted(monkeypatch):
+    monkeypatch.setattr(video_frames, "VIDEO_FRAME_MIN_DISTANCE", 0)
+    monkeypatch.setattr(video_frames, "stats", dict.fromkeys(video_frames.stats, 0))
+    # ffmpeg вернул два кадра из трех
+    monkeypatch.setattr(video_frames, "_run_ffmpeg", lambda cmd, *fds: (jpeg(b"\x01") + jpeg(b"\x02"), b"", 0, b""))
+
+    frames = video_frames.extract_frames("video.mp4", num_frames=3, duration=30)
+
+    assert len(frames) == 2
+    assert video_frames.get_frame_stats()["missing"] == 1
+
+
+def test_dhash_sets_a_bit_where_brightness_increases():
+    rising = bytes(range(9)) * 8
+    falling = bytes(range(8, -1, -1)) * 8
+
+    assert video_frames.dhash(rising) == 2 ** 64 - 1
+    assert video_frames.dhash(falling) == 0
+
+
+def test_near_identical_frames_are_sent_once():
+    talking_head = 0x0F0F_0F0F_0F0F_0F0F
+    # Каждый следующий кадр отличается от первого на 1-3 бита
+    hashes = [talking_head, talking_head ^ 0b1, talking_head ^ 0b101, talking_head ^ 0b111 << 20]
+    frames = [f"frame{i}" for i in range(len(hashes))]
+
+    assert video_frames.select_distinct(frames, hashes, num_frames=3, min_distance=10) == ["frame0"]
+
+
+def test_distinct_frames_keep_time_order_and_limit():
+    scenes = [0, 2 ** 64 - 1, 0x00FF_00FF_00FF_00FF, 0xFF00_FF00_FF00_FF00, 0x0F0F_0F0F_0F0F_0F0F]
+    # Между сменами сцен — почти такие же кадры, они отбрасываются
+    hashes = [value for scene in scenes for value in (scene, scene ^ 1)]
+    frames = [f"frame{i}" for i in range(len(hashes))]
+
+    selected = video_frames.select_distinct(frames, hashes, num_frames=3, min_distance=10)
+
+    # Остается по кадру на сцену, и из пяти сцен берутся первая, средняя и последняя
+    assert selected == ["frame0", "frame4", "frame8"]
+
+
+@pytest.mark.parametrize("count, num_frames, expected", [
+    (10, 5, [0, 2, 4, 7, 9]),
+    (10, 2, [0, 9]),
+    (10, 1, [5]),
+    (3, 5, [0, 1, 2]),
+])
+def test_thin_evenly_spreads_frames_over_the_video(count, num_frames, expected):
+    assert video_frames._thin_evenly(list(range(count)), num_frames) == expected
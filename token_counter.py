@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Подсчет токенов для оценки размера промпта.
+# Используется точный токенизатор модели из tiktoken; если его не удалось
+# загрузить (нет пакета или нет сети для скачивания словаря) — грубая оценка
+# по числу символов.
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Токенизатор загружается при первом подсчете: tiktoken при первом запуске
+# скачивает словарь, и это не должно задерживать старт бота
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+# Примерно столько символов приходится на один токен (для русского текста меньше, чем для английского)
+CHARS_PER_TOKEN = 3.0
+
+# Служебные токены на каждое сообщение в chat completions
+TOKENS_PER_MESSAGE = 4
+
+def _get_encoding():
+    """Load the gpt-4o tokenizer on first use (None if tiktoken is unavailable)."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("o200k_base")  # токенизатор gpt-4o
+                except Exception:
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+def count_tokens(text):
+    """
+    Count (or estimate) the number of tokens in a string.
+
+    Args:
+        text (str): Text to measure
+
+    Returns:
+        int: Number of tokens
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+def count_message_tokens(message):
+    """
+    Count tokens for a single chat message dict, including per-message overhead.
+
+    Only text content is counted; image parts are ignored.
+
+    Args:
+        message (dict): Message with 'role' and 'content' keys
+
+    Returns:
+        int: Number of tokens
+    """
+    content = message.get("content", "")
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return count_tokens(content) + TOKENS_PER_MESSAGE
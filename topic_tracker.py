@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Ограниченный подсчет частых тем пользователя (алгоритм Space-Saving).
+# Вместо словаря со всеми словами, которые пользователь когда-либо писал,
+# храним не более TOPIC_CAPACITY счетчиков. Новое слово при заполненной
+# таблице вытесняет самое редкое и наследует его счетчик + 1, поэтому частые
+# темы гарантированно остаются, а память на пользователя фиксирована.
+
+import os
+import heapq
+
+# Сколько счетчиков хранится на пользователя
+TOPIC_CAPACITY = int(os.getenv("TOPIC_CAPACITY", "50"))
+
+# Период полураспада счетчиков в секундах (0 — без затухания)
+TOPIC_HALF_LIFE = float(os.getenv("TOPIC_HALF_LIFE", "0"))
+
+# Минимальная длина слова, которое считается темой
+MIN_TOPIC_LENGTH = 4
+
+# Частые слова, которые ничего не говорят об интересах пользователя
+TOPIC_STOP_WORDS = {
+    "можно", "нужно", "надо", "этом", "этот", "эта", "это", "этого", "этой", "эти", "есть",
+    "меня", "тебя", "тебе", "себя", "него", "нему", "неё", "нее", "ними", "мной", "тобой",
+    "какой", "какая", "какое", "какие", "какую", "каким", "который", "которые", "которая",
+    "просто", "очень", "только", "когда", "чтобы", "тоже", "также", "если", "даже", "потом",
+    "сейчас", "здесь", "тут", "там", "была", "было", "были", "будет", "будешь", "буду",
+    "всех", "всего", "всем", "весь", "вообще", "ещё", "еще", "уже", "почему", "зачем",
+    "где", "куда", "откуда", "сколько", "много", "мало", "твой", "твоя", "твои", "мой",
+    "моя", "мои", "свой", "своя", "свои", "давай", "скажи", "пожалуйста", "спасибо",
+    "привет", "хорошо", "ладно", "знаешь", "думаешь", "сделать", "можешь", "хочу",
+    "люблю", "нравится", "зовут", "увлекаюсь", "занимаюсь",
+    "with", "that", "this", "what", "have", "from", "your", "about",
+}
+
+_STRIP_CHARS = ".,!?()[]{}:;\"'«»…-–—"
+
+def _normalize(word):
+    return word.strip(_STRIP_CHARS).lower()
+
+def _is_topic_word(word):
+    return len(word) >= MIN_TOPIC_LENGTH and word not in TOPIC_STOP_WORDS and not word.isdigit()
+
+def extract_topic_words(message_text):
+    """
+    Pick candidate topic words out of a message.
+
+    Args:
+        message_text (str): The text message from the user
+
+    Returns:
+        list: Lowercased words that are long enough and not stop words
+    """
+    words = []
+    for word in message_text.split():
+        word = _normalize(word)
+        if _is_topic_word(word):
+            words.append(word)
+    return words
+
+def apply_decay(topics, elapsed_seconds):
+    """
+    Scale all counters down according to TOPIC_HALF_LIFE.
+
+    Args:
+        topics (dict): {word: count}, modified in place
+        elapsed_seconds (float): Time since the counters were last decayed
+    """
+    if TOPIC_HALF_LIFE <= 0 or elapsed_seconds <= 0 or not topics:
+        return
+    factor = 0.5 ** (elapsed_seconds / TOPIC_HALF_LIFE)
+    for word in topics:
+        topics[word] = round(topics[word] * factor, 3)
+
+def record_topic(topics, word, capacity=TOPIC_CAPACITY):
+    """
+    Count one occurrence of a word using Space-Saving replacement.
+
+    Args:
+        topics (dict): {word: count}, modified in place
+        word (str): The topic word
+        capacity (int): Maximum number of counters
+
+    Returns:
+        tuple: (new count of the word, evicted word or None)
+    """
+    if word in topics:
+        topics[word] += 1
+        return topics[word], None
+
+    if len(topics) < capacity:
+        topics[word] = 1
+        return 1, None
+
+    # Table is full: the rarest word makes room and its count is inherited
+    evicted = min(topics, key=topics.get)
+    min_count = topics.pop(evicted)
+    topics[word] = min_count + 1
+    return topics[word], evicted
+
+def top_topics(topics, k):
+    """
+    Get the k most frequent topics from a bounded counter table.
+
+    Args:
+        topics (dict): {word: count}
+        k (int): How many topics to return
+
+    Returns:
+        list: (word, count) tuples, most frequent first
+    """
+    return heapq.nlargest(k, topics.items(), key=lambda x: x[1])
+
+def filter_topics(topics):
+    """
+    Apply the extract_topic_words filter to a (legacy) topics dict.
+
+    Old records were counted with a looser filter, so they hold stop words,
+    numbers and words with quotes or dashes attached. Such words are dropped
+    or normalized; counts of words that become equal are added up.
+
+    Args:
+        topics (dict): {word: count}, modified in place
+
+    Returns:
+        bool: True if anything was changed
+    """
+    filtered = {}
+    for word, count in topics.items():
+        word = _normalize(word)
+        if _is_topic_word(word):
+            filtered[word] = filtered.get(word, 0) + count
+    if filtered == topics:
+        return False
+    topics.clear()
+    topics.update(filtered)
+    return True
+
+def compact_topics(topics, capacity=TOPIC_CAPACITY):
+    """
+    Trim an oversized (legacy) topics dict down to its most frequent entries.
+
+    Args:
+        topics (dict): {word: count}, modified in place
+
+    Returns:
+        bool: True if anything was removed
+    """
+    if len(topics) <= capacity:
+        return False
+    keep = dict(top_topics(topics, capacity))
+    topics.clear()
+    topics.update(keep)
+    return True
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Ограниченная приоритетная очередь обновлений для webhook-режима.
+# Flask-сервер (keep_alive.py) кладет сюда обновления от Telegram и сразу
+# отвечает 200, а рабочие потоки забирают их и передают в TeleBot.
+
+import os
+import time
+import queue
+import logging
+import itertools
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Размер очереди и число рабочих потоков
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "500"))
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "5"))
+# Сколько секунд ждать свободного места для команд и текста перед отказом
+ENQUEUE_TIMEOUT = float(os.getenv("UPDATE_ENQUEUE_TIMEOUT", "0.5"))
+
+# Приоритеты: меньше — важнее
+PRIORITY_COMMAND = 0  # команды и нажатия кнопок
+PRIORITY_TEXT = 1     # обычные текстовые сообщения
+PRIORITY_MEDIA = 2    # фото, видео, голосовые
+PRIORITY_STOP = 3     # сигнал остановки рабочему потоку, после всех обновлений
+
+_queue = queue.PriorityQueue(maxsize=UPDATE_QUEUE_SIZE)
+_sequence = itertools.count()
+_stats_lock = threading.Lock()
+_workers = []
+
+stats = {
+    "accepted": 0,
+    "shed": 0,
+    "rejected": 0,
+    "processed": 0,
+    "errors": 0,
+    "total_wait": 0.0,
+}
+
+def classify_update(update):
+    """
+    Pick a priority for a raw Telegram update.
+
+    Args:
+        update (dict): Update JSON as sent by Telegram
+
+    Returns:
+        int: One of PRIORITY_COMMAND, PRIORITY_TEXT or PRIORITY_MEDIA
+    """
+    if "callback_query" in update:
+        return PRIORITY_COMMAND
+
+    message = update.get("message") or update.get("edited_message") or {}
+    text = message.get("text")
+    if text is not None:
+        return PRIORITY_COMMAND if text.startswith("/") else PRIORITY_TEXT
+    if any(key in message for key in ("photo", "video", "voice", "video_note", "audio", "document")):
+        return PRIORITY_MEDIA
+    return PRIORITY_TEXT
+
+def _count(key, value=1):
+    with _stats_lock:
+        stats[key] += value
+
+def submit(update):
+    """
+    Put an update into the work queue without blocking the HTTP request for long.
+
+    Media updates are shed immediately when the queue is full (Telegram still
+    gets 200, so it does not resend them). Commands and text wait up to
+    ENQUEUE_TIMEOUT for a free slot; if none appears the caller should answer
+    with a non-2xx status so Telegram redelivers the update later.
+
+    Args:
+        update (dict): Update JSON as sent by Telegram
+
+    Returns:
+        bool: True if the update was accepted or deliberately shed, False if it was rejected
+    """
+    priority = classify_update(update)
+    item = (priority, next(_sequence), time.monotonic(), update)
+
+    try:
+        if priority == PRIORITY_MEDIA:
+            _queue.put_nowait(item)
+        else:
+            _queue.put(item, timeout=ENQUEUE_TIMEOUT)
+    except queue.Full:
+        if priority == PRIORITY_MEDIA:
+            _count("shed")
+            logger.warning(f"Update queue is full, dropping media update {update.get('update_id')}")
+            return True
+        _count("rejected")
+        logger.warning(f"Update queue is full, asking Telegram to retry update {update.get('update_id')}")
+        return False
+
+    _count("accepted")
+    return True
+
+def _worker(process_update):
+    while True:
+        priority, _, enqueued_at, update = _queue.get()
+        if priority == PRIORITY_STOP:
+            _queue.task_done()
+            return
+        _count("total_wait", time.monotonic() - enqueued_at)
+        try:
+            process_update(update)
+            _count("processed")
+        except Exception as e:
+            _count("errors")
+            logger.error(f"Error processing update {update.get('update_id')}: {str(e)}")
+        finally:
+            _queue.task_done()
+
+def start_workers(process_update, num_workers=UPDATE_WORKERS):
+    """
+    Start daemon threads that drain the queue.
+
+    Args:
+        process_update (callable): Called with the raw update dict
+        num_workers (int): Number of worker threads
+    """
+    for i in range(num_workers):
+        thread = threading.Thread(target=_worker, args=(process_update,), name=f"update-worker-{i}", daemon=True)
+        thread.start()
+        _workers.append(thread)
+    logger.info(f"Started {num_workers} update workers (queue size {UPDATE_QUEUE_SIZE})")
+
+def stop_workers(timeout=None):
+    """
+    Stop the worker threads once the updates already queued are processed.
+
+    Args:
+        timeout (float, optional): How long to wait for each thread
+    """
+    for _ in _workers:
+        _queue.put((PRIORITY_STOP, next(_sequence), time.monotonic(), None))
+    for thread in _workers:
+        thread.join(timeout)
+    _workers.clear()
+
+def get_queue_stats():
+    """
+    Get a snapshot of queue metrics.
+
+    Returns:
+        dict: Current depth plus accepted/shed/rejected/processed counters and average wait in seconds
+    """
+    with _stats_lock:
+        snapshot = dict(stats)
+    snapshot["depth"] = _queue.qsize()
+    snapshot["capacity"] = UPDATE_QUEUE_SIZE
+    done = snapshot["processed"] + snapshot["errors"]
+    snapshot["avg_wait"] = snapshot["total_wait"] / done if done else 0.0
+    return snapshot
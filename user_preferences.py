@@ -3,8 +3,18 @@
 
 import json
 import os
+import hashlib
+import time
+import atexit
 import logging
+import itertools
+import threading
+from collections import OrderedDict
 from datetime import datetime
+from preferences_store import PreferencesStore
+from sharded_state import ShardedDict
+import topic_tracker
+from personal_info_extractor import extract_personal_info
 
 # Set up logging
 logging.basicConfig(
@@ -15,33 +25,284 @@ logger = logging.getLogger(__name__)
 # Path to store user preferences
 PREFERENCES_FOLDER = "user_data"
 PREFERENCES_FILE = os.path.join(PREFERENCES_FOLDER, "user_preferences.json")
+PREFERENCES_DB = os.path.join(PREFERENCES_FOLDER, "user_preferences.db")
+
+# Как часто (в секундах) изменившиеся пользователи сбрасываются в базу
+PREFERENCES_FLUSH_INTERVAL = float(os.getenv("PREFERENCES_FLUSH_INTERVAL", "5"))
 
 # Ensure the user data folder exists
 os.makedirs(PREFERENCES_FOLDER, exist_ok=True)
 
-# Initialize the preferences storage
-preferences = {}
+# In-memory cache of the users loaded so far (filled lazily from the store),
+# sharded so that handler threads working on different users do not contend
+preferences = ShardedDict()
+
+# Persistent storage and the set of users changed since the last flush
+_store = None
+_dirty_users = set()
+_dirty_lock = threading.Lock()
+_flush_thread_started = False
+
+# Для скольких недавно активных пользователей держать в памяти версии промпта и топ тем
+PROMPT_CACHE_USERS = int(os.getenv("PROMPT_CACHE_USERS", "10000"))
+
+# Версия данных пользователя, которые попадают в промпт. Меняется только когда
+# меняется отображаемая информация, чтобы prompt_builder мог кэшировать блок.
+# Версии берутся из общего счетчика: после вытеснения пользователь получает
+# новую версию, а не начинает с той, под которой уже лежит старый блок.
+# Structure: {user_id: int}, least recently used first
+_prompt_versions = OrderedDict()
+_version_counter = itertools.count(1)
+
+# Текущие 5 самых частых тем пользователя, пересчитываются из ограниченной
+# таблицы topic_tracker после каждого сообщения
+# Structure: {user_id: [(topic, count), ...]}, least recently used first
+_top_topics = OrderedDict()
+
+# Оба кэша общие для всех шардов preferences
+_user_caches_lock = threading.Lock()
+
+TOP_TOPICS_COUNT = 5
 
-# Try to load existing preferences
+# Сколько последних упоминаний хобби/симпатий/антипатий хранится на пользователя
+PERSONAL_INFO_MAX_ITEMS = int(os.getenv("PERSONAL_INFO_MAX_ITEMS", "5"))
+
+# Максимальная длина одного сохраненного упоминания (символов)
+PERSONAL_INFO_MAX_CHARS = 300
+
+PERSONAL_INFO_LISTS = ("hobbies", "likes", "dislikes")
+
+# Open the store and import the legacy JSON file on first start
 def load_preferences():
-    """Load user preferences from file."""
-    global preferences
+    """Open the preferences store; users are loaded lazily on first access."""
+    global _store, _flush_thread_started
     try:
-        if os.path.exists(PREFERENCES_FILE):
-            with open(PREFERENCES_FILE, 'r', encoding='utf-8') as f:
-                preferences = json.load(f)
+        _store = PreferencesStore(PREFERENCES_DB)
+        _store.import_json(PREFERENCES_FILE)
+        _compact_stored_users()
     except Exception as e:
         logger.error(f"Error loading user preferences: {e}")
-        preferences = {}
+    
+    preferences.clear()
+    with _user_caches_lock:
+        _top_topics.clear()
+    
+    if not _flush_thread_started:
+        threading.Thread(target=_flush_loop, name="preferences-flush", daemon=True).start()
+        atexit.register(save_preferences)
+        _flush_thread_started = True
+
+def _get_user(user_id):
+    """
+    Get a user's preferences from the cache, loading them from the store on first access.
+    
+    Returns:
+        dict: The user's preferences or None if the user is unknown
+    """
+    with preferences.lock(user_id):
+        user_pref = preferences.get(user_id)
+        if user_pref is None and _store is not None:
+            try:
+                user_pref = _store.load_user(user_id)
+            except Exception as e:
+                logger.error(f"Error loading preferences for user {user_id}: {e}")
+            if user_pref is not None:
+                # Старые записи могли накопить тысячи слов и повторов
+                if _compact_user(user_pref):
+                    _mark_dirty(user_id)
+                preferences[user_id] = user_pref
+                _bump_prompt_version(user_id)
+        return user_pref
+
+def _mention_key(text):
+    """Content hash used to detect repeated mentions."""
+    return hashlib.sha1(" ".join(text.casefold().split()).encode("utf-8")).hexdigest()
+
+def _append_mention(items, text):
+    """
+    Add a mention to a fixed-size, deduplicated list (oldest entries drop out).
+    
+    A repeated mention is moved to the end instead of being stored twice.
+    
+    Args:
+        items (list): hobbies, likes or dislikes list, modified in place
+        text (str): The message text
+        
+    Returns:
+        bool: True if the list changed
+    """
+    text = " ".join(text.split())[:PERSONAL_INFO_MAX_CHARS]
+    key = _mention_key(text)
+    if items and _mention_key(items[-1]) == key:
+        return False
+    
+    items[:] = [item for item in items if _mention_key(item) != key]
+    items.append(text)
+    del items[:-PERSONAL_INFO_MAX_ITEMS]
+    return True
 
-# Save preferences to file
+def _compact_user(user_pref):
+    """
+    Bring a stored user record within the size limits.
+    
+    Drops stop words from the topics table and trims it, then deduplicates and
+    caps the hobbies, likes and dislikes lists.
+    
+    Args:
+        user_pref (dict): The user's preferences, modified in place
+        
+    Returns:
+        bool: True if anything was changed
+    """
+    topics = user_pref.setdefault("topics", {})
+    # Стоп-слова убираются до обрезки, чтобы не занимать место настоящих тем
+    changed = topic_tracker.filter_topics(topics)
+    changed = topic_tracker.compact_topics(topics) or changed
+    personal_info = user_pref.get("personal_info", {})
+    
+    for key in PERSONAL_INFO_LISTS:
+        items = personal_info.get(key)
+        if not items:
+            continue
+        compacted = []
+        for item in items:
+            _append_mention(compacted, item)
+        if compacted != items:
+            personal_info[key] = compacted
+            changed = True
+    
+    return changed
+
+def _compact_stored_users():
+    """One-time migration: compact every user record already in the store."""
+    # v2: записи, сжатые до появления фильтра стоп-слов в темах, проходят миграцию еще раз
+    if _store.get_meta("users_compacted_v2"):
+        return
+    
+    compacted = {}
+    for user_id in _store.iter_user_ids():
+        user_pref = _store.load_user(user_id)
+        if user_pref is not None and _compact_user(user_pref):
+            compacted[user_id] = json.dumps(user_pref, ensure_ascii=False)
+    
+    _store.save_users(compacted)
+    _store.set_meta("users_compacted_v2", "1")
+    if compacted:
+        _store.vacuum()
+    logger.info(f"Compacted {len(compacted)} stored user records")
+
+def _mark_dirty(user_id):
+    with _dirty_lock:
+        _dirty_users.add(user_id)
+
+# Save changed preferences to the store
 def save_preferences():
-    """Save user preferences to file."""
+    """Write the users changed since the last flush to the store."""
+    global _dirty_users
+    with _dirty_lock:
+        dirty, _dirty_users = _dirty_users, set()
+    if not dirty or _store is None:
+        return
+    
     try:
-        with open(PREFERENCES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(preferences, f, ensure_ascii=False, indent=2)
+        # Each user is serialized under its own shard lock, so concurrent updates
+        # cannot change the dict while json.dumps walks it
+        _store.save_users(preferences.snapshot(
+            dirty, serializer=lambda user_pref: json.dumps(user_pref, ensure_ascii=False)
+        ))
     except Exception as e:
         logger.error(f"Error saving user preferences: {e}")
+        # Keep them dirty so the next flush retries
+        with _dirty_lock:
+            _dirty_users.update(dirty)
+
+def _flush_loop():
+    """Write-behind timer: periodically flush changed users."""
+    while True:
+        time.sleep(PREFERENCES_FLUSH_INTERVAL)
+        save_preferences()
+
+def _remember(cache, user_id, value):
+    """Store a per-user value in a bounded LRU cache (caller holds _user_caches_lock)."""
+    cache[user_id] = value
+    cache.move_to_end(user_id)
+    while len(cache) > PROMPT_CACHE_USERS:
+        cache.popitem(last=False)
+
+def _bump_prompt_version(user_id):
+    with _user_caches_lock:
+        _remember(_prompt_versions, user_id, next(_version_counter))
+
+def get_preferences_version(user_id):
+    """
+    Get the version of the user's prompt-relevant data.
+    
+    The version changes whenever personal info or the top topics change, so
+    callers can cache anything derived from them.
+    
+    Args:
+        user_id: The unique ID of the user
+        
+    Returns:
+        int: Current version (a new one if the user's version is not in memory)
+    """
+    user_id = str(user_id)
+    with _user_caches_lock:
+        version = _prompt_versions.get(user_id)
+        if version is None:
+            version = next(_version_counter)
+            _remember(_prompt_versions, user_id, version)
+        else:
+            _prompt_versions.move_to_end(user_id)
+        return version
+
+def get_top_topics(user_id):
+    """
+    Get the user's most frequent topics.
+    
+    Args:
+        user_id: The unique ID of the user
+        
+    Returns:
+        list: Up to TOP_TOPICS_COUNT (topic, count) tuples, most frequent first
+    """
+    user_id = str(user_id)
+    with preferences.lock(user_id):
+        with _user_caches_lock:
+            top = _top_topics.get(user_id)
+            if top is not None:
+                _top_topics.move_to_end(user_id)
+                return list(top)
+        topics = (_get_user(user_id) or {}).get("topics", {})
+        top = topic_tracker.top_topics(topics, TOP_TOPICS_COUNT)
+        with _user_caches_lock:
+            _remember(_top_topics, user_id, top)
+        return list(top)
+
+def _update_topics(user_id, message_text):
+    """
+    Count the message's topic words in the user's bounded topic table.
+    
+    Returns:
+        bool: True if the list of top topics changed
+    """
+    user_pref = preferences[user_id]
+    topics = user_pref.setdefault("topics", {})
+    old_order = [topic for topic, _ in get_top_topics(user_id)]
+    
+    # Optional time decay so that old interests fade out
+    now = time.time()
+    topic_tracker.apply_decay(topics, now - user_pref.get("topics_decayed_at", now))
+    user_pref["topics_decayed_at"] = now
+    
+    for word in topic_tracker.extract_topic_words(message_text):
+        topic_tracker.record_topic(topics, word)
+    
+    # The table holds at most TOPIC_CAPACITY entries, so this is O(capacity)
+    top = topic_tracker.top_topics(topics, TOP_TOPICS_COUNT)
+    with _user_caches_lock:
+        _remember(_top_topics, user_id, top)
+    return [topic for topic, _ in top] != old_order
 
 # Extract and store user preferences from conversation
 def update_user_preferences(user_id, message_text):
@@ -54,86 +315,48 @@ def update_user_preferences(user_id, message_text):
     """
     user_id = str(user_id)  # Ensure user_id is string
     
-    # Initialize user preferences if not exist
-    if user_id not in preferences:
-        preferences[user_id] = {
-            "first_interaction": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "topics": {},
-            "personal_info": {}
-        }
-    
-    # Update last interaction time
-    preferences[user_id]["last_interaction"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    # Update interaction count
-    preferences[user_id]["interaction_count"] = preferences[user_id].get("interaction_count", 0) + 1
-    
-    # Look for potential personal information to store
-    # This is a simple approach - more sophisticated extraction would require NLP
-    
-    # Check for name mentions
-    if "меня зовут" in message_text.lower() or "я" in message_text.lower() and "зовусь" in message_text.lower():
-        words = message_text.split()
-        name_idx = -1
-        
-        for i, word in enumerate(words):
-            if word.lower() == "зовут" or word.lower() == "зовусь":
-                name_idx = i + 1
-                break
-        
-        if name_idx >= 0 and name_idx < len(words):
-            name = words[name_idx].strip(".,!?")
-            if len(name) > 1 and name[0].isupper():  # Basic check for name validity
-                preferences[user_id]["personal_info"]["name"] = name
-    
-    # Check for age mentions
-    if "мне" in message_text.lower() and "лет" in message_text.lower():
-        words = message_text.split()
-        for i, word in enumerate(words):
-            if word.lower() == "мне" and i+1 < len(words):
-                potential_age = words[i+1].strip(".,!?")
-                if potential_age.isdigit() and 1 <= int(potential_age) <= 120:
-                    preferences[user_id]["personal_info"]["age"] = int(potential_age)
-    
-    # Check for hobby mentions
-    hobby_triggers = ["увлекаюсь", "люблю", "моё хобби", "мое хобби", "занимаюсь"]
-    for trigger in hobby_triggers:
-        if trigger in message_text.lower():
-            # Just store the full message for now, 
-            # could be enhanced with more sophisticated extraction
-            if "hobbies" not in preferences[user_id]["personal_info"]:
-                preferences[user_id]["personal_info"]["hobbies"] = []
-            preferences[user_id]["personal_info"]["hobbies"].append(message_text)
-            break
-    
-    # Check for preferences/likes
-    like_triggers = ["люблю", "нравится", "обожаю", "предпочитаю"]
-    for trigger in like_triggers:
-        if trigger in message_text.lower():
-            if "likes" not in preferences[user_id]["personal_info"]:
-                preferences[user_id]["personal_info"]["likes"] = []
-            preferences[user_id]["personal_info"]["likes"].append(message_text)
-            break
-    
-    # Check for dislikes
-    dislike_triggers = ["не люблю", "ненавижу", "не нравится"]
-    for trigger in dislike_triggers:
-        if trigger in message_text.lower():
-            if "dislikes" not in preferences[user_id]["personal_info"]:
-                preferences[user_id]["personal_info"]["dislikes"] = []
-            preferences[user_id]["personal_info"]["dislikes"].append(message_text)
-            break
-    
-    # Store message to topic analysis
-    # Here we simply tokenize and count words
-    topic_words = [word.strip(".,!?()[]{}:;\"'").lower() for word in message_text.split() if len(word) > 3]
-    for word in topic_words:
-        if word not in preferences[user_id]["topics"]:
-            preferences[user_id]["topics"][word] = 0
-        preferences[user_id]["topics"][word] += 1
-    
-    # Save preferences
-    save_preferences()
+    # All reads and writes for this user happen under its shard lock
+    with preferences.lock(user_id):
+        # Track whether anything shown in the prompt has changed
+        prompt_changed = False
+        
+        # Initialize user preferences if not exist
+        if _get_user(user_id) is None:
+            prompt_changed = True
+            preferences[user_id] = {
+                "first_interaction": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "topics": {},
+                "personal_info": {}
+            }
+        
+        # Update last interaction time
+        preferences[user_id]["last_interaction"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        # Update interaction count
+        preferences[user_id]["interaction_count"] = preferences[user_id].get("interaction_count", 0) + 1
+        
+        # Look for potential personal information to store (single pass over the message)
+        facts = extract_personal_info(message_text)
+        personal_info = preferences[user_id]["personal_info"]
+        
+        for key in ("name", "age"):
+            if key in facts:
+                personal_info[key] = facts[key]
+                prompt_changed = True
+        
+        for key in PERSONAL_INFO_LISTS:
+            if key in facts and _append_mention(personal_info.setdefault(key, []), facts[key]):
+                prompt_changed = True
+        
+        # Store message to topic analysis (bounded Space-Saving counters)
+        if _update_topics(user_id, message_text):
+            prompt_changed = True
+        
+        if prompt_changed:
+            _bump_prompt_version(user_id)
+        
+        # Persisted by the write-behind flush
+        _mark_dirty(user_id)
 
 def get_user_preferences(user_id):
     """
@@ -145,10 +368,74 @@ def get_user_preferences(user_id):
     Returns:
         dict: User's preferences or empty dict if not found
     """
+    return _get_user(str(user_id)) or {}
+
+def format_personal_info_for_prompt(user_id):
+    """
+    Format the cacheable part of the user block: the header and personal info.
+    
+    Args:
+        user_id: The unique ID of the user
+        
+    Returns:
+        str: Formatted personal info (empty string if the user is unknown)
+    """
     user_id = str(user_id)
-    if user_id in preferences:
-        return preferences[user_id]
-    return {}
+    with preferences.lock(user_id):
+        if _get_user(user_id) is None:
+            return ""
+        
+        user_pref = preferences[user_id]
+        result = "Информация о пользователе:\n"
+        
+        # Add personal info
+        if "personal_info" in user_pref and user_pref["personal_info"]:
+            if "name" in user_pref["personal_info"]:
+                result += f"- Имя пользователя: {user_pref['personal_info']['name']}\n"
+            
+            if "age" in user_pref["personal_info"]:
+                result += f"- Возраст: {user_pref['personal_info']['age']}\n"
+            
+            if "hobbies" in user_pref["personal_info"] and user_pref["personal_info"]["hobbies"]:
+                result += "- Пользователь упоминал интересы и хобби:\n"
+                for hobby in user_pref["personal_info"]["hobbies"][-3:]:  # Last 3 mentions
+                    result += f"  * {hobby}\n"
+            
+            if "likes" in user_pref["personal_info"] and user_pref["personal_info"]["likes"]:
+                result += "- Пользователь упоминал, что ему нравится:\n"
+                for like in user_pref["personal_info"]["likes"][-3:]:  # Last 3 mentions
+                    result += f"  * {like}\n"
+            
+            if "dislikes" in user_pref["personal_info"] and user_pref["personal_info"]["dislikes"]:
+                result += "- Пользователь упоминал, что ему не нравится:\n"
+                for dislike in user_pref["personal_info"]["dislikes"][-3:]:  # Last 3 mentions
+                    result += f"  * {dislike}\n"
+        
+        return result
+
+def format_interaction_count_for_prompt(user_id):
+    """Format the interaction counter line (changes on every message, so it is never cached)."""
+    user_pref = _get_user(str(user_id)) or {}
+    return f"- Количество взаимодействий с ботом: {user_pref.get('interaction_count', 0)}\n"
+
+def format_topics_for_prompt(user_id):
+    """
+    Format the user's most frequent topics.
+    
+    Args:
+        user_id: The unique ID of the user
+        
+    Returns:
+        str: Formatted topics (empty string if there are none)
+    """
+    topics = get_top_topics(user_id)
+    if not topics:
+        return ""
+    
+    result = "- Частые темы в разговорах:\n"
+    for topic, count in topics:
+        result += f"  * {topic}\n"
+    return result
 
 def format_user_preferences_for_prompt(user_id):
     """
@@ -161,47 +448,14 @@ def format_user_preferences_for_prompt(user_id):
         str: Formatted user preferences
     """
     user_id = str(user_id)
-    if user_id not in preferences:
+    if _get_user(user_id) is None:
         return ""
     
-    user_pref = preferences[user_id]
-    result = "Информация о пользователе:\n"
-    
-    # Add personal info
-    if "personal_info" in user_pref and user_pref["personal_info"]:
-        if "name" in user_pref["personal_info"]:
-            result += f"- Имя пользователя: {user_pref['personal_info']['name']}\n"
-        
-        if "age" in user_pref["personal_info"]:
-            result += f"- Возраст: {user_pref['personal_info']['age']}\n"
-        
-        if "hobbies" in user_pref["personal_info"] and user_pref["personal_info"]["hobbies"]:
-            result += "- Пользователь упоминал интересы и хобби:\n"
-            for hobby in user_pref["personal_info"]["hobbies"][-3:]:  # Last 3 mentions
-                result += f"  * {hobby}\n"
-        
-        if "likes" in user_pref["personal_info"] and user_pref["personal_info"]["likes"]:
-            result += "- Пользователь упоминал, что ему нравится:\n"
-            for like in user_pref["personal_info"]["likes"][-3:]:  # Last 3 mentions
-                result += f"  * {like}\n"
-        
-        if "dislikes" in user_pref["personal_info"] and user_pref["personal_info"]["dislikes"]:
-            result += "- Пользователь упоминал, что ему не нравится:\n"
-            for dislike in user_pref["personal_info"]["dislikes"][-3:]:  # Last 3 mentions
-                result += f"  * {dislike}\n"
-    
-    # Add interaction history
-    result += f"- Количество взаимодействий с ботом: {user_pref.get('interaction_count', 0)}\n"
-    
-    # Add top topics of interest
-    if "topics" in user_pref and user_pref["topics"]:
-        topics = sorted(user_pref["topics"].items(), key=lambda x: x[1], reverse=True)[:5]
-        if topics:
-            result += "- Частые темы в разговорах:\n"
-            for topic, count in topics:
-                result += f"  * {topic}\n"
-    
-    return result
+    return (
+        format_personal_info_for_prompt(user_id)
+        + format_interaction_count_for_prompt(user_id)
+        + format_topics_for_prompt(user_id)
+    )
 
 # Load preferences on module import
 load_preferences()
\ No newline at end of file
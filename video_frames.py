@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Извлечение кадров из видео за один запуск ffmpeg.
+# Раньше на каждый кадр запускался отдельный процесс ffmpeg (-ss <pos> -vframes 1),
+# то есть пять процессов подряд на одно видео. Теперь длительность берется из
+# Telegram (или одного вызова ffprobe), а один процесс ffmpeg перематывает к каждой
+# точке (-ss перед каждым входом), берет по одному кадру, склеивает их фильтром
+# concat и сразу уменьшает, поэтому в stdout идут небольшие JPEG. Фильтр fps по
+# всему видео оказался в ~10 раз медленнее: он декодирует каждый кадр.
+#
+# Тот же процесс ffmpeg отдает через второй pipe крошечные серые миниатюры 9x8,
+# по ним считается разностный хэш (dHash), и из кандидатов остаются только
+# непохожие кадры: статичное видео "говорящей головы" уходит в модель одним-двумя
+# кадрами вместо пяти одинаковых. У длинных видео кандидатов берется больше.
+
+import os
+import threading
+import logging
+import subprocess
+import media_worker
+
+logger = logging.getLogger(__name__)
+
+# Максимальная сторона кадра, отправляемого в модель (больше GPT-4o все равно уменьшит)
+VIDEO_FRAME_MAX_SIDE = int(os.getenv("VIDEO_FRAME_MAX_SIDE", "768"))
+
+# Качество JPEG для ffmpeg (2 — лучшее, 31 — худшее)
+VIDEO_FRAME_QUALITY = int(os.getenv("VIDEO_FRAME_QUALITY", "4"))
+
+# Для видео длиннее этого (в секундах) берутся ближайшие ключевые кадры без точной перемотки
+VIDEO_KEYFRAMES_ONLY_AFTER = float(os.getenv("VIDEO_KEYFRAMES_ONLY_AFTER", "60"))
+
+# Сколько секунд может длиться извлечение кадров
+VIDEO_FRAMES_TIMEOUT = float(os.getenv("VIDEO_FRAMES_TIMEOUT", "60"))
+
+# Во сколько раз больше точек-кандидатов проверять у длинных видео, где перемотка к ключевым
+# кадрам дешевая (у коротких точная перемотка к каждой лишней точке стоит столько же, сколько к нужной)
+VIDEO_FRAME_CANDIDATES = float(os.getenv("VIDEO_FRAME_CANDIDATES", "2"))
+
+# Минимальное расстояние Хэмминга между 64-битными dHash, чтобы кадры считались разными (0 — не отбирать)
+VIDEO_FRAME_MIN_DISTANCE = int(os.getenv("VIDEO_FRAME_MIN_DISTANCE", "10"))
+
+_JPEG_START = b"\xff\xd8"
+_SOS = 0xDA
+_EOI = 0xD9
+
+# Размер миниатюры для dHash: 9 столбцов дают 8 сравнений соседних пикселей в строке
+_HASH_WIDTH = 9
+_HASH_HEIGHT = 8
+_HASH_FRAME_SIZE = _HASH_WIDTH * _HASH_HEIGHT
+
+_stats_lock = threading.Lock()
+stats = {
+    "videos": 0,
+    "candidates": 0,
+    "selected": 0,
+    "missing": 0,
+}
+
+def probe_duration(video_path):
+    """
+    Get the video duration with ffprobe.
+
+    Args:
+        video_path (str): Path to the video file
+
+    Returns:
+        float: Duration in seconds, or 0 if it could not be determined
+    """
+    cmd = [
+        "ffprobe", "-v", "error", "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1", video_path,
+    ]
+    try:
+        result = media_worker.run(cmd, timeout=VIDEO_FRAMES_TIMEOUT)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"Failed to get video info: {e}")
+        return 0.0
+    if result.returncode != 0:
+        logger.warning(f"Failed to get video info: {result.stderr.decode('utf-8', 'replace').strip()}")
+        return 0.0
+    try:
+        return float(result.stdout.strip() or 0)
+    except ValueError:
+        return 0.0
+
+def _jpeg_end(data, start):
+    """
+    Find the end of the JPEG image starting with SOI at start by walking its markers.
+
+    Marker segments are skipped by their length, so an embedded thumbnail (EXIF)
+    does not end the image early; entropy-coded data is scanned for the next
+    marker, skipping stuffed 0xFF00 bytes and restart markers.
+
+    Returns:
+        int: Offset just past the EOI marker, or None if the image is truncated or malformed
+    """
+    position = start + 2
+    while True:
+        if position + 2 > len(data) or data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # Заполняющие байты 0xFF перед маркером
+            position += 1
+            continue
+        if marker == _EOI:
+            return position + 2
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            position += 2
+            continue
+        if position + 4 > len(data):
+            return None
+        length = int.from_bytes(data[position + 2:position + 4], "big")
+        position += 2 + length
+        if marker != _SOS:
+            continue
+        # Сжатые данные после SOS: ищем следующий маркер (0xFF00 — экранированный байт, RSTn — часть данных)
+        while True:
+            position = data.find(b"\xff", position)
+            if position == -1 or position + 1 >= len(data):
+                return None
+            following = data[position + 1]
+            if following == 0x00 or 0xD0 <= following <= 0xD7:
+                position += 2
+            elif following == 0xFF:
+                position += 1
+            else:
+                break
+
+def split_jpeg_stream(data):
+    """
+    Split concatenated JPEGs from ffmpeg's image2pipe output into SOI..EOI pairs.
+
+    Each image is parsed marker by marker, so SOI bytes inside a segment (an
+    EXIF thumbnail) do not split it. A truncated last image and garbage between
+    images are dropped.
+
+    Returns:
+        list: One bytes object per complete image
+    """
+    images = []
+    position = data.find(_JPEG_START)
+    while position != -1:
+        end = _jpeg_end(data, position)
+        if end is None:
+            # Обрезанное или испорченное изображение: ищем следующее начало
+            position = data.find(_JPEG_START, position + 2)
+            continue
+        images.append(data[position:end])
+        position = data.find(_JPEG_START, end)
+    return images
+
+def _scale_filter(max_side):
+    # Уменьшаем только большие кадры, сохраняя пропорции (четные размеры нужны mjpeg)
+    return (
+        f"scale='min({max_side},iw)':'min({max_side},ih)':force_original_aspect_ratio=decrease,"
+        "scale=trunc(iw/2)*2:trunc(ih/2)*2"
+    )
+
+def sample_positions(duration, num_frames):
+    """
+    Timestamps of num_frames evenly spaced samples: the middle of each equal segment.
+
+    The very first and last instants are avoided: the first frame is often black
+    and a seek to the exact end returns no frame at all.
+    """
+    return [duration * (i + 0.5) / num_frames for i in range(num_frames)]
+
+def build_extract_command(video_path, num_frames, duration, max_side=VIDEO_FRAME_MAX_SIDE, hash_fd=None):
+    """
+    Build the single ffmpeg command that samples num_frames frames.
+
+    Args:
+        video_path (str): Path to the video file
+        num_frames (int): Number of frames to sample
+        duration (float): Video duration in seconds (0 if unknown: one frame per second from the start)
+        max_side (int): Longest side of the output JPEGs
+        hash_fd (int, optional): File descriptor for the raw 9x8 grayscale thumbnails used for dHash
+
+    Returns:
+        list: ffmpeg arguments
+    """
+    cmd = ["ffmpeg", "-v", "error", "-nostdin"]
+    graph = []
+
+    if duration <= 0:
+        cmd += ["-an", "-sn", "-dn", "-i", video_path]
+        graph.append(f"[0:v]fps=1,trim=end_frame={num_frames},setpts=N/TB")
+    else:
+        # Длинное видео: ключевой кадр перед точкой, без декодирования кадров до нее. С точной
+        # перемоткой ffmpeg отбросил бы этот кадр, и у последних точек (после последнего
+        # ключевого кадра) не осталось бы ни одного кадра
+        keyframes_only = duration > VIDEO_KEYFRAMES_ONLY_AFTER
+        for i, position in enumerate(sample_positions(duration, num_frames)):
+            if keyframes_only:
+                cmd += ["-skip_frame", "nokey", "-noaccurate_seek"]
+            cmd += ["-ss", f"{position:.3f}", "-an", "-sn", "-dn", "-i", video_path]
+            graph.append(f"[{i}:v]trim=end_frame=1,setpts=PTS-STARTPTS[f{i}]")
+        inputs = "".join(f"[f{i}]" for i in range(num_frames))
+        # У склеенных кадров совпадают метки времени: нумеруем их заново
+        graph.append(f"{inputs}concat=n={num_frames}:v=1:a=0,setpts=N/TB")
+
+    if hash_fd is None:
+        graph[-1] += f",{_scale_filter(max_side)}[frames]"
+    else:
+        graph[-1] += f",split=2[full][small];[full]{_scale_filter(max_side)}[frames]"
+        graph.append(f"[small]scale={_HASH_WIDTH}:{_HASH_HEIGHT}:flags=area,format=gray[hashes]")
+
+    # passthrough: не даем ffmpeg выбрасывать или повторять кадры под частоту кадров
+    cmd += [
+        "-filter_complex", ";".join(graph),
+        "-map", "[frames]", "-vsync", "passthrough", "-q:v", str(VIDEO_FRAME_QUALITY),
+        "-f", "image2pipe", "-vcodec", "mjpeg", "pipe:1",
+    ]
+    if hash_fd is not None:
+        cmd += ["-map", "[hashes]", "-vsync", "passthrough", "-f", "rawvideo", f"pipe:{hash_fd}"]
+    return cmd
+
+def dhash(thumbnail):
+    """
+    Difference hash of a 9x8 grayscale thumbnail: one bit per pair of neighbouring pixels.
+
+    Args:
+        thumbnail (bytes): 72 grayscale pixels, row by row
+
+    Returns:
+        int: 64-bit hash
+    """
+    value = 0
+    for row in range(_HASH_HEIGHT):
+        offset = row * _HASH_WIDTH
+        for col in range(_HASH_WIDTH - 1):
+            value = (value << 1) | (thumbnail[offset + col] < thumbnail[offset + col + 1])
+    return value
+
+def select_distinct(frames, hashes, num_frames, min_distance=VIDEO_FRAME_MIN_DISTANCE):
+    """
+    Choose up to num_frames visually distinct frames, keeping their order in time.
+
+    A frame is kept if its dHash differs from every kept frame by at least
+    min_distance bits; if more than num_frames remain, they are thinned out
+    evenly so the whole video stays covered.
+
+    Args:
+        frames (list): Candidate JPEG frames in time order
+        hashes (list): dHash of each candidate
+        num_frames (int): Maximum number of frames to return
+        min_distance (int): Minimum Hamming distance between kept frames
+
+    Returns:
+        list: Selected frames
+    """
+    distinct = []
+    kept_hashes = []
+    for frame, frame_hash in zip(frames, hashes):
+        if all(bin(frame_hash ^ kept).count("1") >= min_distance for kept in kept_hashes):
+            distinct.append(frame)
+            kept_hashes.append(frame_hash)
+
+    return _thin_evenly(distinct, num_frames)
+
+def _thin_evenly(frames, num_frames):
+    """Keep num_frames of the frames, evenly spread over time (first and last included)."""
+    if len(frames) <= num_frames:
+        return frames
+    if num_frames == 1:
+        return [frames[len(frames) // 2]]
+    step = (len(frames) - 1) / (num_frames - 1)
+    return [frames[round(i * step)] for i in range(num_frames)]
+
+def _run_ffmpeg(cmd, hash_read_fd=None, hash_write_fd=None):
+    """Run ffmpeg in the media pool, returning (stdout, stderr, returncode, hash bytes)."""
+    hash_data = []
+    reader = None
+    if hash_read_fd is not None:
+        # Читаем миниатюры параллельно, чтобы заполненный pipe не остановил ffmpeg
+        def read_hashes():
+            with os.fdopen(hash_read_fd, "rb") as hash_pipe:
+                hash_data.append(hash_pipe.read())
+        reader = threading.Thread(target=read_hashes, daemon=True)
+        reader.start()
+
+    pass_fds = (hash_write_fd,) if hash_write_fd is not None else ()
+    try:
+        result = media_worker.run(cmd, timeout=VIDEO_FRAMES_TIMEOUT, pass_fds=pass_fds)
+    finally:
+        # media_worker закрывает наш конец записи, так что чтение завершится
+        if reader is not None:
+            reader.join()
+    return result.stdout, result.stderr, result.returncode, b"".join(hash_data)
+
+def extract_frames(video_path, num_frames=3, duration=None, max_side=VIDEO_FRAME_MAX_SIDE):
+    """
+    Sample up to num_frames visually distinct, downscaled JPEG frames with a single ffmpeg process.
+
+    Args:
+        video_path (str): Path to the video file
+        num_frames (int): Number of frames to sample
+        duration (float, optional): Duration hint (e.g. from Telegram); probed with ffprobe if missing
+        max_side (int): Longest side of the output JPEGs
+
+    Returns:
+        list: JPEG frames as bytes (empty if extraction failed)
+    """
+    if not duration or duration <= 0:
+        duration = probe_duration(video_path)
+        if duration <= 0:
+            logger.warning("Could not determine video duration, sampling from the start")
+
+    use_hashes = VIDEO_FRAME_MIN_DISTANCE > 0
+    candidates = num_frames
+    if use_hashes and duration > VIDEO_KEYFRAMES_ONLY_AFTER:
+        candidates = max(num_frames, round(num_frames * VIDEO_FRAME_CANDIDATES))
+
+    hash_read_fd = hash_write_fd = None
+    if use_hashes:
+        hash_read_fd, hash_write_fd = os.pipe()
+    cmd = build_extract_command(video_path, candidates, duration, max_side, hash_write_fd)
+    stdout, stderr, returncode, hash_data = _run_ffmpeg(cmd, hash_read_fd, hash_write_fd)
+    if returncode != 0:
+        logger.warning(f"ffmpeg frame extraction failed: {stderr.decode('utf-8', 'replace').strip()}")
+
+    frames = split_jpeg_stream(stdout)
+    if len(frames) < candidates:
+        logger.warning(f"ffmpeg returned {len(frames)} of {candidates} frames for {os.path.basename(video_path)}")
+    hashes = [
+        dhash(hash_data[offset:offset + _HASH_FRAME_SIZE])
+        for offset in range(0, len(hash_data) - _HASH_FRAME_SIZE + 1, _HASH_FRAME_SIZE)
+    ]
+    if use_hashes and len(hashes) == len(frames):
+        selected = select_distinct(frames, hashes, num_frames)
+    else:
+        # Без хэшей убираем хотя бы точные повторы (несколько точек попали на один ключевой кадр)
+        unique = [frame for i, frame in enumerate(frames) if i == 0 or frame != frames[i - 1]]
+        selected = _thin_evenly(unique, num_frames)
+
+    with _stats_lock:
+        stats["videos"] += 1
+        stats["candidates"] += len(frames)
+        stats["missing"] += max(0, candidates - len(frames))
+        stats["selected"] += len(selected)
+    return selected
+
+def get_frame_stats():
+    """
+    Get frame selection metrics.
+
+    Returns:
+        dict: videos processed, candidate frames extracted, requested frames ffmpeg
+              did not return and frames actually sent
+    """
+    with _stats_lock:
+        return dict(stats)